@@ -1,21 +1,49 @@
 import marshal
 import os
-import secrets
-import glob
+import threading
+import contextlib
+import collections.abc
 
 from . import exceptions as _except
-from . import polyfill
 
-from .table import Table
+from .table import Table, DEFAULT_CHECKPOINT_SIZE
 from .document import Document
-from .chunk import Chunk
+from .chunk import Chunk, CHUNK_FORMAT, LEGACY_CHUNK_FORMAT
 from .autogenerateid import AutoGenerateId
 from .console import Console
+from .cache import ChunkCache, open_readers
+from .scheduler import CommitScheduler, DEFAULT_COMMIT_WORKERS, DEFAULT_COMMIT_BACKLOG
+from .index import Index
+from .query_engine import QueryEngine
+from .aio import AsyncDatabase, AsyncTable
+from .query import Field, Query, Condition, And, Or, Not
+from .aggregate import Aggregation, Count, Sum, Avg, Min, Max, Distinct
+from .codec import get_codec, DEFAULT_CODEC
+from .storage import atomic_write, DURABILITY_MODES, DURABILITY_NONE, DURABILITY_BATCH
+from .shared import FileLock
+from .stats import Stats, Histogram
+from .transaction import Transaction, Snapshot
+from .partition import LAYOUTS, LAYOUT_APPEND, LAYOUT_HASH, parse_partition
 
 import atexit
 
 name = "tasho"
 
+# Everything `from tasho import *` gives, most of it re-exported from the submodules.
+__all__ = [
+    "Database", "Table", "Document", "Chunk", "AutoGenerateId", "Console", "Index", "QueryEngine",
+    "AsyncDatabase", "AsyncTable", "Field", "Query", "Condition", "And", "Or", "Not",
+    "Aggregation", "Count", "Sum", "Avg", "Min", "Max", "Distinct",
+    "ChunkCache", "CommitScheduler", "FileLock", "Stats", "Histogram", "Transaction", "Snapshot",
+    "TableMap", "TableSelector", "get_codec", "atomic_write", "parse_partition",
+    "DEFAULT_CHECKPOINT_SIZE", "CHUNK_FORMAT", "LEGACY_CHUNK_FORMAT", "DEFAULT_COMMIT_WORKERS", "DEFAULT_COMMIT_BACKLOG",
+    "DEFAULT_CODEC", "DURABILITY_MODES", "DURABILITY_NONE", "DURABILITY_BATCH", "LAYOUTS", "LAYOUT_APPEND", "LAYOUT_HASH",
+    "RUNTIME_OPTIONS",
+]
+
+# Options that can be changed every time the database is opened.
+RUNTIME_OPTIONS = ("cache_chunks", "cache_documents", "commit_workers", "commit_backlog", "multiprocess", "stats")
+
 
 class Database(): 
     """Database.new(String:database_file, **options) returns tasho.database.Database
@@ -28,10 +56,53 @@ class Database():
                 auto_commit=Bool:False
                     > Commits upon storing data
                         (useful for large insert ops)
+                wal_checkpoint=Int:4194304
+                    > Write-ahead log size in bytes after which
+                        the dirty chunks are written to disk.
+                cache_chunks=Int:None
+                    > Maximum number of chunks kept in memory,
+                        unlimited by default.
+                cache_documents=Int:None
+                    > Maximum number of documents kept in memory,
+                        unlimited by default.
+                durability=String:"batch"
+                    > "none" never fsyncs, "batch" fsyncs chunk and
+                        index files on checkpoint, "commit" also
+                        fsyncs the write-ahead log on every commit.
+                commit_workers=Int:2
+                    > Threads writing chunk files.
+                commit_backlog=Int:64
+                    > Chunk writes that can be queued before
+                        committing blocks until the disk catches up.
+                codec=String:"marshal"
+                    > How documents and internal files are stored:
+                        "marshal", "msgpack", optionally compressed
+                        with "+zlib" or "+lzma" (ex. "marshal+lzma").
+                table_codecs=Dict{String:String}:{}
+                    > Codec per table name, overrides `codec`.
+                layout=String:"append"
+                    > How new tables place documents: "append"
+                        fills chunks in insertion order, "hash"
+                        partitions keys by their hash and splits
+                        partitions as they grow.
+                table_layouts=Dict{String:String}:{}
+                    > Layout per table name, overrides `layout`.
+                multiprocess=Bool:False
+                    > Lets several processes open the database at
+                        once, every process has to enable it.
+                        Writers lock the table until their next
+                        commit, which makes the changes visible to
+                        the other processes.
+                stats=Bool:False
+                    > Collects the counters and latencies returned
+                        by Database.stats and Table.stats, can also
+                        be switched with Database.metrics.enable().
             
-        Database.open(String:database_file) returns tasho.database.Database
+        Database.open(String:database_file, **options) returns tasho.database.Database
 
-            Opens an existing Database database.
+            Opens an existing Database database. The cache_chunks, cache_documents,
+            commit_workers, commit_backlog, multiprocess and stats options can be
+            changed when opening.
 
 
         Database(directory, **options) returns tasho.database.Database
@@ -47,19 +118,44 @@ class Database():
             err = "Database '{}' already exists. Drop the database first.".format(directory)
             raise _except.DatabaseInitException(err)
 
+        durability = options.get("durability", DURABILITY_BATCH)
+        if durability not in DURABILITY_MODES:
+            err = "Unknown durability mode '{}', expected one of {}.".format(durability, DURABILITY_MODES)
+            raise _except.DatabaseInitException(err)
+
+        codec = get_codec(options.get("codec", DEFAULT_CODEC))
+        table_codecs = {x: get_codec(y).name for x, y in options.get("table_codecs", {}).items()}
+
+        layout = options.get("layout", LAYOUT_APPEND)
+        table_layouts = dict(options.get("table_layouts", {}))
+        for x in [layout] + list(table_layouts.values()):
+            _check_layout(x)
+
         os.mkdir(directory)
 
         properties = {
             "chunk_size": options.get("chunk_size", 8192),
             "table_index": options.get("table_index", "tables"),
-            "auto_commit": options.get("auto_commit", False)
+            "auto_commit": options.get("auto_commit", False),
+            "wal_checkpoint": options.get("wal_checkpoint", DEFAULT_CHECKPOINT_SIZE),
+            "durability": durability,
+            "cache_chunks": options.get("cache_chunks", None),
+            "cache_documents": options.get("cache_documents", None),
+            "commit_workers": options.get("commit_workers", DEFAULT_COMMIT_WORKERS),
+            "commit_backlog": options.get("commit_backlog", DEFAULT_COMMIT_BACKLOG),
+            "chunk_format": CHUNK_FORMAT,
+            "codec": codec.name,
+            "table_codecs": table_codecs,
+            "layout": layout,
+            "table_layouts": table_layouts,
+            "multiprocess": options.get("multiprocess", False),
+            "stats": options.get("stats", False)
         }
 
-        with open(os.path.join(directory, "properties"), "wb") as f:
-            marshal.dump(properties, f)
-
-        with open(os.path.join(directory, properties['table_index']), "wb") as f:
-            marshal.dump({}, f)
+        # The properties are always marshal, they say which codec the rest uses.
+        fsync = durability != DURABILITY_NONE
+        atomic_write(os.path.join(directory, "properties"), marshal.dumps(properties), fsync)
+        atomic_write(os.path.join(directory, properties['table_index']), codec.dumps({}), fsync)
 
         return Database(directory, **properties)
 
@@ -75,53 +171,207 @@ class Database():
         with open(os.path.join(directory, 'properties'), "rb") as f:
             properties = marshal.load(f)
 
+        for option in RUNTIME_OPTIONS:
+            if option in options:
+                properties[option] = options[option]
+
         return Database(directory, **properties)
 
 
-    def _load_internal(self, filename):
+    def _load_internal(self, filename, codec=None):
         with open(os.path.join(self._directory, filename), "rb") as f:
-            return marshal.load(f)
+            return (codec or self._codec).loads(f.read())
+
+
+    def _write_internal(self, filename, data, codec=None):
+        atomic_write(os.path.join(self._directory, filename),
+                     (codec or self._codec).dumps(data),
+                     self._durability != DURABILITY_NONE)
+
+
+    def _update_properties(self, **changes):
+        marshal_codec = get_codec("marshal")
+        with self.lock:
+            properties = self._load_internal("properties", marshal_codec)
+            properties.update(changes)
+            self._write_internal("properties", properties, marshal_codec)
+            self._options.update(changes)
+
+
+    def table_codec(self, table_name):
+        """
+        Database.table_codec(String:table_name) returns tasho.codec.Codec
+            Returns the codec used to store a table.
+        """
+        return get_codec(self._table_codecs.get(table_name, self._codec.name))
+
+
+    def table_layout(self, table_name):
+        """
+        Database.table_layout(String:table_name) returns String
+            Returns the layout a new table gets, "append" or "hash".
+        """
+        return self._table_layouts.get(table_name, self._layout)
+
 
+    def _key_directory_file(self, table_name):
+        return "{}.keys".format(table_name)
 
-    def _write_internal(self, filename, data):
-        with open(os.path.join(self._directory, filename), "wb") as f:
-            marshal.dump(data, f)
+
+    def _load_key_directory(self, table_name):
+        filename = self._key_directory_file(table_name)
+        if os.path.exists(os.path.join(self._directory, filename)):
+            return self._load_internal(filename, self.table_codec(table_name))
+        return None
 
 
     def __init__(self, directory, **options):
         self._options = options
         self._directory = directory
+        # Guards the table list, the table index and the properties file.
+        # Taken after a table's lock, never before it.
+        self.lock = threading.RLock()
+        self._durability = options.get('durability', DURABILITY_BATCH)
+        self._codec = get_codec(options.get('codec', DEFAULT_CODEC))
+        self._table_codecs = dict(options.get('table_codecs', {}))
+        self._layout = options.get('layout', LAYOUT_APPEND)
+        self._table_layouts = dict(options.get('table_layouts', {}))
+        self.cache = ChunkCache(options.get('cache_chunks'), options.get('cache_documents'))
+        self.metrics = Stats(options.get('stats', False), directory)
+        self.scheduler = CommitScheduler(options.get('commit_workers', DEFAULT_COMMIT_WORKERS),
+                                         options.get('commit_backlog', DEFAULT_COMMIT_BACKLOG))
+        # Databases created before the format was recorded use the legacy format.
+        self._chunk_format = options.get('chunk_format', LEGACY_CHUNK_FORMAT)
         self._table_index = self._load_internal(options['table_index'])
         self._database = {}
+        # Tables are only opened on first use, see Database.get_table.
         self._tables = {}
+        self._index_listing = None
+        self._checkpoint_size = options.get('wal_checkpoint', DEFAULT_CHECKPOINT_SIZE)
         self.commit_on_exit = True
-        for table_i, chunks in self._table_index.items():
-            self._tables[table_i] = Table(table_i, 
-                                          directory, 
-                                          chunks, 
-                                          self._options.get('auto_commit'),
-                                          self._options.get('chunk_size'), 
-                                          self)
-
-        atexit.register(self._atexit_cleanup)
+        self._query_engine = None
+        # Other processes may use the directory too, the table index is
+        # only read and written under the database file lock then.
+        self._multiprocess = options.get('multiprocess', False)
+        self._file_lock = FileLock(os.path.join(directory, "database.lock")) if self._multiprocess else None
+        _open_databases.append(self)
 
     def __repr__(self):
         return "<tasho.database: {}>".format(self._directory)
 
+    def _open_table(self, table_name, chunks):
+        # The chunk names say how an existing table is laid out,
+        # whichever process created it.
+        layout = LAYOUT_HASH if chunks and parse_partition(chunks[0]) else LAYOUT_APPEND
+        table = Table(table_name, 
+                      self._directory, 
+                      chunks, 
+                      self._options.get('auto_commit'),
+                      self._options.get('chunk_size'), 
+                      self,
+                      self._load_key_directory(table_name),
+                      self._checkpoint_size,
+                      self._durability,
+                      self.cache,
+                      self._chunk_format,
+                      self.table_codec(table_name),
+                      self.scheduler,
+                      layout,
+                      self.metrics.child(table_name))
+        table._recover_bulk_load()
+        if self._multiprocess:
+            # Catches up with the other processes and recovers their log if needed.
+            table.share()
+        else:
+            table._replay_wal()
+        return table
+
+    def _index_files(self, table_name):
+        # Index files of a table (<table>-<field>.index). The directory is
+        # listed once rather than globbed for every table, except in
+        # multi-process mode where other processes add and remove them.
+        with self.lock:
+            if self._index_listing is None or self._multiprocess:
+                self._index_listing = [x for x in os.listdir(self._directory) if x.endswith(".index")]
+            prefix = table_name + "-"
+            return [os.path.join(self._directory, x) for x in self._index_listing if x.startswith(prefix)]
+
+    def _index_lock(self):
+        return self._file_lock or contextlib.nullcontext()
+
+    def _reload_table_index(self):
+        if self._multiprocess:
+            self._table_index = self._load_internal(self._options['table_index'])
+
+    def close(self):
+        """
+        Database.close()
+            Checkpoints the open tables (unless commit_on_exit is off) and
+            stops the database's threads and worker processes. The exit
+            hook does the same for every database that wasn't closed.
+        """
+        self._atexit_cleanup()
+        if self in _open_databases:
+            _open_databases.remove(self)
+
     def _atexit_cleanup(self):
+        if self._query_engine:
+            self._query_engine.close()
+            self._query_engine = None
+
         if self.commit_on_exit:
-            dirties = []
-            for table in self._tables.values():
-                dirties.extend(table.dirty)
+            Console.log('Checkpointing tables.')
+            for table in list(self._tables.values()):
+                table.checkpoint()
+        self.scheduler.shutdown()
+
+    def flush(self, timeout=None):
+        """
+        Database.flush(Float:timeout) returns Bool
+            Commits every table and waits until all queued chunk
+            writes are on disk. Returns False on timeout.
+        """
+        for table in list(self._tables.values()):
+            table.commit()
+        return self.scheduler.flush(timeout)
 
-            for chunk in dirties:
-                print(f"Commiting {chunk}")
-                chunk.commit()
-            
-            Console.log('Waiting for commits to finish.')
-            for chunk in dirties:
-                chunk.commitQueue.join()
 
+    def stats(self):
+        """
+        Database.stats() returns Dict
+            Returns the counters and latency histograms of every table
+            added up, along with the chunk cache and commit queue usage
+            and the stats of each table (see Table.stats). open_readers
+            is process wide, see tasho.cache.ReaderCache.
+            Counters and latencies are only collected while stats are
+            enabled, with the `stats` option or Database.metrics.enable().
+            Database.metrics.add_hook(function(kind, name, value, table))
+            passes every recorded value on to an external metrics system.
+        """
+        stats = self.metrics.snapshot()
+        stats.update({
+            "enabled": self.metrics.enabled,
+            "chunk_cache": self.cache.stats(),
+            "open_readers": open_readers.stats(),
+            "commit_queue": self.scheduler.stats(),
+            "tables": {x: y.stats() for x, y in list(self._tables.items())},
+        })
+        return stats
+
+
+    def query_engine(self, worker_count):
+        """
+        Database.query_engine(Int:worker_count) returns tasho.query_engine.QueryEngine
+            Returns the worker pool used for parallel queries, the
+            pool is started on first use and kept until exit.
+        """
+        with self.lock:
+            if self._query_engine and self._query_engine.worker_count != worker_count:
+                self._query_engine.close()
+                self._query_engine = None
+            if not self._query_engine:
+                self._query_engine = QueryEngine(worker_count)
+            return self._query_engine
 
     @property
     def table(self):
@@ -129,6 +379,14 @@ class Database():
 
     @property
     def tables(self):
+        """
+        Database.tables returns tasho.TableMap
+            Every table by name, a table is opened when it's first looked up.
+        """
+        return TableMap(self)
+
+    @property
+    def open_tables(self):
         return self._tables
 
     def get_table(self, table_name):
@@ -137,27 +395,64 @@ class Database():
             Returns a table object. Creates a new table if it doesn't exist.
             You can also call the table though `Database.table.table_name`
         """
-        if table_name in self._tables:
-            return self._tables[table_name]
-        else:
-            return self.new_table(table_name)
-
-    def new_table(self, table_name):
-        if table_name in self._table_index:
-            raise _except.DatabaseInitException(
-                    "Table '{}' already exists. Drop the table first.".format(table_name))
-
-        table = Table(table_name, 
-                      self._directory, 
-                      [], 
-                      self._options.get('auto_commit'), 
-                      self._options.get('chunk_size'), 
-                      self)
-
-        table._new_chunk()
-        self._tables[table.name] = table
-        self.commit_table_index()
-        return table
+        table = self._tables.get(table_name, None)
+        if table is not None:
+            return table
+        with self.lock:
+            if table_name in self._tables:
+                return self._tables[table_name]
+            if table_name not in self._table_index:
+                with self._index_lock():
+                    self._reload_table_index()
+                    if table_name not in self._table_index:
+                        return self.new_table(table_name)
+            # Opened on first use, or created by another process.
+            table = self._tables[table_name] = self._open_table(table_name, self._table_index[table_name])
+            return table
+
+    def new_table(self, table_name, codec=None, layout=None):
+        """
+        Database.new_table(String:table_name, String:codec, String:layout) returns tasho.database.Table
+            Creates a new table, optionally stored with its own codec
+            or laid out differently than the database's default.
+        """
+        if layout is not None:
+            _check_layout(layout)
+        with self.lock, self._index_lock():
+            self._reload_table_index()
+            if table_name in self._table_index:
+                raise _except.DatabaseInitException(
+                        "Table '{}' already exists. Drop the table first.".format(table_name))
+
+            table = Table(table_name, 
+                          self._directory, 
+                          [], 
+                          self._options.get('auto_commit'), 
+                          self._options.get('chunk_size'), 
+                          self,
+                          {},
+                          self._checkpoint_size,
+                          self._durability,
+                          self.cache,
+                          self._chunk_format,
+                          codec or self.table_codec(table_name),
+                          self.scheduler,
+                          layout or self.table_layout(table_name),
+                          self.metrics.child(table_name))
+
+            if codec:
+                self._table_codecs[table_name] = table.codec.name
+                self._update_properties(table_codecs=self._table_codecs)
+            if layout:
+                self._table_layouts[table_name] = layout
+                self._update_properties(table_layouts=self._table_layouts)
+
+            table._new_chunk()
+            self._tables[table.name] = table
+            self.commit_table_index(table)
+            if self._multiprocess:
+                table.share()
+            return table
 
     def drop_table(self, table_name, drop_key):
         """
@@ -165,20 +460,111 @@ class Database():
             Deletes a table. You must supply the table's drop key
             which can be found through `Table.drop_key`.
         """
-        if table_name in self._table_index:
-            if self._tables[table_name].drop_key == drop_key:
-                chunks = self._table_index.pop(table_name)
-                table = self._tables.pop(table_name)
-                table.__is_dropped = True
-                for chunk in chunks:
-                    os.remove(os.path.join(self._directory, chunk))
-            else:
+        if table_name not in self._tables and table_name not in self._table_index:
+            return
+        table = self.get_table(table_name)
+        with table.lock.write():
+            if table.drop_key != drop_key:
                 raise _except.DatabaseOperationException("Wrong drop key.")
+            table._begin()
+            try:
+                with self.lock, self._index_lock():
+                    self._reload_table_index()
+                    chunks = set(self._table_index.pop(table_name, ())) | set(table.chunk_ids)
+                    self._tables.pop(table_name)
+                    self.metrics.remove_child(table.metrics)
+                    self._index_listing = None
+                    self._write_internal(self._options['table_index'], self._table_index)
+                    table.__is_dropped = True
+                    for chunk in chunks:
+                        chunk_path = os.path.join(self._directory, chunk)
+                        if os.path.exists(chunk_path):
+                            os.remove(chunk_path)
+                    table.wal.truncate()
+                    for chunk in table.chunks:
+                        self.cache.forget(chunk)
+                    for field in list(table.indexes):
+                        table.drop_index(field)
+                    key_file = os.path.join(self._directory, self._key_directory_file(table_name))
+                    if os.path.exists(key_file):
+                        os.remove(key_file)
+                    if table.shared and os.path.exists(table.shared.path):
+                        os.remove(table.shared.path)
+            finally:
+                if table.shared and table.shared.lock.held:
+                    table.shared.lock.release()
+
+
+    def commit_table_index(self, table=None):
+        """
+        Database.commit_table_index(tasho.database.Table:table)
+            Writes the list of tables and their chunks. In multi-process
+            mode only the given table's entry is replaced, the rest of
+            the index is re-read since other processes change it too.
+        """
+        with self.lock, self._index_lock():
+            if self._multiprocess:
+                self._reload_table_index()
+                if table is not None:
+                    self._table_index[table.name] = table.chunk_ids
+            else:
+                # Tables that were never opened keep their entry.
+                for x in self._tables.values():
+                    self._table_index[x.name] = x.chunk_ids
+            self._write_internal(self._options['table_index'], self._table_index)
+
+    def commit_key_directory(self, table):
+        """
+        Database.commit_key_directory(tasho.database.Table:table)
+            Writes the table's key -> chunk directory if it has changed.
+        """
+        with table.lock.write():
+            if table.key_directory_dirty:
+                self._write_internal(self._key_directory_file(table.name), table.key_directory, table.codec)
+                table.key_directory_dirty = False
+
 
+def _check_layout(layout):
+    if layout not in LAYOUTS:
+        err = "Unknown table layout '{}', expected one of {}.".format(layout, LAYOUTS)
+        raise _except.DatabaseInitException(err)
 
-    def commit_table_index(self):
-        self._table_index = {table.name: table.chunk_ids for table in self._tables.values()}
-        self._write_internal(self._options['table_index'], self._table_index)
+
+class TableMap(collections.abc.Mapping):
+    """TableMap(tasho.database.Database:database) returns tasho.TableMap
+
+            Read-only mapping of table names to tables, tables that
+            aren't open yet are opened as they are looked up."""
+
+    def __init__(self, database):
+        self.db = database
+
+    def __repr__(self):
+        return "<TashoDBTables Tables: {} Open: {}>".format(len(self), len(self.db._tables))
+
+    def __getitem__(self, table_name):
+        if table_name not in self:
+            raise KeyError(table_name)
+        return self.db.get_table(table_name)
+
+    def __contains__(self, table_name):
+        return table_name in self.db._tables or table_name in self.db._table_index
+
+    def __iter__(self):
+        return iter(list(self.db._table_index))
+
+    def __len__(self):
+        return len(self.db._table_index)
+
+
+_open_databases = []
+
+
+@atexit.register
+def _atexit_cleanup():
+    # One hook for every database rather than one registered per instance.
+    for database in list(_open_databases):
+        database._atexit_cleanup()
 
 
 class TableSelector():
@@ -186,13 +572,7 @@ class TableSelector():
         self.db = database
 
     def __getattr__(self, table_name):
-        if table_name in self.db._tables:
-            return self.db._tables[table_name]
-        else:
-            return self.db.new_table(table_name)
+        return self.db.get_table(table_name)
 
     def __getitem__(self, table_name):
-        if table_name in self.db._tables:
-            return self.db._tables[table_name]
-        else:
-            return self.db.new_table(table_name)
+        return self.db.get_table(table_name)
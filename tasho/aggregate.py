@@ -0,0 +1,219 @@
+from .index import sort_key, _hashable
+
+
+def _number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _order(value):
+    # Orderable values first, the rest after them in repr order.
+    return sort_key(value) or (3, repr(value))
+
+
+class Aggregation():
+    """Base class of the aggregations taken by Table.aggregate.
+
+            Every aggregation keeps a partial state that is built up one
+            document at a time and can be merged with the state of another
+            chunk, so chunks can be aggregated on their own, even in other
+            processes. Like in SQL, documents where the field is missing or
+            None are skipped."""
+
+    def __init__(self, field=None):
+        self.field = field
+
+    def __repr__(self):
+        return "{}({})".format(type(self).__name__, repr(self.field) if self.field is not None else "")
+
+    def initial(self):
+        return None
+
+    def add(self, state, value):
+        raise NotImplementedError
+
+    def merge(self, state, other):
+        raise NotImplementedError
+
+    def result(self, state):
+        return state
+
+
+class Count(Aggregation):
+    """Count(String:field) returns tasho.aggregate.Count
+
+            Number of documents, or of documents where the field is set."""
+
+    def initial(self):
+        return 0
+
+    def add(self, state, value):
+        return state + 1
+
+    def merge(self, state, other):
+        return state + other
+
+
+class Sum(Aggregation):
+    """Sum(String:field) returns tasho.aggregate.Sum
+
+            Sum of the numeric values of a field."""
+
+    def initial(self):
+        return 0
+
+    def add(self, state, value):
+        return state + value if _number(value) else state
+
+    def merge(self, state, other):
+        return state + other
+
+
+class Avg(Aggregation):
+    """Avg(String:field) returns tasho.aggregate.Avg
+
+            Mean of the numeric values of a field, None if there are none."""
+
+    def initial(self):
+        return (0, 0)
+
+    def add(self, state, value):
+        return (state[0] + value, state[1] + 1) if _number(value) else state
+
+    def merge(self, state, other):
+        return (state[0] + other[0], state[1] + other[1])
+
+    def result(self, state):
+        return state[0] / state[1] if state[1] else None
+
+
+class Min(Aggregation):
+    """Min(String:field) returns tasho.aggregate.Min
+
+            Smallest value of a field, ordered like an index orders them
+            (numbers before strings before bytes)."""
+
+    def add(self, state, value):
+        key = sort_key(value)
+        if key is None:
+            return state
+        if state is None or key < sort_key(state):
+            return value
+        return state
+
+    def merge(self, state, other):
+        return state if other is None else self.add(state, other)
+
+
+class Max(Min):
+    """Max(String:field) returns tasho.aggregate.Max
+
+            Largest value of a field, see Min."""
+
+    def add(self, state, value):
+        key = sort_key(value)
+        if key is None:
+            return state
+        if state is None or key > sort_key(state):
+            return value
+        return state
+
+
+class Distinct(Aggregation):
+    """Distinct(String:field) returns tasho.aggregate.Distinct
+
+            The distinct values of a field, unhashable values are skipped."""
+
+    def initial(self):
+        return set()
+
+    def add(self, state, value):
+        if _hashable(value):
+            state.add(value)
+        return state
+
+    def merge(self, state, other):
+        state |= other
+        return state
+
+    def result(self, state):
+        return sorted(state, key=_order)
+
+
+def group_fields(group_by):
+    if group_by is None:
+        return None
+    if isinstance(group_by, str):
+        return group_by
+    return tuple(group_by)
+
+
+def _group_value(document, field):
+    value = document.get(field, None)
+    return value if _hashable(value) else None
+
+
+def accumulate(items, aggregations, group_by=None, match=None):
+    """
+    accumulate(Iterable[(String/Int:id, Dict:document)]:items, List[tasho.aggregate.Aggregation]:aggregations,
+               String/List[String]:group_by, function(id, document):match) returns Dict
+
+    Returns the partial states of the aggregations for every group of
+    the matching documents. Documents without a hashable value for a
+    group field are grouped under None.
+    """
+    group_by = group_fields(group_by)
+    specs = [(i, x.field, x.add) for i, x in enumerate(aggregations)]
+    groups = {}
+    for key, document in items:
+        if match is not None and not match(key, document):
+            continue
+        if group_by is None:
+            group = None
+        elif isinstance(group_by, str):
+            group = _group_value(document, group_by)
+        else:
+            group = tuple(_group_value(document, x) for x in group_by)
+
+        states = groups.get(group, None)
+        if states is None:
+            states = groups[group] = [x.initial() for x in aggregations]
+        for i, field, add in specs:
+            if field is None:
+                states[i] = add(states[i], document)
+                continue
+            value = document.get(field, None)
+            if value is not None:
+                states[i] = add(states[i], value)
+    return groups
+
+
+def merge_groups(groups, other, aggregations):
+    """
+    merge_groups(Dict:groups, Dict:other, List[tasho.aggregate.Aggregation]:aggregations) returns Dict
+
+    Merges the partial states from accumulate of another chunk into groups.
+    """
+    for group, states in other.items():
+        mine = groups.get(group, None)
+        if mine is None:
+            groups[group] = states
+            continue
+        for i, aggregation in enumerate(aggregations):
+            mine[i] = aggregation.merge(mine[i], states[i])
+    return groups
+
+
+def group_results(groups, names, aggregations, group_by=None):
+    """
+    group_results(Dict:groups, List[String]:names, List[tasho.aggregate.Aggregation]:aggregations,
+                  String/List[String]:group_by) returns Dict
+
+    Turns the partial states into {name: value}, or {group: {name: value}} when grouped.
+    """
+    def finish(states):
+        return {name: x.result(state) for name, x, state in zip(names, aggregations, states)}
+
+    if group_by is None:
+        states = groups.get(None, None)
+        return finish(states if states is not None else [x.initial() for x in aggregations])
+    return {group: finish(states) for group, states in groups.items()}
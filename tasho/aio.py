@@ -0,0 +1,315 @@
+import asyncio
+import functools
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_BATCH_SIZE = 256
+DEFAULT_WORKERS = 4
+
+
+class AsyncDatabase():
+    """AsyncDatabase(tasho.database.Database:database, concurrent.futures.Executor:executor) returns tasho.aio.AsyncDatabase
+
+            asyncio front for a Database. Everything that touches the disk
+            (loading chunks, commits, scans) runs on the executor so the
+            event loop is never blocked, reads of chunks that are already
+            loaded are answered right away. Concurrent loads of the same
+            chunk share one read. Unless an executor is given, blocking work
+            runs on a pool of DEFAULT_WORKERS threads.
+
+        await AsyncDatabase.new(String:database_file, **options) returns tasho.aio.AsyncDatabase
+        await AsyncDatabase.open(String:database_file, **options) returns tasho.aio.AsyncDatabase
+
+            Same as Database.new and Database.open."""
+
+    def __init__(self, database, executor=None):
+        self.database = database
+        self._owns_executor = executor is None
+        self.executor = executor or ThreadPoolExecutor(DEFAULT_WORKERS, thread_name_prefix="tasho-io")
+        self._tables = {}
+        self._loading = {}
+        self.loads = 0
+        self.coalesced = 0
+
+    @classmethod
+    async def new(AsyncDatabase, directory, executor=None, **options):
+        from . import Database
+        return await AsyncDatabase._create(Database.new, directory, executor, **options)
+
+    @classmethod
+    async def open(AsyncDatabase, directory, executor=None, **options):
+        from . import Database
+        return await AsyncDatabase._create(Database.open, directory, executor, **options)
+
+    @classmethod
+    async def _create(AsyncDatabase, constructor, directory, executor, **options):
+        owns_executor = executor is None
+        executor = executor or ThreadPoolExecutor(DEFAULT_WORKERS, thread_name_prefix="tasho-io")
+        loop = asyncio.get_running_loop()
+        database = await loop.run_in_executor(executor, functools.partial(constructor, directory, **options))
+        self = AsyncDatabase(database, executor)
+        self._owns_executor = owns_executor
+        return self
+
+    def __repr__(self):
+        return "<tasho.aio: {}>".format(self.database._directory)
+
+    async def run(self, function, *args, **kwargs):
+        """
+        await AsyncDatabase.run(function:function, *args, **kwargs) returns Object
+
+        Runs a blocking call on the database's executor.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(function, *args, **kwargs))
+
+    async def tables(self):
+        """
+        await AsyncDatabase.tables() returns Dict[String:tasho.aio.AsyncTable]
+
+        Every table by name, the ones that aren't open yet are opened on the executor.
+        """
+        tables = await self.run(lambda: dict(self.database.tables.items()))
+        return {x: self._wrap(y) for x, y in tables.items()}
+
+    async def get_table(self, table_name):
+        """
+        await AsyncDatabase.get_table(String:table_name) returns tasho.aio.AsyncTable
+
+        Returns a table, creating it if it doesn't exist.
+        """
+        table = self.database.open_tables.get(table_name, None)
+        if table is not None:
+            return self._wrap(table)
+        # Opening reads the table's key directory and indexes.
+        return self._wrap(await self.run(self.database.get_table, table_name))
+
+    async def new_table(self, table_name, codec=None, layout=None):
+        return self._wrap(await self.run(self.database.new_table, table_name, codec, layout))
+
+    async def drop_table(self, table_name, drop_key):
+        await self.run(self.database.drop_table, table_name, drop_key)
+        self._tables.pop(table_name, None)
+
+    async def flush(self, timeout=None):
+        """
+        await AsyncDatabase.flush(Float:timeout) returns Bool
+
+        Same as Database.flush.
+        """
+        return await self.run(self.database.flush, timeout)
+
+    async def close(self):
+        """
+        await AsyncDatabase.close()
+
+        Flushes and closes the database, then stops the executor if it
+        was created here.
+        """
+        await self.flush()
+        await self.run(self.database.close)
+        self._tables.clear()
+        if self._owns_executor:
+            self.executor.shutdown(wait=True)
+
+    def stats(self):
+        return {"loads": self.loads, "coalesced": self.coalesced, "loading": len(self._loading)}
+
+    def _wrap(self, table):
+        wrapper = self._tables.get(table.name, None)
+        if wrapper is None or wrapper.table is not table:
+            wrapper = self._tables[table.name] = AsyncTable(self, table)
+        return wrapper
+
+    async def load_chunk(self, chunk):
+        """
+        await AsyncDatabase.load_chunk(tasho.chunk.Chunk:chunk)
+
+        Loads a chunk on the executor. Callers waiting on the same
+        chunk share a single read.
+        """
+        if chunk.is_loaded:
+            return
+        pending = self._loading.get(chunk, None)
+        if pending is None:
+            self.loads += 1
+            pending = asyncio.ensure_future(self.run(_load_chunk, chunk))
+            self._loading[chunk] = pending
+            pending.add_done_callback(lambda _: self._loading.pop(chunk, None))
+        else:
+            self.coalesced += 1
+        # One cancelled caller shouldn't cancel the read for the others.
+        await asyncio.shield(pending)
+
+
+def _load_chunk(chunk):
+    if not chunk.is_loaded:
+        chunk.initalize()
+
+
+class AsyncTable():
+    """AsyncTable(tasho.aio.AsyncDatabase:database, tasho.table.Table:table) returns tasho.aio.AsyncTable
+
+            Awaitable version of a Table, use AsyncDatabase.get_table to get one.
+            AsyncTable.query returns a result that can either be awaited
+            for the list of documents or iterated with `async for`, which
+            reads the table a batch at a time."""
+
+    def __init__(self, database, table):
+        self.database = database
+        self.table = table
+
+    def __repr__(self):
+        return "<TashoDBAsyncTable:{}>".format(self.table.name)
+
+    @property
+    def name(self):
+        return self.table.name
+
+    @property
+    def indexes(self):
+        return self.table.indexes
+
+    async def _ensure_loaded(self, key):
+        chunk = self.table.get_chunk(key)
+        if chunk is not None:
+            await self.database.load_chunk(chunk)
+
+    async def get(self, key):
+        """
+        await AsyncTable.get(String/Int:key) returns tasho.database.Document
+        """
+        return await self._read(self.table.get, key)
+
+    async def raw_get(self, key):
+        """
+        await AsyncTable.raw_get(String/Int:key) returns Dict
+        """
+        return await self._read(self.table.raw_get, key)
+
+    async def _read(self, function, key):
+        await self._ensure_loaded(key)
+        chunk = self.table.get_chunk(key)
+        if self.table.shared or (chunk is not None and not chunk.is_loaded):
+            # The chunk was evicted since it was loaded, or a shared table
+            # has to catch up with the other processes first.
+            return await self.database.run(function, key)
+        return function(key)
+
+    async def get_many(self, keys, as_dict=False, raw=False):
+        """
+        await AsyncTable.get_many(List[String/Int]:keys, Bool:as_dict, Bool:raw) returns List[tasho.database.Document]
+
+        Same as Table.get_many, chunks that aren't loaded are read on the executor.
+        """
+        return await self.database.run(self.table.get_many, keys, as_dict, raw)
+
+    async def insert(self, key, value):
+        """
+        await AsyncTable.insert(String/Int:key, Dict:value) returns tasho.database.Document
+        """
+        await self._ensure_loaded(key)
+        return await self.database.run(self.table.insert, key, value)
+
+    async def update(self, key, patch):
+        """
+        await AsyncTable.update(String/Int:key, Dict:patch) returns tasho.database.Document
+        """
+        await self._ensure_loaded(key)
+        return await self.database.run(self.table.update, key, patch)
+
+    async def update_many(self, query, patch):
+        """
+        await AsyncTable.update_many(tasho.query.Query/function(id, document):query, Dict:patch) returns Int
+        """
+        return await self.database.run(self.table.update_many, query, patch)
+
+    async def delete(self, key):
+        """
+        await AsyncTable.delete(String/Int:key) returns Bool
+        """
+        await self._ensure_loaded(key)
+        return await self.database.run(self.table.delete, key)
+
+    async def bulk_load(self, items):
+        return await self.database.run(self.table.bulk_load, items)
+
+    async def create_index(self, field):
+        return await self.database.run(self.table.create_index, field)
+
+    async def drop_index(self, field):
+        return await self.database.run(self.table.drop_index, field)
+
+    async def commit(self):
+        return await self.database.run(self.table.commit)
+
+    async def checkpoint(self):
+        return await self.database.run(self.table.checkpoint)
+
+    async def compact(self, threshold=None):
+        """
+        await AsyncTable.compact(Float:threshold) returns Dict
+
+        Runs Table.compact in the background, reads of loaded chunks
+        keep being answered meanwhile.
+        """
+        if threshold is None:
+            return await self.database.run(self.table.compact)
+        return await self.database.run(self.table.compact, threshold)
+
+    def query(self, query, batch_size=DEFAULT_BATCH_SIZE, **options):
+        """
+        AsyncTable.query(tasho.query.Query/function(id, document):query, Int:batch_size, **options) returns tasho.aio.AsyncResult
+
+        Takes the same options as Table.query.
+        Ex. documents = await table.query(tasho.Field('age') > 50, limit=20)
+            async for document in table.query(tasho.Field('age') > 50, order_by='age'):
+                ...
+        """
+        return AsyncResult(self, query, batch_size, options)
+
+    async def aggregate(self, query=None, group_by=None, parallel=None, **aggregations):
+        """
+        await AsyncTable.aggregate(tasho.query.Query/function(id, document):query, String/List[String]:group_by,
+                                   Int:parallel, **tasho.aggregate.Aggregation) returns Dict
+        """
+        return await self.database.run(self.table.aggregate, query, group_by, parallel, **aggregations)
+
+    async def query_one(self, query):
+        return await self.database.run(self.table.query_one, query)
+
+    def explain(self, query):
+        return self.table.explain(query)
+
+
+class AsyncResult():
+    """AsyncResult(tasho.aio.AsyncTable:table, tasho.query.Query/function(id, document):query, Int:batch_size, Dict:options) returns tasho.aio.AsyncResult
+
+            Pending Table.query, awaiting it returns the whole list while
+            `async for` pulls batch_size documents at a time from a lazy query."""
+
+    def __init__(self, table, query, batch_size, options):
+        self.table = table
+        self.query = query
+        self.batch_size = batch_size
+        self.options = options
+
+    def __await__(self):
+        options = dict(self.options, lazy=False)
+        return self.table.database.run(self.table.table.query, self.query, **options).__await__()
+
+    async def __aiter__(self):
+        run = self.table.database.run
+        options = dict(self.options, lazy=True)
+        results = await run(self.table.table.query, self.query, **options)
+        while True:
+            # The generator is only ever advanced from one executor call at a time.
+            batch = await run(_take, results, self.batch_size)
+            for document in batch:
+                yield document
+            if len(batch) < self.batch_size:
+                return
+
+
+def _take(iterator, count):
+    return list(itertools.islice(iterator, count))
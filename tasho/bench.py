@@ -0,0 +1,529 @@
+"""Benchmarks a table across chunk sizes and table sizes.
+
+    python -m tasho.bench [--sizes 10000,100000] [--chunk-sizes 1024,8192,32768] [--tables 10,100,1000]
+                          [--parallel 2] [--codecs marshal,msgpack+zlib] [--durability none,batch,commit]
+                          [--processes 4 [--process-seconds 10]] [--output results.json]
+
+Every case builds a fresh database in a temporary directory from the same
+seeded data, so two runs of the same version measure the same work. The
+results are written as JSON, to stdout unless --output is given, with
+progress going to stderr. Every case times the same scans serially and
+over --parallel worker processes, the codec and durability cases store
+the first table size with each codec and durability mode. --processes
+also runs readers and writers in that many processes against one
+multi-process database, and exits with an error if any of them lost a
+write or read a stale document.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from . import Database, Field, Console
+from . import codec as _codec
+from .codec import DEFAULT_CODEC
+from .storage import DURABILITY_NONE, DURABILITY_MODES
+from .partition import LAYOUTS, LAYOUT_APPEND
+
+BENCH_FORMAT = 1
+DEFAULT_SIZES = (10000, 100000)
+DEFAULT_CHUNK_SIZES = (1024, 8192, 32768)
+DEFAULT_OPERATIONS = 1000
+DEFAULT_QUERIES = 10
+DEFAULT_COMMITS = 20
+DEFAULT_TABLE_COUNTS = (10, 100, 1000)
+STARTUP_DOCUMENTS = 100
+DEFAULT_PROCESS_SECONDS = 10
+PROCESS_SHARED = 500
+DEFAULT_PARALLEL = 2
+DEFAULT_CODECS = tuple(x + y for x in _codec.SERIALIZERS for y in ("", "+zlib", "+lzma"))
+GROUPS = 100
+
+
+def _document(rng, n):
+    return {
+        "group": rng.randrange(GROUPS),
+        "score": rng.random(),
+        "name": "document-{}".format(n),
+        "tags": [rng.randrange(1000) for _ in range(3)],
+        "payload": "%032x" % rng.getrandbits(128),
+    }
+
+
+def _summary(samples, elapsed=None):
+    """
+    _summary(List[Float]:samples, Float:elapsed) returns Dict
+
+    Seconds per operation, `elapsed` is the wall time of the whole run
+    when it isn't just the sum of the samples.
+    """
+    samples = sorted(samples)
+    total = elapsed if elapsed is not None else sum(samples)
+    count = len(samples)
+    return {
+        "count": count,
+        "seconds": total,
+        "ops_per_second": count / total if total else None,
+        "mean": sum(samples) / count if count else None,
+        "p50": samples[count // 2] if count else None,
+        "p99": samples[min(count - 1, count * 99 // 100)] if count else None,
+        "max": samples[-1] if count else None,
+    }
+
+
+def _rate(count, seconds):
+    return {"count": count, "seconds": seconds, "ops_per_second": count / seconds if seconds else None}
+
+
+def _timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+def _unload(table):
+    # Checkpointed first, so every chunk matches its file.
+    table.checkpoint()
+    table.db.flush()
+    for chunk in table.chunks:
+        if table.cache:
+            table.cache.forget(chunk)
+        chunk.unload()
+
+
+def _chunk_bytes(table):
+    return sum(os.path.getsize(x.chunk_path) for x in table.chunks if os.path.exists(x.chunk_path))
+
+
+def run_case(directory, chunk_size, size, operations=DEFAULT_OPERATIONS, queries=DEFAULT_QUERIES,
+             commits=DEFAULT_COMMITS, codec=DEFAULT_CODEC, layout=LAYOUT_APPEND, parallel=DEFAULT_PARALLEL, seed=0):
+    """
+    run_case(String:directory, Int:chunk_size, Int:size, Int:operations, Int:queries, Int:commits,
+             String:codec, String:layout, Int:parallel, Int:seed) returns Dict
+
+    Benchmarks one table of `size` documents stored in chunks of `chunk_size`.
+    The database is created under `directory` and removed afterwards.
+    Unless `parallel` is 0, the scans are also timed with nothing loaded,
+    serially and over that many worker processes.
+    """
+    rng = random.Random(seed)
+    items = [(n, _document(rng, n)) for n in range(size)]
+    path = os.path.join(directory, "bench-{}-{}".format(chunk_size, size))
+    results = {"chunk_size": chunk_size, "size": size}
+
+    database = Database.new(path, chunk_size=chunk_size, codec=codec, layout=layout)
+    database.commit_on_exit = False
+    try:
+        table = database.table.Bench
+
+        elapsed, _ = _timed(lambda: (table.bulk_load(items), database.flush()))
+        results["bulk_insert"] = _rate(size, elapsed)
+
+        samples = []
+        start = time.perf_counter()
+        for n in range(size, size + operations):
+            document = _document(rng, n)
+            began = time.perf_counter()
+            table.insert(n, document)
+            samples.append(time.perf_counter() - began)
+        database.flush()
+        results["single_insert"] = _summary(samples, time.perf_counter() - start)
+
+        # A commit appends a few changes to the write-ahead log,
+        # a checkpoint writes the chunks they touched.
+        samples, checkpoints = [], []
+        for _ in range(commits):
+            for _ in range(10):
+                n = rng.randrange(size)
+                table.insert(n, _document(rng, n))
+            samples.append(_timed(database.flush)[0])
+            checkpoints.append(_timed(lambda: (table.checkpoint(), database.flush()))[0])
+        results["commit"] = _summary(samples)
+        results["checkpoint"] = _summary(checkpoints)
+
+        keys = [rng.randrange(size) for _ in range(operations)]
+        samples = [_timed(table.raw_get, x)[0] for x in keys]
+        results["point_get"] = _summary(samples)
+
+        # Changes one field, only that gets logged.
+        samples = [_timed(table.update, x, {"$inc": {"score": 1}})[0] for x in keys]
+        database.flush()
+        results["update"] = _summary(samples)
+
+        groups = [rng.randrange(GROUPS) for _ in range(queries)]
+        samples = [_timed(table.query, Field("group") == x)[0] for x in groups]
+        results["scan_query"] = _summary(samples)
+
+        if parallel:
+            # Starting the workers isn't part of the first query.
+            database.query_engine(parallel)
+            serial, split = [], []
+            for x in groups:
+                _unload(table)
+                serial.append(_timed(table.query, Field("group") == x)[0])
+                _unload(table)
+                split.append(_timed(lambda: table.query(Field("group") == x, parallel=parallel))[0])
+            results["parallel_query"] = {"workers": parallel, "serial": _summary(serial), "parallel": _summary(split)}
+
+        results["create_index"] = _timed(table.create_index, "group")[0]
+        samples = [_timed(table.query, Field("group") == x)[0] for x in groups]
+        results["indexed_query"] = _summary(samples)
+        database.flush()
+
+        # Opening and the first read, with nothing of the table in memory yet.
+        start = time.perf_counter()
+        reopened = Database.open(path)
+        reopened.commit_on_exit = False
+        opened = time.perf_counter()
+        reopened.table.Bench.raw_get(keys[0])
+        results["cold_open"] = {"open": opened - start, "first_get": time.perf_counter() - opened}
+        reopened.close()
+
+        # Python allocations while a fresh handle loads the whole table.
+        tracemalloc.start()
+        try:
+            reopened = Database.open(path)
+            reopened.commit_on_exit = False
+            for _ in reopened.table.Bench.items():
+                pass
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        reopened.close()
+        results["memory"] = {"current": current, "peak": peak}
+        results["chunks"] = len(table.chunks)
+    finally:
+        database.close()
+        shutil.rmtree(path, ignore_errors=True)
+    return results
+
+
+def run_startup(directory, tables, documents=STARTUP_DOCUMENTS, seed=0):
+    """
+    run_startup(String:directory, Int:tables, Int:documents, Int:seed) returns Dict
+
+    Times opening a database of `tables` tables, the first read from one
+    of them and opening all of them. Tables are opened on first use, so
+    only the last one should grow with the number of tables.
+    """
+    rng = random.Random(seed)
+    path = os.path.join(directory, "startup-{}".format(tables))
+    # Nothing here measures writes, the setup doesn't need to wait for the disk.
+    database = Database.new(path, durability=DURABILITY_NONE)
+    try:
+        for n in range(tables):
+            database.get_table("table{}".format(n)).bulk_load((x, _document(rng, x)) for x in range(documents))
+        database.close()
+
+        tracemalloc.start()
+        try:
+            start = time.perf_counter()
+            database = Database.open(path)
+            opened = time.perf_counter()
+            memory = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        database.commit_on_exit = False
+        database.table["table{}".format(tables // 2)].raw_get(0)
+        first = time.perf_counter()
+        for table in database.tables.values():
+            pass
+        results = {
+            "tables": tables,
+            "open": opened - start,
+            "first_table": first - opened,
+            "all_tables": time.perf_counter() - first,
+            "open_memory": memory,
+        }
+    finally:
+        database.commit_on_exit = False
+        database.close()
+        shutil.rmtree(path, ignore_errors=True)
+    return results
+
+
+def run_codecs(directory, size, chunk_size, codecs=DEFAULT_CODECS, seed=0):
+    """
+    run_codecs(String:directory, Int:size, Int:chunk_size, List[String]:codecs, Int:seed) returns List[Dict]
+
+    Stores the same `size` documents with every codec, timing how long
+    writing them takes ("dump"), how long a fresh handle takes to read
+    them all back ("load") and how many bytes the chunks take on disk.
+    Codecs that need a package that isn't installed are left out.
+    """
+    rng = random.Random(seed)
+    items = [(n, _document(rng, n)) for n in range(size)]
+    results = []
+    for name in codecs:
+        if name.startswith("msgpack") and _codec.msgpack is None:
+            continue
+        path = os.path.join(directory, "codec-{}".format(name))
+        database = Database.new(path, chunk_size=chunk_size, codec=name)
+        database.commit_on_exit = False
+        reopened = None
+        try:
+            table = database.table.Bench
+            dump, _ = _timed(lambda: (table.bulk_load(items), database.flush()))
+            reopened = Database.open(path)
+            reopened.commit_on_exit = False
+            load, _ = _timed(lambda: sum(1 for _ in reopened.table.Bench.items()))
+            results.append({"codec": name, "size": size, "chunk_size": chunk_size,
+                            "dump": dump, "load": load, "bytes": _chunk_bytes(table)})
+        finally:
+            if reopened is not None:
+                reopened.close()
+            database.close()
+            shutil.rmtree(path, ignore_errors=True)
+    return results
+
+
+def run_durability(directory, size, chunk_size, commits=DEFAULT_COMMITS, modes=DURABILITY_MODES, seed=0):
+    """
+    run_durability(String:directory, Int:size, Int:chunk_size, Int:commits, List[String]:modes, Int:seed) returns List[Dict]
+
+    Times the same ten writes and the commit after them, and the
+    checkpoints that follow, with every durability mode.
+    """
+    results = []
+    for mode in modes:
+        rng = random.Random(seed)
+        path = os.path.join(directory, "durability-{}".format(mode))
+        database = Database.new(path, chunk_size=chunk_size, durability=mode)
+        database.commit_on_exit = False
+        try:
+            table = database.table.Bench
+            table.bulk_load((n, _document(rng, n)) for n in range(size))
+            database.flush()
+            samples, checkpoints = [], []
+            for _ in range(commits):
+                # With "commit" every write waits for the disk, so the writes are timed too.
+                writes = [(n, _document(rng, n)) for n in (rng.randrange(size) for _ in range(10))]
+                samples.append(_timed(lambda: ([table.insert(*x) for x in writes], database.flush()))[0])
+                checkpoints.append(_timed(lambda: (table.checkpoint(), database.flush()))[0])
+            results.append({"durability": mode, "size": size, "chunk_size": chunk_size,
+                            "commit": _summary(samples), "checkpoint": _summary(checkpoints)})
+        finally:
+            database.close()
+            shutil.rmtree(path, ignore_errors=True)
+    return results
+
+
+def _process_worker(path, n, deadline, seed, results):
+    rng = random.Random(seed + n)
+    Console.logLevel = 5
+    database = Database.open(path, multiprocess=True)
+    database.commit_on_exit = False
+    table = database.table.Bench
+    own = {}
+    reads = writes = stale = 0
+    while time.time() < deadline:
+        op = rng.random()
+        if op < 0.25:
+            key = "p{}-{}".format(n, rng.randrange(1000))
+            document = {"group": rng.randrange(GROUPS), "writer": n, "version": writes}
+            table.insert(key, document)
+            own[key] = document
+            writes += 1
+        elif op < 0.30:
+            table.insert("shared-{}".format(rng.randrange(PROCESS_SHARED)), {"group": rng.randrange(GROUPS), "writer": n})
+            writes += 1
+        elif op < 0.90:
+            if own:
+                key = rng.choice(list(own))
+                if table.raw_get(key) != own[key]:
+                    stale += 1
+            table.raw_get("shared-{}".format(rng.randrange(PROCESS_SHARED)))
+            reads += 1
+        else:
+            group = rng.randrange(GROUPS)
+            for document in table.query(Field("group") == group, limit=20):
+                if document["group"] != group:
+                    stale += 1
+            reads += 1
+    database.flush()
+    results.put((n, own, reads, writes, stale, table.shared.stats()))
+
+
+def run_multiprocess(directory, processes, seconds=DEFAULT_PROCESS_SECONDS, seed=0):
+    """
+    run_multiprocess(String:directory, Int:processes, Float:seconds, Int:seed) returns Dict
+
+    Runs readers and writers in `processes` processes against one database
+    opened with multiprocess=True for `seconds`, then checks that a fresh
+    handle, and the idle one that created the table, see every process'
+    last writes. What went wrong is listed under "errors".
+    """
+    path = os.path.join(directory, "multiprocess-{}".format(processes))
+    database = Database.new(path, chunk_size=256, multiprocess=True)
+    database.commit_on_exit = False
+    reopened = None
+    try:
+        table = database.table.Bench
+        table.create_index("group")
+        table.bulk_load(("shared-{}".format(x), {"group": 0, "writer": None}) for x in range(PROCESS_SHARED))
+        database.flush()
+
+        results = multiprocessing.Queue()
+        deadline = time.time() + seconds
+        workers = [multiprocessing.Process(target=_process_worker, args=(path, x, deadline, seed, results))
+                   for x in range(processes)]
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        reports = sorted((results.get() for _ in workers), key=lambda x: x[0])
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - started
+
+        errors = ["process {} read {} stale documents".format(x[0], x[4]) for x in reports if x[4]]
+        reopened = Database.open(path, multiprocess=True)
+        reopened.commit_on_exit = False
+        bench = reopened.table.Bench
+        for n, own, _, _, _, _ in reports:
+            errors.extend("{} lost".format(key) for key, document in own.items() if bench.raw_get(key) != document)
+        index = bench.indexes["group"]
+        if any(index.keys.get(key) != document["group"] for key, document in bench.items()):
+            errors.append("index is stale")
+        key = next(iter(reports[0][1]), "shared-0") if reports else "shared-0"
+        if table.raw_get(key) != bench.raw_get(key):
+            errors.append("idle handle did not catch up")
+
+        reads = sum(x[2] for x in reports)
+        writes = sum(x[3] for x in reports)
+        return {
+            "processes": processes,
+            "seconds": elapsed,
+            "reads": _rate(reads, elapsed),
+            "writes": _rate(writes, elapsed),
+            "shared": [x[5] for x in reports],
+            "errors": errors,
+        }
+    finally:
+        if reopened is not None:
+            reopened.close()
+        database.close()
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def run(sizes=DEFAULT_SIZES, chunk_sizes=DEFAULT_CHUNK_SIZES, directory=None, log=None,
+        table_counts=DEFAULT_TABLE_COUNTS, codecs=DEFAULT_CODECS, durability=DURABILITY_MODES,
+        processes=0, process_seconds=DEFAULT_PROCESS_SECONDS, **options):
+    """
+    run(List[Int]:sizes, List[Int]:chunk_sizes, String:directory, function(String):log,
+        List[Int]:table_counts, List[String]:codecs, List[String]:durability,
+        Int:processes, Float:process_seconds, **options) returns Dict
+
+    Runs run_case for every table size and chunk size, the options are
+    passed on to it, run_startup for every table count, run_codecs and
+    run_durability with the first size and chunk size and, unless
+    processes is 0, run_multiprocess.
+    Returns the JSON document the command line prints.
+    """
+    owns_directory = directory is None
+    directory = directory or tempfile.mkdtemp(prefix="tasho-bench-")
+    log_level, Console.logLevel = Console.logLevel, 5
+    cases, startup, codec_cases, durability_cases, shared = [], [], [], [], None
+    try:
+        for size in sizes:
+            for chunk_size in chunk_sizes:
+                if log:
+                    log("size={} chunk_size={}".format(size, chunk_size))
+                cases.append(run_case(directory, chunk_size, size, **options))
+        for tables in table_counts:
+            if log:
+                log("tables={}".format(tables))
+            startup.append(run_startup(directory, tables, seed=options.get("seed", 0)))
+        if codecs and sizes and chunk_sizes:
+            if log:
+                log("codecs={}".format(",".join(codecs)))
+            codec_cases = run_codecs(directory, sizes[0], chunk_sizes[0], codecs, seed=options.get("seed", 0))
+        if durability and sizes and chunk_sizes:
+            if log:
+                log("durability={}".format(",".join(durability)))
+            durability_cases = run_durability(directory, sizes[0], chunk_sizes[0], options.get("commits", DEFAULT_COMMITS),
+                                              durability, seed=options.get("seed", 0))
+        if processes:
+            if log:
+                log("processes={}".format(processes))
+            shared = run_multiprocess(directory, processes, process_seconds, seed=options.get("seed", 0))
+    finally:
+        Console.logLevel = log_level
+        if owns_directory:
+            shutil.rmtree(directory, ignore_errors=True)
+    return {
+        "format": BENCH_FORMAT,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "options": dict(options, sizes=list(sizes), chunk_sizes=list(chunk_sizes), table_counts=list(table_counts),
+                        codecs=list(codecs), durability=list(durability),
+                        processes=processes, process_seconds=process_seconds),
+        "cases": cases,
+        "startup": startup,
+        "codecs": codec_cases,
+        "durability": durability_cases,
+        "multiprocess": shared,
+    }
+
+
+def _numbers(value):
+    return [int(x) for x in value.split(",") if x]
+
+
+def _names(value):
+    return [x for x in value.split(",") if x]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m tasho.bench", description="Benchmarks TashoDB and prints the results as JSON.")
+    parser.add_argument("--sizes", type=_numbers, default=list(DEFAULT_SIZES), help="table sizes, comma separated")
+    parser.add_argument("--chunk-sizes", type=_numbers, default=list(DEFAULT_CHUNK_SIZES), help="chunk sizes, comma separated")
+    parser.add_argument("--tables", type=_numbers, default=list(DEFAULT_TABLE_COUNTS),
+                        help="table counts of the startup benchmark, comma separated")
+    parser.add_argument("--operations", type=int, default=DEFAULT_OPERATIONS, help="single inserts and point gets per case")
+    parser.add_argument("--queries", type=int, default=DEFAULT_QUERIES, help="scan and indexed queries per case")
+    parser.add_argument("--commits", type=int, default=DEFAULT_COMMITS, help="timed commits per case")
+    parser.add_argument("--parallel", type=int, default=DEFAULT_PARALLEL,
+                        help="worker processes the scans are also timed with, skipped when 0")
+    parser.add_argument("--codecs", type=_names, default=list(DEFAULT_CODECS),
+                        help="codecs of the codec benchmark, comma separated")
+    parser.add_argument("--durability", type=_names, default=list(DURABILITY_MODES),
+                        help="durability modes of the commit benchmark, comma separated")
+    parser.add_argument("--processes", type=int, default=0,
+                        help="processes of the multi-process run, it is skipped when 0")
+    parser.add_argument("--process-seconds", type=float, default=DEFAULT_PROCESS_SECONDS,
+                        help="how long the multi-process run lasts")
+    parser.add_argument("--codec", default=DEFAULT_CODEC)
+    parser.add_argument("--layout", default=LAYOUT_APPEND, choices=LAYOUTS)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--directory", help="where the databases are created, a temporary directory by default")
+    parser.add_argument("--output", help="file the JSON is written to instead of stdout")
+    args = parser.parse_args(argv)
+
+    results = run(args.sizes, args.chunk_sizes, args.directory,
+                  log=lambda x: print(x, file=sys.stderr, flush=True), table_counts=args.tables,
+                  codecs=args.codecs, durability=args.durability,
+                  processes=args.processes, process_seconds=args.process_seconds,
+                  operations=args.operations, queries=args.queries, commits=args.commits,
+                  codec=args.codec, layout=args.layout, parallel=args.parallel, seed=args.seed)
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if results["multiprocess"] and results["multiprocess"]["errors"]:
+        print("\n".join(results["multiprocess"]["errors"][:20]), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,340 @@
+import threading
+from collections import OrderedDict
+
+from .console import Console
+
+
+class ChunkCache():
+    """ChunkCache(Int:max_chunks, Int:max_documents) returns tasho.cache.ChunkCache
+
+            Database wide LRU of the loaded chunks. Once more than max_chunks
+            chunks or max_documents documents are resident, the least recently
+            used clean chunks are unloaded, they get read from disk again on
+            their next access. Dirty chunks and chunks with a commit still in
+            flight are pinned, as are chunks another thread holds a lock on.
+            Either limit can be None to leave it unbounded."""
+
+    def __init__(self, max_chunks=None, max_documents=None):
+        self.max_chunks = max_chunks
+        self.max_documents = max_documents
+        self.resident = OrderedDict()
+        self.documents = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.RLock()
+
+    def __repr__(self):
+        return "<TashoDBChunkCache Chunks: {} Documents: {}>".format(len(self.resident), self.documents)
+
+    @property
+    def bounded(self):
+        return self.max_chunks is not None or self.max_documents is not None
+
+    def stats(self):
+        """
+        ChunkCache.stats() returns Dict
+
+        Returns the hit, miss and eviction counters along with the current usage.
+        """
+        with self.lock:
+            return self._stats()
+
+    def _stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "chunks": len(self.resident),
+            "documents": self.documents,
+            "max_chunks": self.max_chunks,
+            "max_documents": self.max_documents,
+        }
+
+    def hit(self, chunk):
+        """
+        ChunkCache.hit(tasho.chunk.Chunk:chunk)
+
+        Records an access to a chunk that is already loaded.
+        """
+        self.hits += 1
+        size = self.resident.get(chunk, None)
+        if size is not None and size == len(chunk._data):
+            # Common case, move_to_end is atomic so the lock isn't needed.
+            try:
+                self.resident.move_to_end(chunk)
+            except KeyError:
+                pass
+            return
+        with self.lock:
+            size = self.resident.get(chunk, None)
+            if size is None:
+                self._add(chunk)
+            else:
+                self.resident.move_to_end(chunk)
+                if size != len(chunk._data):
+                    self.documents += len(chunk._data) - size
+                    self.resident[chunk] = len(chunk._data)
+
+    def loaded(self, chunk):
+        """
+        ChunkCache.loaded(tasho.chunk.Chunk:chunk)
+
+        Records a chunk that was just read from disk, evicting others if needed.
+        """
+        with self.lock:
+            self.misses += 1
+            self.forget(chunk)
+            self._add(chunk)
+            self.evict()
+
+    def forget(self, chunk):
+        """
+        ChunkCache.forget(tasho.chunk.Chunk:chunk)
+
+        Stops tracking a chunk without unloading it.
+        """
+        with self.lock:
+            size = self.resident.pop(chunk, None)
+            if size is not None:
+                self.documents -= size
+
+    def evict(self):
+        """
+        ChunkCache.evict() returns Int
+
+        Unloads clean chunks, least recently used first, until the cache
+        fits its limits. Returns the number of chunks unloaded.
+        """
+        if not self.bounded:
+            return 0
+        with self.lock:
+            evicted = 0
+            for chunk in list(self.resident):
+                if not self._over_budget():
+                    break
+                if chunk.dirty or chunk.committing:
+                    continue
+                # Never waits, a chunk that is in use just stays resident. That
+                # includes chunks locked by this thread, which may be in the
+                # middle of loading one so it can write to it.
+                if chunk.lock.locked or not chunk.lock.acquire_write(blocking=False):
+                    continue
+                try:
+                    if chunk.dirty or chunk.committing:
+                        continue
+                    self.forget(chunk)
+                    chunk.unload()
+                    evicted += 1
+                finally:
+                    chunk.lock.release_write()
+
+            self.evictions += evicted
+        if evicted:
+            Console.log(f'[ChunkCache] Evicted {evicted} chunks')
+        return evicted
+
+    def _add(self, chunk):
+        self.resident[chunk] = len(chunk._data)
+        self.documents += len(chunk._data)
+
+    def _over_budget(self):
+        if self.max_chunks is not None and len(self.resident) > self.max_chunks:
+            return True
+        if self.max_documents is not None and self.documents > self.max_documents:
+            return True
+        return False
+
+
+# File descriptors a process keeps open for point reads of unloaded chunks.
+DEFAULT_OPEN_READERS = 128
+
+
+class ReaderCache():
+    """ReaderCache(Int:max_readers) returns tasho.cache.ReaderCache
+
+            Process wide LRU of the chunks that keep their file mapped for
+            point reads while they aren't loaded (see Chunk.get). Every open
+            reader holds a file descriptor, so past max_readers the least
+            recently used ones are closed, they are opened again on their
+            next read. Readers in use by another thread are left open.
+            Shared by every database, use tasho.cache.open_readers."""
+
+    def __init__(self, max_readers=DEFAULT_OPEN_READERS):
+        self.max_readers = max_readers
+        self.open = OrderedDict()
+        self.closed = 0
+        self.lock = threading.RLock()
+
+    def __repr__(self):
+        return "<TashoDBReaderCache Open: {}>".format(len(self.open))
+
+    def stats(self):
+        return {"open": len(self.open), "closed": self.closed, "max_readers": self.max_readers}
+
+    def opened(self, chunk):
+        """
+        ReaderCache.opened(tasho.chunk.Chunk:chunk)
+
+        Records a chunk that just opened its reader, closing others if needed.
+        The caller holds the chunk's lock, so it is never closed here.
+        """
+        with self.lock:
+            self.open[chunk] = True
+            self.open.move_to_end(chunk)
+            for other in list(self.open):
+                if len(self.open) <= self.max_readers:
+                    break
+                if other is chunk or other.lock.locked or not other.lock.acquire_write(blocking=False):
+                    continue
+                try:
+                    other._close_reader()
+                    self.closed += 1
+                finally:
+                    other.lock.release_write()
+
+    def used(self, chunk):
+        # move_to_end is atomic, a chunk closed meanwhile just isn't there.
+        try:
+            self.open.move_to_end(chunk)
+        except KeyError:
+            pass
+
+    def forget(self, chunk):
+        with self.lock:
+            self.open.pop(chunk, None)
+
+
+open_readers = ReaderCache()
+
+
+DEFAULT_CACHED_QUERIES = 128
+
+
+class QueryCache():
+    """QueryCache(Int:max_queries, Int:max_ids) returns tasho.cache.QueryCache
+
+            Per table cache of query results, enabled through
+            Table.enable_query_cache. Only the matching ids are kept, split
+            by chunk along with the chunk's version at the time. Writes and
+            deletes bump the version of their chunk, so a lookup only scans
+            again the chunks that changed since and reuses the rest.
+            At most max_queries results, and max_ids ids over all of them,
+            are kept, least recently used results go first. Either limit
+            can be None to leave it unbounded."""
+
+    def __init__(self, max_queries=DEFAULT_CACHED_QUERIES, max_ids=None):
+        self.max_queries = max_queries
+        self.max_ids = max_ids
+        self.entries = OrderedDict()
+        self.ids = 0
+        self.hits = 0
+        self.partial_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.chunks_reused = 0
+        self.chunks_scanned = 0
+        self.lock = threading.RLock()
+
+    def __repr__(self):
+        return "<TashoDBQueryCache Queries: {} Ids: {}>".format(len(self.entries), self.ids)
+
+    def stats(self):
+        """
+        QueryCache.stats() returns Dict
+
+        Returns the hit counters and the current usage. A partial hit
+        reused some chunks but had to scan others again.
+        """
+        with self.lock:
+            lookups = self.hits + self.partial_hits + self.misses
+            chunks = self.chunks_reused + self.chunks_scanned
+            return {
+                "hits": self.hits,
+                "partial_hits": self.partial_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "chunk_reuse_ratio": self.chunks_reused / chunks if chunks else 0.0,
+                "queries": len(self.entries),
+                "ids": self.ids,
+                "max_queries": self.max_queries,
+                "max_ids": self.max_ids,
+            }
+
+    def matches(self, key, chunks, scan):
+        """
+        QueryCache.matches(Object:key, List[tasho.chunk.Chunk]:chunks, function(chunk):scan) returns List[(tasho.chunk.Chunk, List)]
+
+        Returns the matching ids of every chunk, in chunk order. Chunks the
+        cached result doesn't cover, or that changed since, are scanned again.
+        """
+        with self.lock:
+            entry = self.entries.get(key, None)
+            if entry is not None:
+                self.entries.move_to_end(key)
+
+        fresh = {}
+        results = []
+        scanned = 0
+        for chunk in chunks:
+            cached = entry.get(chunk.name, None) if entry is not None else None
+            if cached is not None and cached[0] == chunk.version:
+                ids = cached[1]
+            else:
+                # Read before scanning, a write landing during the
+                # scan makes the next lookup scan the chunk again.
+                version = chunk.version
+                ids = scan(chunk)
+                cached = (version, ids)
+                scanned += 1
+            fresh[chunk.name] = cached
+            results.append((chunk, ids))
+
+        with self.lock:
+            if entry is None:
+                self.misses += 1
+            elif scanned:
+                self.partial_hits += 1
+            else:
+                self.hits += 1
+            self.chunks_scanned += scanned
+            self.chunks_reused += len(results) - scanned
+            if scanned or entry is None or len(fresh) != len(entry):
+                self._store(key, fresh)
+        return results
+
+    def forget(self, key):
+        """
+        QueryCache.forget(Object:key)
+
+        Drops a cached result.
+        """
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.ids -= _count_ids(entry)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.ids = 0
+
+    def _store(self, key, entry):
+        self.forget(key)
+        size = _count_ids(entry)
+        if self.max_ids is not None and size > self.max_ids:
+            return
+        self.entries[key] = entry
+        self.ids += size
+        while (self.max_queries is not None and len(self.entries) > self.max_queries) or \
+                (self.max_ids is not None and self.ids > self.max_ids):
+            _, evicted = self.entries.popitem(last=False)
+            self.ids -= _count_ids(evicted)
+            self.evictions += 1
+
+
+def _count_ids(entry):
+    return sum(len(x[1]) for x in entry.values())
@@ -1,37 +1,161 @@
 import os
+import mmap
 import marshal
+import struct
 import threading
 import time
-import queue
+import weakref
+from array import array
 
 from .console import Console
+from .storage import atomic_write
+from .codec import get_codec
+from .scheduler import default_scheduler
+from .locks import RWLock
+from .stats import Stats
+from .cache import open_readers
 
-def commitManager(commitQueue, chunk_path):
+# Chunk file formats, stored as `chunk_format` in the database properties.
+#   1 - the whole chunk as a single marshal blob.
+#   2 - <magic><version><header length><header><records>, the header holds
+#       the keys, the end offset of every record and the codec name, so one
+#       document can be read without deserializing the rest of the chunk.
+#       With a compressing codec the records are compressed as one block.
+LEGACY_CHUNK_FORMAT = 1
+CHUNK_FORMAT = 2
+CHUNK_MAGIC = b"TSHC"
+_PREAMBLE = struct.Struct("<4sBI")
+
+
+def dump_chunk(data, chunk_format=CHUNK_FORMAT, codec=None):
+    if chunk_format == LEGACY_CHUNK_FORMAT:
+        return marshal.dumps(data)
+
+    codec = codec or get_codec()
+    dumps = codec.serializer.dumps
+    records = []
+    ends = array("Q")
+    position = 0
+    for document in data.values():
+        record = dumps(document)
+        position += len(record)
+        records.append(record)
+        ends.append(position)
+    records = b"".join(records)
+    if codec.compressor:
+        records = codec.compressor.compress(records)
+    header = marshal.dumps((list(data.keys()), ends.tobytes(), codec.name))
+    return _PREAMBLE.pack(CHUNK_MAGIC, CHUNK_FORMAT, len(header)) + header + records
+
+
+def remove_chunk_file(chunk_path):
+    try:
+        os.remove(chunk_path)
+    except FileNotFoundError:
+        pass
+
+
+def read_chunk(chunk_path):
+    reader = ChunkReader(chunk_path)
     try:
-        while True:
-            data = commitQueue.get(True, 15)
-            flattenCount = 0
-            while not commitQueue.empty():
-                flattenCount += 1
-                data.update(commitQueue.get())
-            # Console.log(f'[{chunk_path}]Flattened Commit Count:', flattenCount)
-            with open(chunk_path, "wb") as f:
-                marshal.dump(data, f)
-    except queue.Empty:
-        chunkName = chunk_path.split("/")[-1].split("\\")[-1]
-        Console.log(f'[{chunkName}]Retiring Manager')
+        return dict(reader.items())
+    finally:
+        reader.close()
+
+
+class ChunkReader():
+    """ChunkReader(String:chunk_path) returns tasho.chunk.ChunkReader
+
+            Memory maps a chunk file and deserializes documents on demand.
+            Files in the legacy format are loaded whole, compressed
+            records are decompressed as one block."""
+
+    def __init__(self, chunk_path):
+        self.chunk_path = chunk_path
+        self._legacy = None
+        self._mmap = None
+        self._positions = None
+        with open(chunk_path, "rb") as f:
+            size = self.size = os.fstat(f.fileno()).st_size
+            if size < _PREAMBLE.size or f.read(len(CHUNK_MAGIC)) != CHUNK_MAGIC:
+                f.seek(0)
+                self._legacy = marshal.loads(f.read())
+                return
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, header_length = _PREAMBLE.unpack_from(self._mmap, 0)
+        start = _PREAMBLE.size
+        header = marshal.loads(self._mmap[start:start + header_length])
+        self._keys, ends = header[0], header[1]
+        self._ends = array("Q", ends)
+        self.codec = get_codec(header[2] if len(header) > 2 else None)
+        self._loads = self.codec.serializer.loads
+
+        self._data = self._mmap
+        self._records = start + header_length
+        if self.codec.compressor:
+            self._data = self.codec.compressor.decompress(self._mmap[self._records:])
+            self._records = 0
+            self.close()
+
+    def __len__(self):
+        if self._legacy is not None:
+            return len(self._legacy)
+        return len(self._keys)
+
+    def get(self, key, default=None):
+        if self._legacy is not None:
+            return self._legacy.get(key, default)
+        if self._positions is None:
+            self._positions = {x: i for i, x in enumerate(self._keys)}
+        i = self._positions.get(key, None)
+        if i is None:
+            return default
+        start = self._records + (self._ends[i - 1] if i else 0)
+        return self._loads(self._data[start:self._records + self._ends[i]])
+
+    def items(self):
+        if self._legacy is not None:
+            yield from self._legacy.items()
+            return
+        loads, data, start = self._loads, self._data, self._records
+        for key, end in zip(self._keys, self._ends):
+            end += self._records
+            yield key, loads(data[start:end])
+            start = end
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
 
 class Chunk():
-    def __init__(self, chunk_id, chunk_path, max_size=8192):
+    def __init__(self, chunk_id, chunk_path, max_size=8192, fsync=False, cache=None,
+                 chunk_format=CHUNK_FORMAT, codec=None, scheduler=None, stats=None):
         self.name = chunk_id
         self.chunk_path = chunk_path
         self.max_size = max_size
+        self.fsync = fsync
+        self.cache = cache
+        self.chunk_format = chunk_format
+        self.codec = codec
+        self._reader = None
         self.is_loaded = False
         self._data = {}
-        self.idhash = None
         self.dirty = False
-        self.commitQueue = queue.Queue()
-        self.commitThread = None
+        # Bumped by every change to the documents, see tasho.cache.QueryCache.
+        self.version = 0
+        self.scheduler = scheduler
+        self._commit_future = None
+        # The table's tasho.stats.Stats, loads and writes are counted there.
+        self.stats = stats if stats is not None else Stats()
+        # Open tasho.transaction.Snapshots that still need the current documents.
+        self._snapshots = None
+        # Readers and writers of the documents go through `lock`, loading
+        # the chunk from disk goes through `_load_lock` so it only happens once.
+        self.lock = RWLock()
+        self._load_lock = threading.RLock()
         Console.log(f'[{self.name}] Lazy loaded')
 
 
@@ -39,12 +163,150 @@ class Chunk():
         return "<TashoDBTableChunk:" + self.name + ">"
 
     def initalize(self):
-        if os.path.exists(self.chunk_path):
-            with open(self.chunk_path, "rb") as f:
-                self._data = marshal.load(f)
-                self.idhash = set(self._data.keys())
-                self.is_loaded = True    
-            Console.log(f'[{self.name}] Fully loaded')
+        stats = self.stats
+        started = time.perf_counter() if stats.enabled else None
+        with self._load_lock:
+            self._close_reader()
+            if os.path.exists(self.chunk_path):
+                self._data = read_chunk(self.chunk_path)
+                Console.log(f'[{self.name}] Fully loaded')
+                if started is not None:
+                    stats.count("chunk_loads")
+                    stats.count("bytes_read", os.path.getsize(self.chunk_path))
+                    stats.observe("chunk_load", time.perf_counter() - started)
+            self.is_loaded = True
+        if self.cache:
+            self.cache.loaded(self)
+
+    def unload(self):
+        # The dict is replaced rather than cleared, a commit thread
+        # or a running iteration may still hold the old one.
+        with self.lock.write():
+            self.is_loaded = False
+            self._data = {}
+            self._close_reader()
+        Console.log(f'[{self.name}] Unloaded')
+
+    def get(self, key, default=None):
+        """
+        Chunk.get(String/Int:key, Object:default) returns Dict
+
+        Returns a single document. If the chunk isn't loaded only that
+        document is read from the chunk file.
+        """
+        data = self._data
+        if self.is_loaded and data is self._data:
+            # The dict is only swapped out by unload, which clears is_loaded
+            # first, so a loaded chunk can be read without the lock.
+            if self.cache:
+                self.cache.hit(self)
+            return data.get(key, default)
+        with self.lock.read():
+            if self.is_loaded:
+                return self.items.get(key, default)
+            with self._load_lock:
+                if self.is_loaded:
+                    return self._data.get(key, default)
+                if not os.path.exists(self.chunk_path):
+                    return default
+                if self._reader is None:
+                    self._open_reader()
+                else:
+                    open_readers.used(self)
+                reader = self._reader
+            # The reader is only closed under the write lock.
+            return reader.get(key, default)
+
+    def get_many(self, keys):
+        """
+        Chunk.get_many(List[String/Int]:keys) returns List[Dict]
+
+        Same as Chunk.get for every key, None for the missing ones, but
+        the chunk file is only opened once if the chunk isn't loaded.
+        """
+        with self.lock.read():
+            if self.is_loaded:
+                data = self.items
+                return [data.get(x, None) for x in keys]
+            with self._load_lock:
+                if self.is_loaded:
+                    return [self._data.get(x, None) for x in keys]
+                if not os.path.exists(self.chunk_path):
+                    return [None] * len(keys)
+                if self._reader is None:
+                    self._open_reader()
+                else:
+                    open_readers.used(self)
+                reader = self._reader
+            return [reader.get(x, None) for x in keys]
+
+    def iter_items(self):
+        """
+        Chunk.iter_items() returns (String/Int:id, Dict:document)
+
+        Goes through the documents of the chunk. If the chunk isn't loaded
+        the documents are streamed from the chunk file without loading it.
+        """
+        reader = None
+        if not self.is_loaded:
+            try:
+                reader = ChunkReader(self.chunk_path)
+            except FileNotFoundError:
+                # Not written yet, or retired and published by a shared table since.
+                pass
+        if reader is None:
+            # Copied so other threads can keep writing while the caller iterates.
+            with self.lock.read():
+                items = list(self.items.items())
+            yield from items
+            return
+        if self.stats.enabled:
+            self.stats.count("chunk_streams")
+            self.stats.count("bytes_read", reader.size)
+        try:
+            yield from reader.items()
+        finally:
+            reader.close()
+
+    def _register(self, snapshot):
+        if self._snapshots is None:
+            self._snapshots = weakref.WeakSet()
+        self._snapshots.add(snapshot)
+
+    def _unregister(self, snapshot):
+        if self._snapshots is not None:
+            self._snapshots.discard(snapshot)
+
+    def _changing(self):
+        # Called under the write lock before the documents change.
+        if self._snapshots:
+            self._preserve()
+
+    def _preserve(self):
+        # Copy on write: the snapshots open on the chunk keep the current
+        # dict, which is never changed again, the chunk goes on with a copy.
+        with self.lock.write():
+            snapshots = list(self._snapshots or ())
+            self._snapshots = None
+            if not snapshots:
+                return
+            data = self.items
+            for snapshot in snapshots:
+                snapshot.preserved.setdefault(self, data)
+            self._data = dict(data)
+
+    def _open_reader(self):
+        # Point reads map the file, only the documents asked for are deserialized.
+        self._reader = ChunkReader(self.chunk_path)
+        open_readers.opened(self)
+        if self.stats.enabled:
+            self.stats.count("chunk_opens")
+
+    def _close_reader(self):
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+            open_readers.forget(self)
 
     @property
     def is_full(self):
@@ -55,18 +317,16 @@ class Chunk():
 
     @property
     def items(self):
-        if not self._data:
-            self.initalize()
-        return self._data
-
-    def index_in_chunk(self, index, data):
         if not self.is_loaded:
-            self.initalize()
+            with self._load_lock:
+                if not self.is_loaded:
+                    self.initalize()
+        elif self.cache:
+            self.cache.hit(self)
+        return self._data
 
-        if index in self.idhash:
-            return self._data[index]
-        else:
-            return None
+    def index_in_chunk(self, index, data=None):
+        return self.items.get(index, None)
 
     def find(self, query):
         results = []
@@ -76,29 +336,66 @@ class Chunk():
         return results
 
     def write(self, key, value, commit=False):
-        self._data[key] = value
-        self.dirty = True
+        with self.lock.write():
+            self._changing()
+            self.items[key] = value
+            self.dirty = True
+            self.version += 1
         if commit:
             self.commit()
-            self.dirty = False
 
     def delete(self, key):
-        if key in self._data:
-            self._data.pop(key)
-            self.dirty = True
-            return True
-        return False
+        with self.lock.write():
+            if key in self.items:
+                self._changing()
+                self._data.pop(key)
+                self.dirty = True
+                self.version += 1
+                return True
+            return False
+
+    @property
+    def committing(self):
+        """
+        Chunk.committing returns Bool
+        Returns True while a write of the chunk file is queued or running.
+        """
+        return self._commit_future is not None and not self._commit_future.done()
 
     def commit(self):
-        if not self.commitThread or not self.commitThread.isAlive():
-            Console.log(f'[{self.name}]Spawning Thread')
-            self.commitThread = threading.Thread(
-                None, 
-                target=commitManager, 
-                args=(self.commitQueue, self.chunk_path), 
-                daemon=True
-            )
-            self.commitThread.start()
-
-        self.commitQueue.put(self._data)
-        self.dirty = False
+        """
+        Chunk.commit() returns concurrent.futures.Future
+
+        Queues the chunk to be written to disk, the future resolves once
+        the file is written. The chunk is copied when the commit is queued,
+        so later writes don't race with the serialization.
+        """
+        chunk_path, fsync = self.chunk_path, self.fsync
+        chunk_format, codec = self.chunk_format, self.codec
+        stats = self.stats
+        submitted = time.perf_counter() if stats.enabled else None
+
+        def done(future):
+            if future.exception() is not None:
+                self.dirty = True
+            elif submitted is not None:
+                # Time spent queued included, that's what a checkpoint waits for.
+                stats.observe("chunk_write", time.perf_counter() - submitted)
+
+        # Held until the write is queued so the chunk can't be evicted
+        # and read back from the old file in between.
+        with self.lock.write():
+            snapshot = dict(self.items)
+
+            def write():
+                data = dump_chunk(snapshot, chunk_format, codec)
+                atomic_write(chunk_path, data, fsync)
+                if submitted is not None:
+                    stats.count("chunks_written")
+                    stats.count("bytes_written", len(data))
+
+            self._close_reader()
+            self.dirty = False
+            future = self._commit_future = (self.scheduler or default_scheduler()).submit(chunk_path, write)
+        future.add_done_callback(done)
+        return future
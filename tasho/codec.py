@@ -0,0 +1,98 @@
+import marshal
+import zlib
+import lzma
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from . import exceptions as _except
+
+DEFAULT_CODEC = "marshal"
+
+
+class Serializer():
+
+    def __init__(self, name, dumps, loads):
+        self.name = name
+        self.dumps = dumps
+        self.loads = loads
+
+
+class Compressor():
+
+    def __init__(self, name, compress, decompress):
+        self.name = name
+        self.compress = compress
+        self.decompress = decompress
+
+
+def _msgpack_dumps(data):
+    return msgpack.packb(data, use_bin_type=True)
+
+
+def _msgpack_loads(data):
+    return msgpack.unpackb(data, raw=False, strict_map_key=False)
+
+
+SERIALIZERS = {
+    "marshal": Serializer("marshal", marshal.dumps, marshal.loads),
+    "msgpack": Serializer("msgpack", _msgpack_dumps, _msgpack_loads),
+}
+
+COMPRESSORS = {
+    "zlib": Compressor("zlib", zlib.compress, zlib.decompress),
+    "lzma": Compressor("lzma", lzma.compress, lzma.decompress),
+}
+
+
+class Codec():
+    """Codec(tasho.codec.Serializer:serializer, tasho.codec.Compressor:compressor) returns tasho.codec.Codec
+
+            How documents and internal files are stored on disk, a serializer
+            optionally followed by a compressor. Codecs are looked up by name
+            through get_codec, e.g. 'marshal', 'msgpack', 'marshal+zlib',
+            'msgpack+lzma'. 'zlib' and 'lzma' are short for 'marshal+zlib'
+            and 'marshal+lzma'."""
+
+    def __init__(self, serializer, compressor=None):
+        self.serializer = serializer
+        self.compressor = compressor
+        self.name = serializer.name + ("+" + compressor.name if compressor else "")
+
+    def __repr__(self):
+        return "<TashoDBCodec:{}>".format(self.name)
+
+    def dumps(self, data):
+        data = self.serializer.dumps(data)
+        if self.compressor:
+            data = self.compressor.compress(data)
+        return data
+
+    def loads(self, data):
+        if self.compressor:
+            data = self.compressor.decompress(data)
+        return self.serializer.loads(data)
+
+
+def get_codec(name=DEFAULT_CODEC):
+    """
+    get_codec(String:name) returns tasho.codec.Codec
+
+    Returns the codec with the given name.
+    """
+    if isinstance(name, Codec):
+        return name
+    serializer_name, _, compressor_name = (name or DEFAULT_CODEC).partition("+")
+    if serializer_name in COMPRESSORS and not compressor_name:
+        serializer_name, compressor_name = DEFAULT_CODEC, serializer_name
+
+    if serializer_name not in SERIALIZERS:
+        raise _except.DatabaseInitException("Unknown codec '{}'.".format(name))
+    if compressor_name and compressor_name not in COMPRESSORS:
+        raise _except.DatabaseInitException("Unknown compression '{}'.".format(compressor_name))
+    if serializer_name == "msgpack" and msgpack is None:
+        raise _except.DatabaseInitException("The msgpack codec needs the msgpack package installed.")
+
+    return Codec(SERIALIZERS[serializer_name], COMPRESSORS.get(compressor_name, None))
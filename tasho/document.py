@@ -1,3 +1,5 @@
+_UNSET = object()
+
 
 class Document():
 
@@ -5,6 +7,9 @@ class Document():
         super(Document, self).__setattr__('_id', data[0])
         super(Document, self).__setattr__('_data', data[1])
         super(Document, self).__setattr__('_table', table)
+        # field -> new value (_UNSET if removed) since the last save,
+        # None while the dict is still the one the table holds.
+        super(Document, self).__setattr__('_changes', None)
 
     def __repr__(self):
         return "<TashoDBDocument:{} Origin: {}>".format(self._id, self._table.name)
@@ -21,22 +26,54 @@ class Document():
 
     def __setattr__(self, attribute, data):
         if attribute in self._data:
-            self._data[attribute] = data
+            self._change(attribute, data)
 
     def __getitem__(self, attribute):
         return self._data[attribute]
     
     def __setitem__(self, attribute, data):
-        self._data[attribute] = data   
+        self._change(attribute, data)
+
+    def _change(self, attribute, data):
+        if self._changes is None:
+            # The table's dict is left alone until Document.save.
+            super(Document, self).__setattr__('_data', dict(self._data))
+            super(Document, self).__setattr__('_changes', {})
+        if data is _UNSET:
+            self._data.pop(attribute, None)
+        else:
+            self._data[attribute] = data
+        self._changes[attribute] = data
 
+    @property
+    def patch(self):
+        """
+        Document.patch returns Dict
+
+        The changes made since the document was read or saved, as a Table.update patch.
+        """
+        patch = {}
+        for field, value in (self._changes or {}).items():
+            if value is _UNSET:
+                patch.setdefault("$unset", []).append(field)
+            else:
+                patch.setdefault("$set", {})[field] = value
+        return patch
 
     def save(self):
         """
         Document.save()
 
         Saves the document to the table. Might have to call Table.commit()
+        Only the fields that were changed are written (see Table.update),
+        the whole document if none were or it isn't in the table anymore.
         """
-        return self._table.insert(self._id, self._data)
+        patch = self.patch
+        saved = self._table.update(self._id, patch) if patch else None
+        if saved is None:
+            saved = self._table.insert(self._id, self._data)
+        super(Document, self).__setattr__('_changes', None)
+        return saved
 
     def update(self, data):
         """
@@ -44,15 +81,20 @@ class Document():
 
         Updates the document. Works the same as Dict.update()
         """
-        self._data.update(data)
+        for attribute, value in dict(data).items():
+            self._change(attribute, value)
 
-    def pop(self, data):
+    def pop(self, data, *default):
         """
-        Document.pop() returns Something
+        Document.pop(Object:data, Object:default) returns Something
 
         Works the same way as Dict.pop()
         """
-        return self._data.pop()
+        if data not in self._data:
+            return self._data.pop(data, *default)
+        value = self._data[data]
+        self._change(data, _UNSET)
+        return value
 
     def get(self, data, default=None):
         """
@@ -0,0 +1,241 @@
+import threading
+from bisect import bisect_left, bisect_right, insort
+
+from .codec import get_codec
+
+_MISSING = object()
+
+
+def sort_key(value):
+    # Values of different types can't be compared with each other,
+    # so every orderable type gets its own rank in the sorted list.
+    if isinstance(value, (bool, int, float)):
+        return (0, value)
+    if isinstance(value, str):
+        return (1, value)
+    if isinstance(value, bytes):
+        return (2, value)
+    return None
+
+
+def _hashable(value):
+    try:
+        hash(value)
+    except TypeError:
+        return False
+    return True
+
+
+class Index():
+    """Index(String:field, Dict{id:value}:keys) returns tasho.index.Index
+
+            Secondary index over a document field. Keeps a hash map for
+            equality lookups and a sorted list of the distinct values for
+            range and prefix lookups. Documents without the field, or with
+            None or an unhashable value (lists, dicts) are not indexed, so
+            lookups of those values return None and have to scan instead.
+            Updates and lookups are serialized by Index.lock."""
+
+    OPERATORS = ("==", "<", "<=", ">", ">=", "prefix")
+
+    def __init__(self, field, keys=None):
+        self.field = field
+        self.keys = {}
+        self.entries = {}
+        self.sorted = []
+        self.dirty = False
+        self.deferred = False
+        self.lock = threading.RLock()
+        for key, value in (keys or {}).items():
+            self._add(key, value)
+
+    def __repr__(self):
+        return "<TashoDBIndex:{} Values: {}>".format(self.field, len(self.entries))
+
+    def __len__(self):
+        return len(self.keys)
+
+    # ========== MAINTENANCE =============
+    def update(self, key, document):
+        """
+        Index.update(String/Int:key, Dict:document)
+
+        Updates the entry of a document after it was written.
+        """
+        value = document.get(self.field, _MISSING) if isinstance(document, dict) else _MISSING
+        with self.lock:
+            old = self.keys.get(key, _MISSING)
+            if old is not _MISSING:
+                if value is not _MISSING and type(old) is type(value) and old == value:
+                    return
+                self._discard(key, old)
+            if value is not _MISSING:
+                self._add(key, value)
+            self.dirty = True
+
+    def update_many(self, documents):
+        """
+        Index.update_many(Iterable[(String/Int:key, Dict:document)])
+
+        Same as calling Index.update for every document, but the sorted
+        value list is only rebuilt once at the end.
+        """
+        self.deferred = True
+        try:
+            for key, document in documents:
+                self.update(key, document)
+        finally:
+            self.sort()
+
+    def sort(self):
+        """
+        Index.sort()
+
+        Rebuilds the sorted value list and ends a deferred update.
+        """
+        with self.lock:
+            self.sorted = sorted(x for x in map(sort_key, self.entries) if x is not None)
+            self.deferred = False
+
+    def remove(self, key):
+        """
+        Index.remove(String/Int:key)
+
+        Removes a deleted document from the index.
+        """
+        with self.lock:
+            old = self.keys.get(key, _MISSING)
+            if old is not _MISSING:
+                self._discard(key, old)
+                self.dirty = True
+
+    def _add(self, key, value):
+        if value is None or not _hashable(value):
+            return
+        self.keys[key] = value
+        bucket = self.entries.get(value, None)
+        if bucket is None:
+            bucket = self.entries[value] = set()
+            value_key = sort_key(value)
+            if value_key is not None and not self.deferred:
+                insort(self.sorted, value_key)
+        bucket.add(key)
+
+    def _discard(self, key, value):
+        self.keys.pop(key, None)
+        bucket = self.entries.get(value, None)
+        if bucket is None:
+            return
+        bucket.discard(key)
+        if not bucket:
+            del self.entries[value]
+            value_key = sort_key(value)
+            if value_key is not None and not self.deferred:
+                i = bisect_left(self.sorted, value_key)
+                if i < len(self.sorted) and self.sorted[i] == value_key:
+                    del self.sorted[i]
+
+    # ========== LOOKUPS =============
+    def eq(self, value):
+        """
+        Index.eq(Object:value) returns List[String/Int]
+
+        Returns the ids of the documents where the field equals the value.
+        Returns None for None and unhashable values, they aren't indexed.
+        """
+        if value is None or not _hashable(value):
+            return None
+        with self.lock:
+            return list(self.entries.get(value, ()))
+
+    def range(self, low=None, high=None, include_low=True, include_high=True):
+        """
+        Index.range(Object:low, Object:high, Bool:include_low, Bool:include_high) returns List[String/Int]
+
+        Returns the ids of the documents where the field is between low and high.
+        Either bound can be None to leave that side open, but at least one is
+        required since it decides which type of values gets searched.
+        Returns None if the bounds can't be ordered.
+        """
+        bound = sort_key(low if low is not None else high)
+        if bound is None:
+            return None
+        rank = bound[0]
+
+        with self.lock:
+            start = bisect_left(self.sorted, (rank,))
+            end = bisect_left(self.sorted, (rank + 1,))
+            if low is not None:
+                low_key = sort_key(low)
+                if low_key is None or low_key[0] != rank:
+                    return None
+                start = (bisect_left if include_low else bisect_right)(self.sorted, low_key, start, end)
+            if high is not None:
+                high_key = sort_key(high)
+                if high_key is None or high_key[0] != rank:
+                    return None
+                end = (bisect_right if include_high else bisect_left)(self.sorted, high_key, start, end)
+            return self._collect(self.sorted[start:end])
+
+    def prefix(self, prefix):
+        """
+        Index.prefix(String:prefix) returns List[String/Int]
+
+        Returns the ids of the documents where the field starts with the prefix.
+        """
+        if not isinstance(prefix, str):
+            return None
+        with self.lock:
+            start = bisect_left(self.sorted, (1, prefix))
+            matched = []
+            for value_key in self.sorted[start:]:
+                if value_key[0] != 1 or not value_key[1].startswith(prefix):
+                    break
+                matched.append(value_key)
+            return self._collect(matched)
+
+    def lookup(self, op, value):
+        """
+        Index.lookup(String:op, Object:value) returns List[String/Int]
+
+        Resolves a single comparison against the index.
+        Returns None if the index can't answer it.
+        """
+        if op == "==":
+            return self.eq(value)
+        if op == ">":
+            return self.range(low=value, include_low=False)
+        if op == ">=":
+            return self.range(low=value)
+        if op == "<":
+            return self.range(high=value, include_high=False)
+        if op == "<=":
+            return self.range(high=value)
+        if op == "prefix":
+            return self.prefix(value)
+        return None
+
+    def _collect(self, value_keys):
+        keys = []
+        for value_key in value_keys:
+            # Values dropped during a deferred update are still in the sorted list.
+            keys.extend(self.entries.get(value_key[1], ()))
+        return keys
+
+    # ========== PERSISTENCE =============
+    def dumps(self, codec=None):
+        with self.lock:
+            return (codec or get_codec()).dumps({"field": self.field, "keys": self.keys})
+
+    @classmethod
+    def loads(cls, data, codec=None):
+        """
+        Index.loads(Bytes:data, tasho.codec.Codec:codec) returns tasho.index.Index
+
+        Loads an index written by Index.dumps. Returns None
+        for index files written by older versions.
+        """
+        data = (codec or get_codec()).loads(data)
+        if not isinstance(data, dict) or set(data) != {"field", "keys"}:
+            return None
+        return cls(data["field"], data["keys"])
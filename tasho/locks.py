@@ -0,0 +1,127 @@
+import threading
+
+
+class RWLock():
+    """RWLock() returns tasho.locks.RWLock
+
+            Reader/writer lock. Any number of threads can hold it for
+            reading, or a single thread for writing. Waiting writers block
+            new readers so a steady stream of reads can't starve them.
+            Both sides are reentrant and the writer can also take the read
+            side, but a reader can't upgrade to writing (that would
+            deadlock against another upgrading reader, so it raises)."""
+
+    def __init__(self):
+        self._mutex = threading.Lock()
+        # Made on the first wait, most locks never see contention and
+        # every chunk has one. Only touched under the mutex.
+        self._condition = None
+        self._readers = {}
+        self._writer = None
+        self._writes = 0
+        self._waiting = 0
+        self._sleeping = 0
+        self.read = _Side(self.acquire_read, self.release_read)
+        self.write = _Side(self.acquire_write, self.release_write)
+
+    def __repr__(self):
+        return "<TashoDBRWLock Readers: {} Writer: {}>".format(len(self._readers), self._writer is not None)
+
+    @property
+    def locked(self):
+        """
+        RWLock.locked returns Bool
+        Returns True while any thread, including this one, holds either side.
+        """
+        return self._writer is not None or bool(self._readers)
+
+    def acquire_read(self):
+        me = threading.get_ident()
+        with self._mutex:
+            if self._writer == me or me in self._readers:
+                self._readers[me] = self._readers.get(me, 0) + 1
+                return
+            while self._writer is not None or self._waiting:
+                self._wait()
+            self._readers[me] = 1
+
+    def release_read(self):
+        me = threading.get_ident()
+        with self._mutex:
+            count = self._readers[me] - 1
+            if count:
+                self._readers[me] = count
+                return
+            del self._readers[me]
+            if not self._readers:
+                self._wake()
+
+    def acquire_write(self, blocking=True):
+        """
+        RWLock.acquire_write(Bool:blocking) returns Bool
+
+        Returns False if blocking is off and the lock is held by someone else.
+        """
+        me = threading.get_ident()
+        if self._writer == me:
+            # Only the owner changes these while it holds the lock.
+            self._writes += 1
+            return True
+        with self._mutex:
+            if me in self._readers:
+                if not blocking:
+                    return False
+                raise RuntimeError("Can't take the write lock while holding the read lock.")
+            if not blocking:
+                if self._writer is not None or self._readers:
+                    return False
+            else:
+                self._waiting += 1
+                try:
+                    while self._writer is not None or self._readers:
+                        self._wait()
+                finally:
+                    self._waiting -= 1
+            self._writer = me
+            self._writes = 1
+            return True
+
+    def release_write(self):
+        if self._writes > 1:
+            self._writes -= 1
+            return
+        with self._mutex:
+            self._writes = 0
+            self._writer = None
+            self._wake()
+
+    def _wait(self):
+        if self._condition is None:
+            self._condition = threading.Condition(self._mutex)
+        self._sleeping += 1
+        try:
+            self._condition.wait()
+        finally:
+            self._sleeping -= 1
+
+    def _wake(self):
+        if self._sleeping:
+            self._condition.notify_all()
+
+
+class _Side():
+    # `with lock.read():` / `with lock.write():`, a plain object is
+    # a lot cheaper than a contextmanager on every document access.
+
+    def __init__(self, acquire, release):
+        self._acquire = acquire
+        self._release = release
+
+    def __call__(self):
+        return self
+
+    def __enter__(self):
+        self._acquire()
+
+    def __exit__(self, *exc):
+        self._release()
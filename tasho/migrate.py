@@ -0,0 +1,49 @@
+"""Rewrites the chunk files of a database in another chunk format.
+
+    python -m tasho.migrate DATABASE_DIRECTORY [CHUNK_FORMAT]
+"""
+import os
+import sys
+
+from .chunk import CHUNK_FORMAT, LEGACY_CHUNK_FORMAT
+from .console import Console
+from . import exceptions as _except
+
+
+def migrate(directory, chunk_format=CHUNK_FORMAT):
+    """
+    migrate(String:directory, Int:chunk_format) returns tasho.database.Database
+
+    Opens the database, checkpoints every table and rewrites every chunk
+    file in the given format, then records the format in the properties.
+    Returns the opened database.
+    """
+    from . import Database
+
+    if chunk_format not in (LEGACY_CHUNK_FORMAT, CHUNK_FORMAT):
+        raise _except.DatabaseOperationException("Unknown chunk format {}.".format(chunk_format))
+
+    database = Database.open(directory, append=False)
+    for table in database.tables.values():
+        table.checkpoint()
+        for chunk in table.chunks:
+            chunk.chunk_format = chunk_format
+            if os.path.exists(chunk.chunk_path):
+                chunk.initalize()
+                chunk.dirty = True
+        table.checkpoint()
+        Console.log(f'[{table.name}] Migrated {len(table.chunks)} chunks to format {chunk_format}')
+
+    database._update_properties(chunk_format=chunk_format)
+    database._chunk_format = chunk_format
+    for table in database.tables.values():
+        table.chunk_format = chunk_format
+    return database
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    migrate(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else CHUNK_FORMAT)
+    print("OK")
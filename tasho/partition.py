@@ -0,0 +1,116 @@
+import re
+import zlib
+
+# Table layouts, selected through the `layout` database option.
+#   append - new documents fill the active chunk, or older chunks
+#            with free space, and the key directory records where.
+#   hash   - keys are hash partitioned, every chunk is one partition
+#            and full partitions split in two (extendible hashing).
+LAYOUT_APPEND = "append"
+LAYOUT_HASH = "hash"
+LAYOUTS = (LAYOUT_APPEND, LAYOUT_HASH)
+
+# crc32 gives 32 bits, a partition can't be split any further than that.
+MAX_PARTITION_DEPTH = 32
+
+_SUFFIX = re.compile(r"-p(\d+)\.(\d+)$")
+
+
+def partition_hash(key):
+    """
+    partition_hash(String/Int:key) returns Int
+
+    Hash of a key that is the same in every process, unlike hash().
+    """
+    return zlib.crc32(str(key).encode("utf-8", "surrogatepass"))
+
+
+def partition_suffix(depth, bits):
+    return "-p{}.{}".format(depth, bits)
+
+
+def parse_partition(chunk_name):
+    """
+    parse_partition(String:chunk_name) returns (Int:depth, Int:bits)
+
+    Returns None for chunks that don't belong to a partition.
+    """
+    match = _SUFFIX.search(chunk_name)
+    if match is None:
+        return None
+    return int(match.group(1)), int(match.group(2))
+
+
+class Partitions():
+    """Partitions(List[String]:chunk_names) returns tasho.partition.Partitions
+
+            Extendible hash directory of a hash partitioned table. A chunk
+            holds the keys whose hash ends in `bits`, `depth` bits long,
+            both are part of the chunk's name (<table>-<token>-p<depth>.<bits>).
+            The directory is rebuilt from the chunk names alone, so the
+            table index, which is written atomically, is all that has to
+            be on disk for a split to take effect."""
+
+    def __init__(self, chunk_names=()):
+        self.partitions = {}
+        for name in chunk_names:
+            partition = parse_partition(name)
+            if partition is not None:
+                self.partitions[name] = partition
+
+        self.depth = max([x[0] for x in self.partitions.values()], default=0)
+        self.slots = [None] * (1 << self.depth)
+        for name, (depth, bits) in self.partitions.items():
+            for slot in range(bits, len(self.slots), 1 << depth):
+                self.slots[slot] = name
+
+    def __repr__(self):
+        return "<TashoDBPartitions Depth: {} Partitions: {}>".format(self.depth, len(self.partitions))
+
+    def __len__(self):
+        return len(self.partitions)
+
+    def chunk(self, key):
+        """
+        Partitions.chunk(String/Int:key) returns String
+
+        Returns the name of the chunk the key belongs to.
+        """
+        return self.slots[partition_hash(key) & (len(self.slots) - 1)]
+
+    def can_split(self, chunk_name):
+        return self.partitions[chunk_name][0] < MAX_PARTITION_DEPTH
+
+    def halves(self, chunk_name):
+        """
+        Partitions.halves(String:chunk_name) returns ((Int:depth, Int:bits), (Int:depth, Int:bits))
+
+        Returns the partitions a chunk splits into, keys with the next
+        bit of their hash set go to the second one.
+        """
+        depth, bits = self.partitions[chunk_name]
+        return (depth + 1, bits), (depth + 1, bits | 1 << depth)
+
+    def moves(self, chunk_name, key):
+        """
+        Partitions.moves(String:chunk_name, String/Int:key) returns Bool
+
+        Returns True if the key goes to the second half when the chunk splits.
+        """
+        depth = self.partitions[chunk_name][0]
+        return bool(partition_hash(key) >> depth & 1)
+
+    def split(self, chunk_name, low, high):
+        """
+        Partitions.split(String:chunk_name, String:low, String:high)
+
+        Replaces a chunk with its two halves, see Partitions.halves.
+        """
+        depth, bits = self.partitions.pop(chunk_name)
+        if depth == self.depth:
+            self.slots = self.slots * 2
+            self.depth += 1
+        for slot in range(bits, len(self.slots), 1 << depth):
+            self.slots[slot] = high if slot >> depth & 1 else low
+        self.partitions[low] = (depth + 1, bits)
+        self.partitions[high] = (depth + 1, bits | 1 << depth)
@@ -0,0 +1,84 @@
+from . import exceptions as _except
+
+SET = "$set"
+INC = "$inc"
+UNSET = "$unset"
+OPERATORS = (SET, INC, UNSET)
+
+_MISSING = object()
+
+
+def _number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _fields(fields):
+    # $unset takes a field, a list of them or a dict like the other operators.
+    return [fields] if isinstance(fields, str) else list(fields)
+
+
+def check_patch(patch):
+    """
+    check_patch(Dict:patch)
+
+    Raises DatabaseOperationException unless the patch only uses
+    $set, $inc and $unset, each field at most once.
+    """
+    if not isinstance(patch, dict) or not patch:
+        raise _except.DatabaseOperationException("A patch is a dict of {}.".format(", ".join(OPERATORS)))
+    seen = set()
+    for op, fields in patch.items():
+        if op not in OPERATORS:
+            raise _except.DatabaseOperationException("Unknown patch operator '{}'.".format(op))
+        if op == UNSET:
+            if not isinstance(fields, (str, list, tuple, set, dict)):
+                raise _except.DatabaseOperationException("$unset takes a list of fields.")
+            fields = _fields(fields)
+        elif not isinstance(fields, dict):
+            raise _except.DatabaseOperationException("{} takes a dict of fields.".format(op))
+        elif op == INC:
+            for field, amount in fields.items():
+                if not _number(amount):
+                    raise _except.DatabaseOperationException("Can't $inc '{}' by {!r}.".format(field, amount))
+        for field in fields:
+            if field in seen:
+                raise _except.DatabaseOperationException("'{}' is changed twice by the patch.".format(field))
+            seen.add(field)
+
+
+def diff(document, patch):
+    """
+    diff(Dict:document, Dict:patch) returns (Dict:set, List:unset)
+
+    Works out what a checked patch changes in a document, without changing
+    it: the new values of the fields it sets and the fields it removes.
+    Fields that already hold the value are left out. The values are
+    absolute ($inc is already added), so the result can be applied again.
+    """
+    sets = {}
+    for field, value in patch.get(SET, {}).items():
+        old = document.get(field, _MISSING)
+        if old is _MISSING or type(old) is not type(value) or old != value:
+            sets[field] = value
+    for field, amount in patch.get(INC, {}).items():
+        old = document.get(field, 0)
+        if not _number(old):
+            raise _except.DatabaseOperationException("Can't $inc '{}', it holds {!r}.".format(field, old))
+        if amount or field not in document:
+            sets[field] = old + amount
+    unset = [x for x in _fields(patch.get(UNSET, ())) if x in document]
+    return sets, unset
+
+
+def apply(document, delta):
+    """
+    apply(Dict:document, (Dict:set, List:unset):delta) returns Dict
+
+    Applies what diff returned to a document, in place.
+    """
+    sets, unset = delta
+    document.update(sets)
+    for field in unset:
+        document.pop(field, None)
+    return document
+
@@ -0,0 +1,322 @@
+import operator
+import re
+
+from .index import _hashable
+
+_MISSING = object()
+
+
+def _prefix(value, prefix):
+    return isinstance(value, str) and value.startswith(prefix)
+
+
+_OPERATORS = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "prefix": _prefix,
+}
+
+
+class Query():
+    """Base class of the declarative queries built through tasho.Field.
+
+            Queries can be combined with & (and), | (or) and ~ (not).
+            They are callables with the same (id, document) signature as
+            the lambdas accepted by Table.query, evaluated through a closure
+            compiled once per query, and unlike lambdas the table can plan
+            them against its secondary indexes (see Table.explain)."""
+
+    _evaluator = None
+
+    def __and__(self, other):
+        return And(self, other)
+
+    def __or__(self, other):
+        return Or(self, other)
+
+    def __invert__(self):
+        return Not(self)
+
+    def __call__(self, id, document):
+        if self._evaluator is None:
+            self._evaluator = self.compile()
+        return self._evaluator(id, document)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state.pop('_evaluator', None)
+        return state
+
+    def compile(self):
+        """
+        Query.compile() returns function(id, document)
+
+        Returns a plain function evaluating the query.
+        """
+        raise NotImplementedError
+
+
+class Condition(Query):
+    """Condition(String:field, String:op, Object:value) returns tasho.query.Condition
+
+            A single test against a document field. Operators are
+            ==, !=, <, <=, >, >=, prefix, in, exists and regex."""
+
+    OPERATORS = tuple(_OPERATORS) + ("in", "exists", "regex")
+
+    def __init__(self, field, op, value):
+        if op not in self.OPERATORS:
+            raise ValueError("Unknown operator '{}'".format(op))
+        self.field = field
+        self.op = op
+        self.value = value
+
+    def __repr__(self):
+        return "({} {} {!r})".format(self.field, self.op, self.value)
+
+    def compile(self):
+        field, op, value = self.field, self.op, self.value
+
+        # Documents usually have the field, so indexing and catching the
+        # KeyError is cheaper than a .get() with a sentinel.
+        if op == "==":
+            def evaluate(id, document):
+                try:
+                    return document[field] == value
+                except KeyError:
+                    return False
+        elif op == "!=":
+            def evaluate(id, document):
+                try:
+                    return document[field] != value
+                except KeyError:
+                    return False
+        elif op == "exists":
+            exists = bool(value)
+            def evaluate(id, document):
+                return (field in document) == exists
+        elif op == "in":
+            try:
+                values = frozenset(value)
+            except TypeError:
+                values = list(value)
+            def evaluate(id, document):
+                try:
+                    return document[field] in values
+                except (KeyError, TypeError):
+                    return False
+        elif op == "regex":
+            search = (re.compile(value) if isinstance(value, str) else value).search
+            def evaluate(id, document):
+                found = document.get(field, None)
+                return isinstance(found, str) and search(found) is not None
+        elif op == "prefix":
+            def evaluate(id, document):
+                found = document.get(field, None)
+                return isinstance(found, str) and found.startswith(value)
+        else:
+            compare = _OPERATORS[op]
+            def evaluate(id, document):
+                try:
+                    return compare(document[field], value)
+                except (KeyError, TypeError):
+                    return False
+        return evaluate
+
+
+class And(Query):
+
+    def __init__(self, *queries):
+        self.queries = []
+        for query in queries:
+            self.queries.extend(query.queries if isinstance(query, And) else [query])
+
+    def __repr__(self):
+        return "(" + " & ".join(repr(x) for x in self.queries) + ")"
+
+    def compile(self):
+        evaluators = [compile_query(x) for x in self.queries]
+        def evaluate(id, document):
+            for evaluator in evaluators:
+                if not evaluator(id, document):
+                    return False
+            return True
+        return evaluate
+
+
+class Or(Query):
+
+    def __init__(self, *queries):
+        self.queries = []
+        for query in queries:
+            self.queries.extend(query.queries if isinstance(query, Or) else [query])
+
+    def __repr__(self):
+        return "(" + " | ".join(repr(x) for x in self.queries) + ")"
+
+    def compile(self):
+        evaluators = [compile_query(x) for x in self.queries]
+        def evaluate(id, document):
+            for evaluator in evaluators:
+                if evaluator(id, document):
+                    return True
+            return False
+        return evaluate
+
+
+class Not(Query):
+
+    def __init__(self, query):
+        self.query = query
+
+    def __repr__(self):
+        return "~{!r}".format(self.query)
+
+    def compile(self):
+        evaluator = compile_query(self.query)
+        def evaluate(id, document):
+            return not evaluator(id, document)
+        return evaluate
+
+
+def compile_query(query):
+    """
+    compile_query(tasho.query.Query/function(id, document):query) returns function(id, document)
+
+    Returns the evaluator for a query, lambdas are returned as is.
+    """
+    return query.compile() if isinstance(query, Query) else query
+
+
+class Field():
+    """Field(String:name) returns tasho.query.Field
+
+            Builds queries for Table.query and Table.query_one.
+            Ex. Table.query(tasho.Field('age') > 50)
+                Table.query((tasho.Field('age') > 50) & tasho.Field('title').startswith('Nichi'))
+                Table.query(tasho.Field('genre').isin(['comedy', 'slice of life']))
+                Table.query(~tasho.Field('rating').exists())"""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return "<TashoDBField: {}>".format(self.name)
+
+    def __eq__(self, value):
+        return Condition(self.name, "==", value)
+
+    def __ne__(self, value):
+        return Condition(self.name, "!=", value)
+
+    def __lt__(self, value):
+        return Condition(self.name, "<", value)
+
+    def __le__(self, value):
+        return Condition(self.name, "<=", value)
+
+    def __gt__(self, value):
+        return Condition(self.name, ">", value)
+
+    def __ge__(self, value):
+        return Condition(self.name, ">=", value)
+
+    def startswith(self, prefix):
+        return Condition(self.name, "prefix", prefix)
+
+    def isin(self, values):
+        return Condition(self.name, "in", list(values))
+
+    def exists(self, exists=True):
+        return Condition(self.name, "exists", exists)
+
+    def matches(self, pattern):
+        return Condition(self.name, "regex", pattern)
+
+    __hash__ = object.__hash__
+
+
+class Plan():
+    """Plan(String:strategy, List:keys, List[String]:steps) returns tasho.query.Plan
+
+            How a table answers a query. strategy is either 'index', where
+            keys are the candidate ids found through the indexes, or 'scan'
+            where every chunk is read. Every candidate is still tested
+            against the full query."""
+
+    def __init__(self, strategy, keys=None, steps=None):
+        self.strategy = strategy
+        self.keys = keys
+        self.steps = steps or []
+
+    def __repr__(self):
+        return "<TashoDBPlan:{} {}>".format(self.strategy, "; ".join(self.steps))
+
+
+def _lookup(query, indexes):
+    # Returns (set of candidate ids, steps) or None if the
+    # indexes can't narrow the query down.
+    if isinstance(query, Condition):
+        index = indexes.get(query.field, None)
+        if index is None:
+            return None
+        if query.op in ("==", "in"):
+            # None and unhashable values are never indexed, only a scan finds them.
+            values = query.value if query.op == "in" else [query.value]
+            if any(x is None or not _hashable(x) for x in values):
+                return None
+        if query.op == "in":
+            keys = set()
+            for value in query.value:
+                keys.update(index.eq(value))
+        else:
+            keys = index.lookup(query.op, query.value)
+            if keys is None:
+                return None
+            keys = set(keys)
+        return keys, ["index {} {} {!r} -> {} ids".format(query.field, query.op, query.value, len(keys))]
+
+    if isinstance(query, And):
+        found = [x for x in (_lookup(q, indexes) for q in query.queries) if x is not None]
+        if not found:
+            return None
+        found.sort(key=lambda x: len(x[0]))
+        keys = set(found[0][0])
+        steps = list(found[0][1])
+        for other_keys, other_steps in found[1:]:
+            keys &= other_keys
+            steps.extend(other_steps)
+        if len(found) > 1:
+            steps.append("intersect -> {} ids".format(len(keys)))
+        return keys, steps
+
+    if isinstance(query, Or):
+        keys, steps = set(), []
+        for sub in query.queries:
+            found = _lookup(sub, indexes)
+            if found is None:
+                return None
+            keys |= found[0]
+            steps.extend(found[1])
+        steps.append("union -> {} ids".format(len(keys)))
+        return keys, steps
+
+    return None
+
+
+def plan(query, indexes):
+    """
+    plan(tasho.query.Query/function(id, document):query, Dict{String:tasho.index.Index}:indexes) returns tasho.query.Plan
+
+    Picks between index lookups and a full chunk scan for the query.
+    """
+    if not isinstance(query, Query):
+        return Plan("scan", steps=["callable, full scan"])
+    found = _lookup(query, indexes)
+    if found is None:
+        return Plan("scan", steps=["no usable index, full scan"])
+    return Plan("index", list(found[0]), found[1])
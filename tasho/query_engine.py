@@ -1,50 +1,109 @@
-from multiprocessing import Process, Pipe, Queue, Manager
-import secrets
-import dill 
+import multiprocessing
+import pickle
+
+try:
+    import dill
+except ImportError:
+    dill = None
+
+from . import exceptions as _except
+from .chunk import ChunkReader
+from .query import compile_query
+from .aggregate import accumulate
+from .console import Console
+
+
+def _dump_query(query):
+    # Declarative queries pickle as is, lambdas need dill.
+    try:
+        return ("pickle", pickle.dumps(query))
+    except (pickle.PicklingError, AttributeError, TypeError):
+        pass
+    if dill is not None:
+        return ("dill", dill.dumps(query))
+    raise _except.DatabaseOperationException(
+            "Query can't be sent to the worker processes, use a tasho.Field "
+            "query or install dill to run lambdas in parallel.")
+
+
+def _load_query(blob):
+    serializer, data = blob
+    if serializer == "dill":
+        return dill.loads(data)
+    return pickle.loads(data)
+
+
+def _scan_chunk(job):
+    # Runs in the worker process, only the matches are sent back.
+    chunk_path, blob, ids_only = job
+    match = compile_query(_load_query(blob))
+    reader = ChunkReader(chunk_path)
+    try:
+        if ids_only:
+            return [key for key, document in reader.items() if match(key, document)]
+        return [(key, document) for key, document in reader.items() if match(key, document)]
+    finally:
+        reader.close()
+
+
+def _aggregate_chunk(job):
+    # Runs in the worker process, only the partial states are sent back.
+    chunk_path, blob, aggregations, group_by = job
+    query = _load_query(blob)
+    reader = ChunkReader(chunk_path)
+    try:
+        return accumulate(reader.items(), aggregations, group_by,
+                          compile_query(query) if query is not None else None)
+    finally:
+        reader.close()
 
-import time
 
 class QueryEngine(object):
-    """docstring for QueryEngine"""
+    """QueryEngine(Int:worker_count) returns tasho.query_engine.QueryEngine
+
+            Pool of worker processes that scan chunk files. Workers are only
+            handed the chunk path and the query, load and filter the chunk
+            themselves and return the matching documents.
+            Used through Table.query(query, parallel=worker_count)."""
+
     def __init__(self, worker_count):
         self.worker_count = worker_count
-        self.queue = Queue()
-        self.manager = Manager()
-        self.workers = [] 
-        
-        for i in range(self.worker_count):
-            proc = Process(target=QueryEngine._worker, args=(self.queue, i))
-            self.workers.append(proc)
-            proc.start()
-
-
-    def _worker(queue, proc_id):
-        print(f"Running Worker {proc_id}")
-        while True:
-            time.sleep(0.1)
-            while not queue.empty():
-                print(f"[{proc_id}] Activate")
-                id, chunk, query, job, blocks = queue.get()
-                #print(f"[{proc_id}-{id}]Recieved Job for ({len(chunk.items)}){chunk}")
-                query = dill.loads(query)
-                blocks[chunk.name] = [x for x in chunk.items.items() if query(x[0], x[1])]
-                #print(f"[{proc_id}-{id}]Result ({len(blocks[chunk.name])}){chunk}")
-                job['count'] += 1
-
-
-    def query(self, query, chunks):
-        blocks = self.manager.dict()
-        job = self.manager.dict()
-        job['count'] = 0
-        query = dill.dumps(query)
-
-        for chunk in chunks:
-            _id = secrets.token_hex(8)
-            print(f"[{_id}]Registering Job for {chunk}")
-            self.queue.put([_id, chunk, query, job, blocks])
-
-        print("Waiting...")
-        while job['count'] < len(chunks):
-            time.sleep(0.1)
-
-        return [j for sub in list(blocks.values()) for j in sub]
+        self.pool = multiprocessing.Pool(worker_count)
+        Console.log(f'[QueryEngine] Started {worker_count} workers')
+
+    def __repr__(self):
+        return "<TashoDBQueryEngine Workers: {}>".format(self.worker_count)
+
+    def submit(self, query, chunk_paths, ids_only=False):
+        """
+        QueryEngine.submit(tasho.query.Query/function(id, document):query, List[String]:chunk_paths, Bool:ids_only) returns multiprocessing.pool.MapResult
+
+        Starts scanning the chunk files, results come back in chunk_paths order.
+        """
+        blob = _dump_query(query)
+        return self.pool.map_async(_scan_chunk, [(x, blob, ids_only) for x in chunk_paths], chunksize=1)
+
+    def query(self, query, chunk_paths, ids_only=False):
+        """
+        QueryEngine.query(tasho.query.Query/function(id, document):query, List[String]:chunk_paths, Bool:ids_only) returns List
+
+        Scans the chunk files and returns the (id, document) matches, or only the ids.
+        """
+        results = self.submit(query, chunk_paths, ids_only).get()
+        return [j for sub in results for j in sub]
+
+    def aggregate(self, query, chunk_paths, aggregations, group_by=None):
+        """
+        QueryEngine.aggregate(tasho.query.Query/function(id, document):query, List[String]:chunk_paths,
+                              List[tasho.aggregate.Aggregation]:aggregations, String/List[String]:group_by) returns multiprocessing.pool.MapResult
+
+        Starts aggregating the chunk files, every chunk's partial states
+        (see tasho.aggregate.accumulate) come back in chunk_paths order.
+        """
+        blob = _dump_query(query)
+        jobs = [(x, blob, aggregations, group_by) for x in chunk_paths]
+        return self.pool.map_async(_aggregate_chunk, jobs, chunksize=1)
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
@@ -0,0 +1,154 @@
+import queue
+import threading
+from concurrent.futures import Future, wait
+
+from .console import Console
+
+DEFAULT_COMMIT_WORKERS = 2
+DEFAULT_COMMIT_BACKLOG = 64
+
+
+class CommitScheduler():
+    """CommitScheduler(Int:workers, Int:backlog) returns tasho.scheduler.CommitScheduler
+
+            Writes chunk files on a bounded pool of worker threads.
+            - Writes to the same file never run at the same time, and a write
+              submitted while an older one for the same file is still queued
+              replaces it; both callers get the same future.
+            - At most `backlog` writes can be queued, CommitScheduler.submit
+              blocks past that until the disk catches up.
+            - Every write returns a concurrent.futures.Future, resolved once
+              the file is on disk. CommitScheduler.flush() waits for all of them."""
+
+    def __init__(self, workers=DEFAULT_COMMIT_WORKERS, backlog=DEFAULT_COMMIT_BACKLOG):
+        self.workers = workers
+        self.backlog = backlog
+        # Plain daemon threads rather than a ThreadPoolExecutor, which stops
+        # accepting work before the atexit commit runs.
+        self._queue = queue.Queue()
+        self._threads = []
+        self._slots = threading.BoundedSemaphore(backlog)
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._running = set()
+        self._futures = set()
+        self.submitted = 0
+        self.coalesced = 0
+        self.written = 0
+        self.failed = 0
+        self.peak_depth = 0
+
+    def __repr__(self):
+        return "<TashoDBCommitScheduler Workers: {} Queued: {}>".format(self.workers, self.depth)
+
+    @property
+    def depth(self):
+        """
+        CommitScheduler.depth returns Int
+        Returns the number of writes queued or in progress.
+        """
+        return len(self._pending) + len(self._running)
+
+    def stats(self):
+        return {
+            "submitted": self.submitted,
+            "coalesced": self.coalesced,
+            "written": self.written,
+            "failed": self.failed,
+            "depth": self.depth,
+            "peak_depth": self.peak_depth,
+        }
+
+    def submit(self, path, write):
+        """
+        CommitScheduler.submit(String:path, function():write) returns concurrent.futures.Future
+
+        Queues write() to be run for the file at path.
+        """
+        self._slots.acquire()
+        with self._lock:
+            self.submitted += 1
+            entry = self._pending.get(path, None)
+            if entry is not None:
+                entry[0] = write
+                self.coalesced += 1
+                self._slots.release()
+                return entry[1]
+
+            future = Future()
+            self._pending[path] = [write, future]
+            self._futures.add(future)
+            if path not in self._running:
+                self._dispatch(path)
+            self.peak_depth = max(self.peak_depth, self.depth)
+        return future
+
+    def flush(self, timeout=None):
+        """
+        CommitScheduler.flush(Float:timeout) returns Bool
+
+        Waits until every submitted write is on disk.
+        Returns False if the timeout ran out first.
+        """
+        with self._lock:
+            futures = list(self._futures)
+        done, not_done = wait(futures, timeout)
+        return not not_done
+
+    def shutdown(self):
+        self.flush()
+        for thread in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _dispatch(self, path):
+        self._running.add(path)
+        if len(self._threads) < self.workers and len(self._threads) < len(self._running):
+            thread = threading.Thread(target=self._worker, name="tasho-commit-{}".format(len(self._threads)), daemon=True)
+            self._threads.append(thread)
+            thread.start()
+        self._queue.put(path)
+
+    def _worker(self):
+        while True:
+            path = self._queue.get()
+            if path is None:
+                return
+            self._run(path)
+
+    def _run(self, path):
+        with self._lock:
+            write, future = self._pending.pop(path)
+        try:
+            write()
+        except BaseException as e:
+            self.failed += 1
+            Console.error(f'[CommitScheduler] Writing {path} failed: {e!r}')
+            future.set_exception(e)
+        else:
+            self.written += 1
+            future.set_result(path)
+        finally:
+            self._slots.release()
+            with self._lock:
+                self._futures.discard(future)
+                self._running.discard(path)
+                if path in self._pending:
+                    self._dispatch(path)
+
+
+_default_scheduler = None
+
+
+def default_scheduler():
+    """
+    default_scheduler() returns tasho.scheduler.CommitScheduler
+
+    Scheduler used by chunks that don't belong to a Database.
+    """
+    global _default_scheduler
+    if _default_scheduler is None:
+        _default_scheduler = CommitScheduler()
+    return _default_scheduler
@@ -0,0 +1,263 @@
+import os
+import marshal
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from . import exceptions as _except
+from .storage import atomic_write, DURABILITY_NONE
+from .console import Console
+
+
+class FileLock():
+    """FileLock(String:path) returns tasho.shared.FileLock
+
+            Exclusive advisory lock (flock) on a file, shared by every process
+            opening the database with multiprocess=True. Acquiring is counted,
+            the file lock is taken on the first acquire and dropped on the
+            matching last release. Threads of one process share the count,
+            callers keep them apart with their own locks."""
+
+    def __init__(self, path):
+        if fcntl is None:
+            raise _except.DatabaseInitException("multiprocess mode needs fcntl, it is only available on POSIX systems.")
+        self.path = path
+        self._fd = None
+        self._count = 0
+        self._mutex = threading.Lock()
+        self.waits = 0
+
+    def __repr__(self):
+        return "<TashoDBFileLock:{} Held: {}>".format(self.path, self.held)
+
+    @property
+    def held(self):
+        return self._count > 0
+
+    def acquire(self):
+        with self._mutex:
+            if self._count:
+                self._count += 1
+                return
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    self.waits += 1
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+            except BaseException:
+                os.close(fd)
+                raise
+            self._fd = fd
+            self._count = 1
+
+    def release(self):
+        with self._mutex:
+            self._count -= 1
+            if self._count:
+                return
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        self.acquire()
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class SharedTable():
+    """SharedTable(tasho.table.Table:table) returns tasho.shared.SharedTable
+
+            Keeps a table in step with other processes using the same database.
+            - Writers take the table's file lock (<table>.lock) on their first
+              change and keep it until the next checkpoint, which publishes
+              the changes and releases it.
+            - Every checkpoint bumps the table generation and stamps the
+              chunks, key directory and indexes it rewrote with it in
+              <table>.generation.
+            - Readers stat that file before each operation. Only when it was
+              replaced do they read it, and they only drop what has a newer
+              generation than the copy they hold."""
+
+    def __init__(self, table):
+        self.table = table
+        self.path = os.path.join(table.path, "{}.generation".format(table.name))
+        self.lock = FileLock(os.path.join(table.path, "{}.lock".format(table.name)))
+        # -1 until the generation file is read, so the first refresh loads everything.
+        self.generation = -1
+        self.chunks = {}
+        self.keys = -1
+        self.indexes = {}
+        self._listed = []
+        self._stamp = None
+        # Files of chunks this process merged or split away, removed once published.
+        self.retired = []
+        self.refreshes = 0
+        self.reloaded = 0
+        self.published = 0
+
+    def __repr__(self):
+        return "<TashoDBSharedTable:{} Generation: {}>".format(self.table.name, self.generation)
+
+    def stats(self):
+        return {
+            "generation": self.generation,
+            "refreshes": self.refreshes,
+            "reloaded_chunks": self.reloaded,
+            "published": self.published,
+            "lock_waits": self.lock.waits,
+        }
+
+    def refresh(self):
+        """
+        SharedTable.refresh() returns Bool
+
+        Catches up with the changes other processes published.
+        Returns True if anything had to be reloaded.
+        """
+        if self.lock.held or self._stat() == self._stamp:
+            return False
+        with self.table.lock.write():
+            return self._refresh()
+
+    def begin(self):
+        """
+        SharedTable.begin()
+
+        Takes the table's file lock ahead of a change and catches up with
+        other processes. The lock is kept until SharedTable.publish.
+        Callers hold Table.lock for writing.
+        """
+        if self.lock.held:
+            return
+        self.lock.acquire()
+        try:
+            self._refresh()
+            if self.table.wal.size:
+                # Left behind by a process that died before its checkpoint finished.
+                Console.warning(f'[{self.table.name}] Recovering the write-ahead log of another process')
+                self.table._replay_wal()
+                if not self.lock.held:
+                    # The replay's checkpoint published and let go of the lock,
+                    # other processes may have written since.
+                    self.lock.acquire()
+                    self._refresh()
+        except BaseException:
+            if self.lock.held:
+                self.lock.release()
+            raise
+
+    def publish(self, chunks=(), keys=False, indexes=()):
+        """
+        SharedTable.publish(List[String]:chunks, Bool:keys, List[String]:indexes)
+
+        Records what a checkpoint rewrote under a new generation and
+        releases the table's file lock.
+        """
+        if not self.lock.held:
+            return
+        try:
+            table = self.table
+            listed = table.chunk_ids
+            if chunks or keys or indexes or listed != self._listed or set(table.indexes) != set(self.indexes):
+                self.generation += 1
+                for name in chunks:
+                    self.chunks[name] = self.generation
+                if keys:
+                    self.keys = self.generation
+                for field in indexes:
+                    self.indexes[field] = self.generation
+                self.indexes = {x: self.indexes.get(x, self.generation) for x in table.indexes}
+                state = {
+                    "generation": self.generation,
+                    "chunks": [(x, self.chunks.setdefault(x, self.generation)) for x in listed],
+                    "keys": self.keys,
+                    "indexes": self.indexes,
+                }
+                atomic_write(self.path, marshal.dumps(state), table.durability != DURABILITY_NONE)
+                self._listed = listed
+                self._stamp = self._stat()
+                self.published += 1
+            for path in self.retired:
+                if os.path.exists(path):
+                    os.remove(path)
+            self.retired = []
+        finally:
+            self.lock.release()
+
+    def _stat(self):
+        # The file is always replaced, never rewritten in place,
+        # so a new inode means a new generation.
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def _refresh(self):
+        stamp = self._stat()
+        if stamp == self._stamp:
+            return False
+        self.refreshes += 1
+        self._stamp = stamp
+        if stamp is None:
+            return False
+        with open(self.path, "rb") as f:
+            state = marshal.loads(f.read())
+
+        table = self.table
+        listed = [name for name, _ in state["chunks"]]
+        names = set(listed)
+        for name, generation in state["chunks"]:
+            chunk = table.get_chunk_from_name(name)
+            if chunk is None:
+                table._add_chunk(name)
+            elif self.chunks.get(name, None) != generation:
+                self._drop_chunk(chunk)
+        for chunk in [x for x in table.chunks if x.name not in names]:
+            self._drop_chunk(chunk)
+            table.chunks.remove(chunk)
+            table._chunk_map.pop(chunk.name, None)
+        table.chunks_dirty = False
+        table._free = None
+        table._reload_partitions()
+
+        if state["keys"] != self.keys:
+            key_directory = table.db._load_key_directory(table.name)
+            if key_directory is not None:
+                table.key_directory = key_directory
+                table.key_directory_dirty = False
+
+        for field, generation in state["indexes"].items():
+            if field not in table.indexes or self.indexes.get(field, None) != generation:
+                index = table._load_index(field)
+                if index is not None:
+                    table.indexes[field] = index
+        for field in [x for x in table.indexes if x not in state["indexes"]]:
+            table.indexes.pop(field)
+
+        self.generation = state["generation"]
+        self.chunks = dict(state["chunks"])
+        self.keys = state["keys"]
+        self.indexes = dict(state["indexes"])
+        self._listed = listed
+        Console.log(f'[{table.name}] Refreshed to generation {self.generation}')
+        return True
+
+    def _drop_chunk(self, chunk):
+        if chunk.is_loaded or chunk._reader is not None:
+            self.reloaded += 1
+        if chunk.is_loaded and chunk._snapshots:
+            # The file has already been replaced, only loaded documents can be kept.
+            chunk._preserve()
+        if self.table.cache:
+            self.table.cache.forget(chunk)
+        chunk.dirty = False
+        chunk.version += 1
+        chunk.unload()
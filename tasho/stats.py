@@ -0,0 +1,186 @@
+import bisect
+import threading
+
+from .console import Console
+
+# Upper bounds, in seconds, of the latency histogram buckets.
+# Anything slower than the last one lands in an extra overflow bucket.
+LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+                   0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram():
+    """Histogram(List[Float]:buckets) returns tasho.stats.Histogram
+
+            Counts latencies into fixed buckets, percentiles are read off
+            the bucket bounds so recording stays O(log buckets)."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def __repr__(self):
+        return "<TashoDBHistogram Count: {}>".format(self.count)
+
+    def record(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, fraction):
+        """
+        Histogram.percentile(Float:fraction) returns Float
+
+        Upper bound of the bucket holding the given fraction of the
+        values, the largest value seen if that's the overflow bucket.
+        """
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(self.buckets[i], self.max) if i < len(self.buckets) else self.max
+        return self.max
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "total": self.total,
+            "mean": self.total / self.count if self.count else None,
+            "min": self.min,
+            "max": self.max,
+            "p50": self.percentile(0.5),
+            "p90": self.percentile(0.9),
+            "p99": self.percentile(0.99),
+            "buckets": {str(x): y for x, y in zip(self.buckets + ("inf",), self.counts) if y},
+        }
+
+
+class Stats():
+    """Stats(Bool:enabled, String:name, tasho.stats.Stats:parent) returns tasho.stats.Stats
+
+            Counters and latency histograms of a database, every table gets
+            a child (Stats.child) whose numbers are added to its parent's too.
+            Callers check Stats.enabled before measuring anything, so while
+            disabled the instrumentation costs one attribute lookup.
+            Hooks are called with (kind, name, value, table) for every
+            count ("count") and latency ("latency") recorded below the
+            Stats they were added to, to feed an external metrics system."""
+
+    def __init__(self, enabled=False, name=None, parent=None):
+        self.enabled = enabled
+        self.name = name
+        self.parent = parent
+        self.counters = {}
+        self.histograms = {}
+        self.hooks = []
+        self.children = []
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return "<TashoDBStats:{} Enabled: {}>".format(self.name, self.enabled)
+
+    def child(self, name):
+        """
+        Stats.child(String:name) returns tasho.stats.Stats
+
+        Returns the stats of a table, enabled along with this one.
+        """
+        child = Stats(self.enabled, name, self)
+        with self.lock:
+            self.children.append(child)
+        return child
+
+    def remove_child(self, child):
+        with self.lock:
+            if child in self.children:
+                self.children.remove(child)
+
+    def enable(self, enabled=True):
+        """
+        Stats.enable(Bool:enabled)
+
+        Turns collecting on or off here and in every child.
+        """
+        self.enabled = enabled
+        for child in list(self.children):
+            child.enable(enabled)
+
+    def disable(self):
+        self.enable(False)
+
+    def add_hook(self, hook):
+        """
+        Stats.add_hook(function(String:kind, String:name, Int/Float:value, String:table):hook)
+
+        Registers an exporter, see Stats. Hooks run on the thread that
+        recorded the value and should hand it off rather than block.
+        """
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        if hook in self.hooks:
+            self.hooks.remove(hook)
+
+    def count(self, name, value=1):
+        """
+        Stats.count(String:name, Int:value)
+
+        Adds to a counter.
+        """
+        self._record("count", name, value, self.name)
+
+    def observe(self, name, seconds):
+        """
+        Stats.observe(String:name, Float:seconds)
+
+        Records a latency in the histogram of that name.
+        """
+        self._record("latency", name, seconds, self.name)
+
+    def reset(self):
+        with self.lock:
+            self.counters = {}
+            self.histograms = {}
+        for child in list(self.children):
+            child.reset()
+
+    def snapshot(self):
+        """
+        Stats.snapshot() returns Dict
+
+        Returns the counters and a summary of every histogram.
+        """
+        with self.lock:
+            return {
+                "counters": dict(self.counters),
+                "latency": {x: y.snapshot() for x, y in self.histograms.items()},
+            }
+
+    def _record(self, kind, name, value, source):
+        with self.lock:
+            if kind == "count":
+                self.counters[name] = self.counters.get(name, 0) + value
+            else:
+                histogram = self.histograms.get(name, None)
+                if histogram is None:
+                    histogram = self.histograms[name] = Histogram()
+                histogram.record(value)
+        for hook in self.hooks:
+            try:
+                hook(kind, name, value, source)
+            except Exception as e:
+                Console.error(f'[Stats] Hook {hook!r} failed: {e!r}')
+        if self.parent is not None:
+            self.parent._record(kind, name, value, source)
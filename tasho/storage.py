@@ -0,0 +1,58 @@
+import os
+
+from . import polyfill
+
+# Durability modes, selected through the `durability` database option.
+#   none   - never fsync, the OS decides when data reaches the disk.
+#   batch  - fsync chunk and index files when they get written
+#            (checkpoints), the write-ahead log is not synced per commit.
+#   commit - like batch, but the write-ahead log is also synced
+#            on every Table.commit().
+DURABILITY_NONE = "none"
+DURABILITY_BATCH = "batch"
+DURABILITY_COMMIT = "commit"
+DURABILITY_MODES = (DURABILITY_NONE, DURABILITY_BATCH, DURABILITY_COMMIT)
+
+
+def fsync_directory(directory):
+    """
+    fsync_directory(String:directory)
+
+    Makes a rename inside the directory durable. Not every
+    platform allows opening a directory, those are skipped.
+    """
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def atomic_write(path, data, fsync=False):
+    """
+    atomic_write(String:path, Bytes:data, Bool:fsync)
+
+    Writes the data to a temporary file next to the target then
+    renames it over the target, so readers (and a crash) only ever
+    see either the old or the new file, never a truncated one.
+    """
+    tmp_path = "{}.tmp-{}".format(path, polyfill.hex_token(4))
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    if fsync:
+        fsync_directory(os.path.dirname(path) or ".")
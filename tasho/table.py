@@ -1,16 +1,40 @@
-import os, multiprocessing
-import glob, marshal
+import os
+import glob
+import heapq, itertools, operator, collections
+import math, time, contextlib, weakref
+from concurrent.futures import ThreadPoolExecutor
 
 from . import polyfill
+from . import exceptions as _except
 from .autogenerateid import AutoGenerateId
 
 from .document import Document
-from .chunk import Chunk
+from .chunk import Chunk, CHUNK_FORMAT, remove_chunk_file
+from .console import Console
+from .wal import WriteAheadLog, OP_WRITE, OP_DELETE, OP_UPDATE
+from .storage import atomic_write, DURABILITY_NONE, DURABILITY_BATCH, DURABILITY_COMMIT
+from .index import Index, sort_key
+from .codec import get_codec
+from .query import Query, Field, plan, compile_query
+from .locks import RWLock
+from .cache import QueryCache, DEFAULT_CACHED_QUERIES
+from .shared import SharedTable
+from .stats import Stats
+from .transaction import Transaction, TransactionState, Snapshot, DELETED
+from .patch import check_patch, diff, apply
+from .partition import Partitions, partition_suffix, LAYOUT_APPEND, LAYOUT_HASH
+from .aggregate import Aggregation, Count, Min, Max, Distinct, accumulate, merge_groups, group_results
+
+DEFAULT_CHECKPOINT_SIZE = 4 * 1024 * 1024
+# Chunks filled below this fraction of the chunk size are merged by Table.compact.
+DEFAULT_COMPACT_THRESHOLD = 0.5
 
 
 class Table():
 
-    def __init__(self, table_name, path, chunk_ids = [], auto_commit=True, chunk_size=8192, db=None):
+    def __init__(self, table_name, path, chunk_ids = [], auto_commit=True, chunk_size=8192, db=None, key_directory=None,
+                 checkpoint_size=DEFAULT_CHECKPOINT_SIZE, durability=DURABILITY_BATCH, cache=None,
+                 chunk_format=CHUNK_FORMAT, codec=None, scheduler=None, layout=LAYOUT_APPEND, stats=None):
         self.name = table_name
         self.path = path
         self.chunks = []
@@ -19,12 +43,62 @@ class Table():
         self.db = db
         self.__is_dropped = False
         self.indexes = {}
+        self._chunk_map = {}
+        self.chunks_dirty = False
+        self.durability = durability
+        self.cache = cache
+        self.chunk_format = chunk_format
+        self.codec = get_codec(codec)
+        self.scheduler = scheduler
+        # Counters and latencies, see Table.stats. A child of the database's.
+        self.metrics = stats if stats is not None else Stats(name=table_name)
+        # Structural lock. Writes to existing keys hold it for reading,
+        # anything that changes the chunk list, moves keys between chunks
+        # or rebuilds the key directory or indexes, and checkpoints, hold
+        # it for writing. Reads don't take it. The one other change to the
+        # key directory is adding a key to a hash partition, under the read
+        # lock (see _insert). A single assignment is atomic, so readers that
+        # walk the whole directory without the write lock copy it first.
+        self.lock = RWLock()
+        # Set by Table.share when other processes use the same files.
+        self.shared = None
+        # Off until Table.enable_query_cache.
+        self.query_cache = None
+        self.named_queries = {}
+        # The transaction each thread has open, see Table.transaction.
+        self._transactions = TransactionState()
+        # Set while Table._apply runs, nothing may be committed before its batch is logged.
+        self._applying = False
 
         for c_id in chunk_ids:
-            chunk_path = os.path.join(self.path, c_id)
-            self.chunks.append(
-                    Chunk(c_id, chunk_path, self.chunk_size))
+            self._add_chunk(c_id)
+        self.chunks_dirty = False
+
+        # Hash partitioned tables place keys by their hash, see tasho.partition.
+        self.layout = layout
+        self.partitions = Partitions(chunk_ids) if layout == LAYOUT_HASH else None
+
+        # Writes are logged to the table's WAL and only checkpointed
+        # into the chunk files once the log grows past checkpoint_size.
+        self.wal = WriteAheadLog(os.path.join(self.path, "{}.wal".format(self.name)))
+        self.checkpoint_size = checkpoint_size
+
+        # key -> chunk name, lets point operations go straight to
+        # the chunk holding the key instead of scanning every chunk.
+        self.key_directory = key_directory
+        self.key_directory_dirty = False
+        if self.key_directory is None:
+            self._rebuild_key_directory()
+        elif not all(x in self._chunk_map for x in set(self.key_directory.values())):
+            # Written by a compaction that didn't get to finish, the chunk list is right.
+            Console.warning(f'[{self.name}] Key directory refers to unknown chunks, rebuilding it')
+            self._rebuild_key_directory()
 
+        # Chunks that documents were deleted from and may have room for
+        # new ones, worked out again on the next insert when None.
+        self._free = None
+
+        self.initialize_index()
 
 
     def __repr__(self):
@@ -35,25 +109,126 @@ class Table():
 
 
     def initialize_index(self):
-        for index in glob.glob(os.path.join(self.path, "{}-*.index".format(self.name))):
-            with open(index, "rb") as f:
-                self.indexes.update(marshal.loads(f.read()))
+        """
+        Table.initialize_index()
+
+        Loads the table's secondary indexes from disk. Called when the table is opened.
+        """
+        if self.db:
+            index_paths = self.db._index_files(self.name)
+        else:
+            index_paths = glob.glob(os.path.join(self.path, "{}-*.index".format(self.name)))
+        for index_path in index_paths:
+            with open(index_path, "rb") as f:
+                index = Index.loads(f.read(), self.codec)
+            if index is None:
+                # Snapshot index from an older version, rebuild it as a live one.
+                field = os.path.basename(index_path)[len(self.name) + 1:-len(".index")]
+                Console.log(f'[{self.name}] Rebuilding index {field}')
+                self.create_index(field)
+            elif index_path == self._index_path(index.field):
+                self.indexes[index.field] = index
+
+    def share(self):
+        """
+        Table.share()
+
+        Switches the table to multi-process mode, used by databases opened
+        with multiprocess=True. See tasho.shared.SharedTable.
+        """
+        with self.lock.write():
+            self.shared = SharedTable(self)
+            self.shared.begin()
+            self.shared.publish()
+
+    def enable_query_cache(self, max_queries=DEFAULT_CACHED_QUERIES, max_ids=None):
+        """
+        Table.enable_query_cache(Int:max_queries, Int:max_ids) returns tasho.cache.QueryCache
+
+        Caches the ids matched by declarative and registered queries that
+        scan the table (see tasho.cache.QueryCache). After a write only the
+        chunks it touched are scanned again. Queries answered from the
+        indexes aren't cached, they don't scan in the first place.
+        """
+        self.query_cache = QueryCache(max_queries, max_ids)
+        return self.query_cache
+
+    def disable_query_cache(self):
+        self.query_cache = None
+
+    def register_query(self, name, query):
+        """
+        Table.register_query(String:name, tasho.query.Query/function(id, document):query)
+
+        Registers a query under a name, Table.query, query_one, explain and
+        aggregate then take the name in place of the query. Unlike other
+        lambdas, registered ones can have their results cached.
+        """
+        self.named_queries[name] = query
+        if self.query_cache is not None:
+            self.query_cache.forget(("named", name))
+
+    def transaction(self):
+        """
+        Table.transaction() returns tasho.transaction.Transaction
+
+        Groups writes so they are applied together or not at all. Inserts,
+        updates and deletes made in the `with` block, through the transaction or
+        the table on this thread, are held back and applied when it ends,
+        logged as one write-ahead log record and committed. An exception
+        in the block discards them. Blocks nest into the outermost one.
+        Ex. with table.transaction():
+                table.insert('001', {'title': 'Nichijou', 'episodes': 24})
+                table.delete('002')
+        """
+        transaction = self._transactions.current
+        return transaction if transaction is not None else Transaction(self)
+
+    def snapshot(self):
+        """
+        Table.snapshot() returns tasho.transaction.Snapshot
+
+        Returns a read-only view of the table as it is now, that writes
+        made afterwards don't show up in. Taking it only registers it with
+        the chunks, a chunk is copied (not its documents) the first time
+        it's written to while the snapshot is open.
+        Ex. with table.snapshot() as snapshot:
+                for key, document in snapshot.items():
+                    ...
+        """
+        return Snapshot(self)
 
     def create_index(self, field):
-        index = {}
-        for chunk in self.chunks:
-            for id, document in chunk.items.items():
-                field_data = document.get(field, None)
-                if field_data:
-                    if index.get(field_data):
-                        index[field_data].append((chunk.name, id))
-                    else:
-                        index[field_data] = [(chunk.name, id)]
-        
-        with open(os.path.join(self.path, "{}-{}.index".format(self.name, field)), "wb") as f:
-            f.write(marshal.dumps({field: index}))
-
-        self.indexes.update({field: index})
+        """
+        Table.create_index(String:field) returns tasho.index.Index
+
+        Creates a secondary index on a field. The index is kept up to date
+        on every insert and delete, and Table.query uses it for conditions
+        built with tasho.Field that target the field.
+        """
+        with self.lock.write():
+            self._begin()
+            index = Index(field)
+            for key, document in self.items():
+                index.update(key, document)
+            self.indexes[field] = index
+            self._write_index(index)
+            self._publish()
+        return index
+
+    def drop_index(self, field):
+        """
+        Table.drop_index(String:field)
+
+        Removes the secondary index on a field.
+        """
+        with self.lock.write():
+            self._begin()
+            self.indexes.pop(field, None)
+            index_path = self._index_path(field)
+            if os.path.exists(index_path):
+                os.remove(index_path)
+            self._publish()
 
     @property
     def active_chunk(self):
@@ -86,8 +261,8 @@ class Table():
         Table.items() returns (String/int:id, Dict:document)
         Returns a generator going through all of the items in the table. 
         """
-        for i in range(len(self.chunks) -1, -1, -1):
-            for item in self.chunks[i].items.items():
+        for chunk in self.chunks[::-1]:
+            for item in chunk.iter_items():
                 yield item
 
 
@@ -95,15 +270,46 @@ class Table():
         """
         Table.bulk_insert(Dict{id:data}) returns None
 
-        Insert, but in bulk.
+        Insert, but in bulk. See Table.bulk_load.
         """ 
-        c_auto_commit = self.auto_commit
-        self.auto_commit = False 
-        for _id, value in data.items():
-            self.insert(_id, value)
+        self.bulk_load(data.items())
 
-        self.commit()
-        self.auto_commit = c_auto_commit
+
+    def bulk_load(self, items):
+        """
+        Table.bulk_load(Iterable[(String/Int:key, Dict:value)]:items) returns Dict
+
+        Loads documents straight into chunks, skipping the write-ahead log.
+        Chunks are handed to the commit scheduler as soon as they are full
+        and unloaded once written, so any number of documents can be streamed
+        from a generator. Existing keys are overwritten in place.
+        The load is only durable once bulk_load returns.
+        Returns the number of documents and chunks written and the throughput.
+        """
+        started = time.time()
+        if isinstance(items, dict):
+            items = items.items()
+
+        with self.lock.write():
+            self._begin()
+            # Full chunks are written as the load goes, the key directory
+            # and indexes only at the end. Until then the marker has
+            # _recover_bulk_load rebuild them from the chunks.
+            atomic_write(self._loading_path, b"", self.durability != DURABILITY_NONE)
+            count, created = self._bulk_load(items)
+            self.checkpoint()
+            os.remove(self._loading_path)
+
+        elapsed = time.time() - started
+        stats = {
+            "documents": count,
+            "chunks": created,
+            "seconds": elapsed,
+            "documents_per_second": count / elapsed if elapsed else float(count),
+        }
+        Console.log(f'[{self.name}] Bulk loaded {count} documents into {created} new chunks '
+                    f'in {elapsed:.2f}s ({stats["documents_per_second"]:.0f}/s)')
+        return stats
 
 
     def insert(self, key, value):
@@ -111,24 +317,120 @@ class Table():
         Table.insert(String/Int:key, Dict:value) returns String
 
         Adds a document to the table. If Table.auto_commit is
-        set to true, then the whole table gets commited to disk.
+        set to true, then the write gets logged to disk.
         Returns the chunk name.
         """
+        transaction = self._transactions.current
+        if transaction is not None:
+            return transaction.insert(key, value)
+        if self.shared:
+            # Other processes' changes have to be in before this one.
+            with self.lock.write():
+                self._begin()
+                return self._insert(key, value)
+        return self._insert(key, value)
+
+    def _insert(self, key, value):
         if key == AutoGenerateId:
             key = polyfill.hex_token(8)
 
-        chunk = self.get_chunk(key)
-        if chunk:
-            chunk.write(key, value, self.auto_commit)
-        else:
-            if self.active_chunk.is_full:
-                self._new_chunk()
-                self.commit()
-            self.active_chunk.write(key, value, self.auto_commit)
-        
+        chunk = None
+        if key in self.key_directory:
+            with self.lock.read():
+                chunk = self.get_chunk(key)
+                if chunk is not None:
+                    self._write(chunk, key, value)
+
+        elif self.partitions is not None:
+            # A key's partition can't change while the table is read locked,
+            # so new keys only need the write lock to split a full partition.
+            # Inserts of the same key go to the same chunk and are ordered by
+            # its lock, writing out or reshaping the directory takes the write lock.
+            with self.lock.read():
+                chunk = self.get_chunk(key) or self._place(key)
+                self._write(chunk, key, value)
+                self.key_directory[key] = chunk.name
+                self.key_directory_dirty = True
+            if len(chunk._data) > self.chunk_size:
+                with self.lock.write():
+                    if chunk.name in self._chunk_map and len(chunk._data) > self.chunk_size:
+                        self._split(chunk)
+
+        if chunk is None:
+            with self.lock.write():
+                chunk = self.get_chunk(key)
+                if chunk is None:
+                    chunk = self._place(key)
+                    self._write(chunk, key, value)
+                    self.key_directory[key] = chunk.name
+                    self.key_directory_dirty = True
+                else:
+                    self._write(chunk, key, value)
+
+        if self.auto_commit:
+            self.commit()
+
         return self.get(key)
 
 
+    def update(self, key, patch):
+        """
+        Table.update(String/Int:key, Dict:patch) returns tasho.database.Document
+
+        Changes some fields of a document instead of writing all of it.
+        The patch takes "$set" {field: value}, "$inc" {field: number},
+        a missing field counting as 0, and "$unset" [field]. Only the
+        changed fields are logged and only the indexes on them updated.
+        Returns None if there's no document with that key.
+        Ex. table.update('001', {'$set': {'title': 'Nichijou'}, '$inc': {'rating': 1}})
+        """
+        transaction = self._transactions.current
+        if transaction is not None:
+            return transaction.update(key, patch)
+        check_patch(patch)
+        if self.shared:
+            with self.lock.write():
+                self._begin()
+                document = self._update(key, patch)
+        else:
+            document = self._update(key, patch)
+        if document is None:
+            return None
+        if self.auto_commit:
+            self.commit()
+        return Document((key, document), self)
+
+    def update_many(self, query, patch):
+        """
+        Table.update_many(tasho.query.Query/function(id, document):query, Dict:patch) returns Int
+
+        Applies a patch (see Table.update) to every document matching
+        the query and commits once. Documents are checked against the
+        query again as they are changed, ones that stopped matching
+        in between are left alone.
+        Returns the number of documents that matched.
+        """
+        query = self._resolve(query)
+        transaction = self._transactions.current
+        if transaction is not None:
+            return transaction.update_many(query, patch)
+        check_patch(patch)
+        started = time.perf_counter() if self.metrics.enabled else None
+        match = compile_query(query)
+        with self.lock.write() if self.shared else contextlib.nullcontext():
+            self._begin()
+            count = 0
+            for key in [x for x, _ in self._matches(query)]:
+                if self._update(key, patch, match) is not None:
+                    count += 1
+        if count and self.auto_commit:
+            self.commit()
+        if started is not None:
+            self.metrics.count("update_many")
+            self.metrics.count("documents_updated", count)
+            self.metrics.observe("update_many", time.perf_counter() - started)
+        return count
+
     def new_document(self, key, value):
         """
         Table.new_document(String/Int:key, Dict:value) returns Document
@@ -148,10 +450,18 @@ class Table():
         Documents are usually deleted through Document.delete().
         Returns True if the tablew as sucessfully deleted.
         """
-        chunk = self.get_chunk(key)
-        if chunk:
-            return chunk.delete(key)
-        return False
+        transaction = self._transactions.current
+        if transaction is not None:
+            return transaction.delete(key)
+        with self.lock.write():
+            self._begin()
+            chunk = self.get_chunk(key)
+            if not chunk:
+                return False
+            deleted = self._delete(chunk, key)
+        if self.auto_commit:
+            self.commit()
+        return deleted
 
 
     def raw_get(self, key):
@@ -160,9 +470,16 @@ class Table():
 
         Retrieves a document in it's dictonary form] as the document.
         """
-        for chunk in self.chunks:
-            if key in chunk.items:
-                return chunk.items[key]
+        transaction = self._transactions.current
+        if transaction is not None:
+            return transaction.raw_get(key)
+        return self._raw_get(key)
+
+    def _raw_get(self, key):
+        self._refresh()
+        chunk = self.get_chunk(key)
+        if chunk:
+            return chunk.get(key, None)
         return None
 
 
@@ -172,26 +489,126 @@ class Table():
 
         Retrieves and returns a Document object.
         """
-        for chunk in self.chunks:
-            nugget = chunk.items.get(key, None)
-            if nugget:
-                return Document((key, nugget), self)
+        nugget = self.raw_get(key)
+        if nugget is not None:
+            return Document((key, nugget), self)
         return None
 
 
+    def get_many(self, keys, as_dict=False, raw=False, parallel=None):
+        """
+        Table.get_many(List[String/Int]:keys, Bool:as_dict, Bool:raw, Int:parallel) returns List[tasho.database.Document]
+
+        Retrieves several documents at once. The keys are grouped by chunk
+        so every chunk is only read once, `parallel` reads the chunks that
+        aren't loaded on that many threads.
+        Returns the documents in the order of the keys with None for the
+        missing ones, or with `as_dict` a dictionary of the keys that were
+        found. `raw` returns the dictionaries instead of Documents.
+        Ex. Table.get_many(['001', '002', '404'])
+            -> [<TashoDBDocument:001>, <TashoDBDocument:002>, None]
+        """
+        self._refresh()
+        keys = list(keys)
+        grouped = {}
+        for key in dict.fromkeys(keys):
+            chunk = self.get_chunk(key)
+            if chunk is not None:
+                grouped.setdefault(chunk, []).append(key)
+
+        def read(group):
+            chunk, chunk_keys = group
+            return zip(chunk_keys, chunk.get_many(chunk_keys))
+
+        warm, cold = [], []
+        for group in grouped.items():
+            (warm if group[0].is_loaded else cold).append(group)
+        found = [read(x) for x in warm]
+        if parallel and len(cold) > 1:
+            with ThreadPoolExecutor(min(parallel, len(cold)), thread_name_prefix="tasho-read") as executor:
+                found += executor.map(read, cold)
+        else:
+            found += [read(x) for x in cold]
+
+        documents = {}
+        for pairs in found:
+            for key, document in pairs:
+                if document is not None:
+                    documents[key] = document if raw else Document((key, document), self)
+        if as_dict:
+            return documents
+        return [documents.get(x, None) for x in keys]
+
+
     def get_indexed(self, index, query):
-        return [[self.get(id) for id in ids[0]] for x, ids in self.indexes[index].items() if query(id, x)]
+        """
+        Table.get_indexed(String:index, Object/function(value):query) returns List[tasho.database.Document]
+
+        Retrieves documents through a secondary index. The query is
+        either a value to match or a callable that filters the indexed values.
+        None and unhashable values aren't indexed, the table is scanned for
+        them, and the callable never sees them.
+        Ex. Table.get_indexed('rating', 99)
+            Table.get_indexed('rating', lambda rating: rating > 50)
+        """
+        self._refresh()
+        index = self.indexes[index]
+        if callable(query):
+            with index.lock:
+                entries = list(index.entries.items())
+            keys = [key for value, ids in entries if query(value) for key in ids]
+        else:
+            keys = index.eq(query)
+            if keys is None:
+                return self.query(Field(index.field) == query)
+        return [Document(x, self) for x in self._fetch(keys)]
 
 
-    def query(self, query):
+    def query(self, query, parallel=None, limit=None, offset=0, order_by=None, reverse=False, fields=None, lazy=False):
         """
-        Table.query(function(id, document)) returns List[tasho.database.Document]
+        Table.query(function(id, document):query, Int:parallel, Int:limit, Int:offset,
+                    String:order_by, Bool:reverse, List[String]:fields, Bool:lazy) returns List[tasho.database.Document]
 
         Queries the table using the callable as the filter.
         Ex. Table.query(lambda id, document: document['age'] > 50)
             - Returns all documents with the 'age' property greater than 50.
+        Declarative queries built with tasho.Field are planned against
+        the table's indexes instead of always scanning the table.
+        Ex. Table.query((tasho.Field('age') > 50) & (tasho.Field('status') == 'active'))
+        Scans can be split over `parallel` worker processes which read the
+        chunk files themselves. Lambdas need `dill` to run in parallel.
+
+        `limit` and `offset` page through the matches, `order_by` sorts them
+        by a field (walking the field's index if there is one) and `fields`
+        returns dictionaries with only those fields instead of Documents.
+        With `lazy` a generator is returned that reads the table chunk by
+        chunk and stops as soon as the limit is reached.
+        Ex. Table.query(tasho.Field('age') > 50, order_by='age', limit=20, offset=40, lazy=True)
         """
-        return [Document(x, self) for x in self.items() if query(x[0], x[1])]
+        started = time.perf_counter() if self.metrics.enabled else None
+        self._refresh()
+        query = self._resolve(query)
+        if order_by is not None:
+            matches = self._ordered(query, order_by, reverse,
+                                    offset + limit if limit is not None else None)
+        else:
+            matches = self._matches(query, parallel)
+
+        if offset or limit is not None:
+            matches = itertools.islice(matches, offset, offset + limit if limit is not None else None)
+
+        if fields is not None:
+            results = (self._project(x, fields) for x in matches)
+        else:
+            results = (Document(x, self) for x in matches)
+        if lazy:
+            return results
+        results = list(results)
+        if started is not None:
+            self.metrics.count("queries")
+            self.metrics.count("documents_returned", len(results))
+            self.metrics.observe("query", time.perf_counter() - started)
+        return results
 
 
     def query_one(self, query):
@@ -200,9 +617,154 @@ class Table():
 
         Same as Table.query but stops at the first match.
         """
-        for data in self.items():
-            if query(data[0], data[1]):
-                return Document(data, self)
+        self._refresh()
+        query = self._resolve(query)
+        for data in self._matches(query):
+            return Document(data, self)
+
+
+    def explain(self, query):
+        """
+        Table.explain(tasho.query.Query/function(id, document):query) returns Dict
+
+        Describes how Table.query would answer the query without running it.
+        """
+        self._refresh()
+        query = self._resolve(query)
+        query_plan = plan(query, self.indexes)
+        return {
+            "query": repr(query),
+            "strategy": query_plan.strategy,
+            "steps": query_plan.steps,
+            "candidates": len(query_plan.keys) if query_plan.keys is not None else len(self.key_directory),
+            "chunks": len(self.chunks) if query_plan.keys is None
+                      else len({self.key_directory.get(x) for x in query_plan.keys} - {None}),
+        }
+
+
+    def aggregate(self, query=None, group_by=None, parallel=None, **aggregations):
+        """
+        Table.aggregate(tasho.query.Query/function(id, document):query, String/List[String]:group_by,
+                        Int:parallel, **tasho.aggregate.Aggregation) returns Dict
+
+        Computes the named aggregations (tasho.Count, Sum, Avg, Min, Max,
+        Distinct) over the documents matching the query, or the whole table.
+        With group_by the results are split by the value of a field, or by
+        the tuple of values of several fields.
+        Every chunk is aggregated on its own and the partial results are
+        merged, `parallel` hands the chunks that aren't loaded to worker
+        processes. Without a query, counts per value of an indexed field
+        and min, max and distinct values of one are read from the index.
+        Ex. Table.aggregate(shows=tasho.Count(), rating=tasho.Avg('rating'))
+            -> {'shows': 120, 'rating': 81.5}
+            Table.aggregate(tasho.Field('year') > 2000, group_by='studio', shows=tasho.Count())
+            -> {'Kyoto Animation': {'shows': 12}, 'Shaft': {'shows': 9}, ...}
+        """
+        started = time.perf_counter() if self.metrics.enabled else None
+        names = list(aggregations)
+        aggregations = [aggregations[x] for x in names]
+        for aggregation in aggregations:
+            if not isinstance(aggregation, Aggregation):
+                raise TypeError("{!r} is not an aggregation, use tasho.Count, Sum, Avg, Min, Max or Distinct.".format(aggregation))
+
+        self._refresh()
+        query = self._resolve(query)
+        groups = None
+        if query is None:
+            groups = self._aggregate_indexed(aggregations, group_by)
+        if groups is None and parallel and self.db and plan(query, self.indexes).strategy == "scan":
+            try:
+                groups = self._aggregate_parallel(query, aggregations, group_by, parallel)
+            except _except.DatabaseOperationException as e:
+                Console.warning(f'[{self.name}] {e} Aggregating serially.')
+        if groups is None:
+            groups = self._aggregate_chunks(query, aggregations, group_by)
+        if started is not None:
+            self.metrics.count("aggregations")
+            self.metrics.observe("aggregate", time.perf_counter() - started)
+        return group_results(groups, names, aggregations, group_by)
+
+
+    def fragmentation(self, threshold=DEFAULT_COMPACT_THRESHOLD):
+        """
+        Table.fragmentation(Float:threshold) returns Dict
+
+        Describes how full the table's chunks are. Chunks holding less
+        than `threshold` of the chunk size count as sparse, `reclaimable`
+        is how many chunks a full compaction could save.
+        """
+        self._refresh()
+        counts = collections.Counter(list(self.key_directory.values()))
+        sizes = [counts[x.name] for x in self.chunks]
+        documents = sum(sizes)
+        capacity = len(sizes) * self.chunk_size
+        return {
+            "chunks": len(sizes),
+            "documents": documents,
+            "fill": documents / capacity if capacity else 0.0,
+            "sparse": sum(1 for x in sizes if x < self.chunk_size * threshold),
+            "empty": sizes.count(0),
+            "reclaimable": len(sizes) - max(1, math.ceil(documents / self.chunk_size)),
+        }
+
+
+    def stats(self):
+        """
+        Table.stats() returns Dict
+
+        Returns the table's counters and latency histograms (collected
+        while the database's stats are enabled, see tasho.stats.Stats)
+        along with its current size, write-ahead log and query cache usage.
+        Ex. Table.stats()['latency']['query']['p99']
+        """
+        stats = self.metrics.snapshot()
+        stats.update({
+            "chunks": len(self.chunks),
+            "loaded_chunks": sum(1 for x in self.chunks if x.is_loaded),
+            "documents": len(self.key_directory),
+            "wal": {"size": self.wal.size, "bytes_written": self.wal.written, "pending": len(self.wal.pending)},
+            "query_cache": self.query_cache.stats() if self.query_cache is not None else None,
+        })
+        if self.shared:
+            stats["shared"] = self.shared.stats()
+        return stats
+
+
+    def compact(self, threshold=DEFAULT_COMPACT_THRESHOLD):
+        """
+        Table.compact(Float:threshold) returns Dict
+
+        Merges the chunks holding less than `threshold` of the chunk size
+        into as few chunks as possible, empty chunks are removed.
+        The merged chunks are written under new names before the table
+        index and key directory switch over to them, so a crash part way
+        leaves either the old or the new layout on disk.
+        Returns the fragmentation before and after.
+        """
+        started = time.time()
+        with self.lock.write():
+            # The log refers to chunks by name, it has to be empty before any go away.
+            self.checkpoint()
+            self._begin()
+            sparse, merged = [], []
+            try:
+                before = self.fragmentation(threshold)
+                sparse, merged = self._compact(threshold)
+            finally:
+                if self.shared:
+                    self.shared.publish([x.name for x in merged], bool(sparse), ())
+
+        elapsed = time.time() - started
+        stats = {
+            "before": before,
+            "after": self.fragmentation(threshold),
+            "merged": len(sparse),
+            "created": len(merged),
+            "seconds": elapsed,
+        }
+        if sparse:
+            Console.log(f'[{self.name}] Compacted {len(sparse)} chunks into {len(merged)} in {elapsed:.2f}s')
+        return stats
 
 
     def commit(self):
@@ -210,34 +772,748 @@ class Table():
         Table.commit()
 
         Writes all of the unsaved changes to the disk.
+        Changes are appended to the table's write-ahead log, the
+        chunks themselves are rewritten once the log gets large.
+        In multi-process mode every commit is a checkpoint, which is
+        what makes the changes visible to the other processes.
         """
-        for chunk in self.dirty:
-           chunk.commit()
-        # for chunk in [chunk for chunk in self.chunks if chunk.dirty]:
-        #     chunk.commit()
+        started = time.perf_counter() if self.metrics.enabled else None
+        if self.shared:
+            if self.shared.lock.held:
+                self.checkpoint()
+        else:
+            self.wal.flush(self.durability == DURABILITY_COMMIT)
+            if self.chunks_dirty and self.db:
+                self.chunks_dirty = False
+                self.db.commit_table_index(self)
 
-        if self.db:
-            self.db.commit_table_index()
+            if self.wal.size >= self.checkpoint_size:
+                self.checkpoint()
+        if started is not None:
+            self.metrics.count("commits")
+            self.metrics.observe("commit", time.perf_counter() - started)
+
+
+    def checkpoint(self):
+        """
+        Table.checkpoint()
+
+        Writes the dirty chunks to disk and empties the write-ahead log.
+        """
+        started = time.perf_counter() if self.metrics.enabled else None
+        # Writers are held off so nothing lands between the chunk
+        # snapshots and emptying the log.
+        with self.lock.write():
+            self._begin()
+            self.wal.flush()
+            # Chunks are written in parallel by the commit scheduler, the log
+            # can only be emptied once all of them are on disk.
+            dirty = self.dirty
+            for future in [chunk.commit() for chunk in dirty]:
+                future.result()
+
+            indexes = [x for x in self.indexes.values() if x.dirty]
+            for index in indexes:
+                self._write_index(index)
+
+            keys = self.key_directory_dirty
+            if self.db:
+                self.db.commit_table_index(self)
+                self.db.commit_key_directory(self)
+            self.chunks_dirty = False
+            self.wal.truncate()
+            if self.shared:
+                self.shared.publish([x.name for x in dirty], keys, [x.field for x in indexes])
+
+        # Chunks that were pinned while dirty can be evicted now.
+        if self.cache:
+            self.cache.evict()
+        if started is not None:
+            self.metrics.count("checkpoints")
+            self.metrics.observe("checkpoint", time.perf_counter() - started)
 
 
     # ========== INTERNAL FUNCTIONS =============
-    def get_chunk(self, key):
-        for chunk in self.chunks:
-            if key in chunk.items:
+    def _refresh(self):
+        if self.shared:
+            self.shared.refresh()
+
+    @property
+    def _loading_path(self):
+        return os.path.join(self.path, "{}.loading".format(self.name))
+
+    def _recover_bulk_load(self):
+        # Called when the table is opened, before the write-ahead log is replayed.
+        if not os.path.exists(self._loading_path):
+            return False
+        Console.warning(f'[{self.name}] A bulk load did not finish, rebuilding the key directory and indexes')
+        with self.lock.write():
+            self._rebuild_key_directory()
+            for field in list(self.indexes):
+                index = self.indexes[field] = Index(field)
+                index.update_many(self.items())
+                self._write_index(index)
+            if self.db:
+                self.db.commit_key_directory(self)
+            os.remove(self._loading_path)
+        return True
+
+    def _begin(self):
+        if self.shared:
+            self.shared.begin()
+
+    def _place(self, key):
+        # The chunk a new key goes to.
+        if self.partitions is not None:
+            return self._chunk_map[self.partitions.chunk(key)]
+        return self._free_chunk()
+
+    def _free_chunk(self):
+        # The chunk a new key goes to. The active chunk first, then older
+        # chunks that documents were deleted from, a new one when all are full.
+        chunk = self.active_chunk
+        if not chunk.is_full:
+            return chunk
+        if self._free is None:
+            counts = collections.Counter(self.key_directory.values())
+            self._free = {x.name for x in self.chunks[:-1] if counts[x.name] < self.chunk_size}
+        while self._free:
+            chunk = self._chunk_map.get(self._free.pop(), None)
+            if chunk is not None and not chunk.is_full:
+                self._free.add(chunk.name)
                 return chunk
-        return None
+        self._new_chunk()
+        # A shared table lists the new chunk when it publishes,
+        # a transaction once its batch is logged.
+        if not self.shared and not self._applying:
+            self.commit()
+        return self.active_chunk
+
+    def _compact(self, threshold):
+        if self.partitions is not None:
+            # Partitions are split as they grow, they are never merged.
+            return [], []
+        counts = collections.Counter(self.key_directory.values())
+        sparse = [x for x in self.chunks if counts[x.name] < self.chunk_size * threshold]
+        needed = math.ceil(sum(counts[x.name] for x in sparse) / self.chunk_size)
+        if len(sparse) == len(self.chunks):
+            # A table always keeps at least one chunk.
+            needed = max(needed, 1)
+        if needed >= len(sparse):
+            return [], []
+
+        merged = []
+        moved = {}
+        chunk = None
+        for old in sparse:
+            for key, document in old.iter_items():
+                if chunk is None or len(chunk._data) >= self.chunk_size:
+                    chunk = self._make_chunk(self.name + "-" + polyfill.hex_token(8))
+                    # Dirty before it is loaded so the cache can't evict it.
+                    chunk.dirty = True
+                    chunk.initalize()
+                    merged.append(chunk)
+                chunk._data[key] = document
+                moved[key] = chunk.name
+        for future in [x.commit() for x in merged]:
+            future.result()
+
+        # The new chunks are on disk, switch the table over to them.
+        removed = {x.name for x in sparse}
+        for chunk in merged:
+            self._chunk_map[chunk.name] = chunk
+        directory = dict(self.key_directory)
+        directory.update(moved)
+        self.key_directory = directory
+        self.key_directory_dirty = True
+        self.chunks = [x for x in self.chunks if x.name not in removed] + merged
+        if not self.chunks:
+            self._new_chunk()
+        for name in removed:
+            self._chunk_map.pop(name, None)
+        self._free = None
+        if self.db:
+            self.db.commit_table_index(self)
+            self.db.commit_key_directory(self)
+
+        for chunk in sparse:
+            self._retire(chunk)
+        return sparse, merged
+
+    def _split(self, chunk):
+        # Splits a partition that outgrew the chunk size in two. Both halves
+        # are written under new names before the table index switches over
+        # to them. The log still names the old chunk, it is replayed by
+        # partition so that doesn't matter.
+        if not self.partitions.can_split(chunk.name):
+            return False
+        halves = []
+        for depth, bits in self.partitions.halves(chunk.name):
+            half = self._make_chunk(self.name + "-" + polyfill.hex_token(8) + partition_suffix(depth, bits))
+            # Dirty before it is loaded so the cache can't evict it.
+            half.dirty = True
+            half.initalize()
+            halves.append(half)
+        low, high = halves
+        for key, document in chunk.iter_items():
+            half = high if self.partitions.moves(chunk.name, key) else low
+            half._data[key] = document
+        for future in [x.commit() for x in halves]:
+            future.result()
+
+        for half in halves:
+            self._chunk_map[half.name] = half
+            for key in half._data:
+                self.key_directory[key] = half.name
+        position = self.chunks.index(chunk)
+        self.chunks = self.chunks[:position] + halves + self.chunks[position + 1:]
+        self._chunk_map.pop(chunk.name, None)
+        self.partitions.split(chunk.name, low.name, high.name)
+        self.key_directory_dirty = True
+        self.chunks_dirty = True
+        if self.db and not self.shared:
+            self.chunks_dirty = False
+            self.db.commit_table_index(self)
+
+        self._retire(chunk)
+        Console.log(f'[{self.name}] Split {chunk.name} into {low.name} and {high.name}')
+        return True
+
+    def _retire(self, chunk):
+        # Drops a chunk that was merged or split away. Other processes
+        # read its file until the change is published, a shared table
+        # only removes it then.
+        if chunk._snapshots:
+            chunk._preserve()
+        if self.cache:
+            self.cache.forget(chunk)
+        chunk.dirty = False
+        chunk.unload()
+        if self.shared:
+            self.shared.retired.append(chunk.chunk_path)
+        else:
+            # Scans that listed the chunk before it was retired still stream
+            # its file, it is removed once nothing refers to the chunk anymore.
+            weakref.finalize(chunk, remove_chunk_file, chunk.chunk_path)
+
+    def _reload_partitions(self):
+        if self.partitions is not None:
+            self.partitions = Partitions(self.chunk_ids)
+
+    def _publish(self):
+        # Index files are written right away, other processes
+        # should not wait for the next commit to see them.
+        if self.shared:
+            self.checkpoint()
+
+    def get_chunk(self, key):
+        chunk_name = self.key_directory.get(key, None)
+        if chunk_name is None:
+            return None
+        return self._chunk_map.get(chunk_name, None)
 
     def get_chunk_from_name(self, name):
-        for chunk in self.chunks:
-            if name == chunk.name:
-                return chunk
+        return self._chunk_map.get(name, None)
+
+    def _resolve(self, query):
+        if isinstance(query, str):
+            if query not in self.named_queries:
+                raise _except.DatabaseOperationException("No query registered as '{}'.".format(query))
+            return self.named_queries[query]
+        return query
+
+    def _cache_key(self, query):
+        # Lambdas can't be told apart unless they were registered.
+        if isinstance(query, Query):
+            return repr(query)
+        for name, registered in self.named_queries.items():
+            if registered is query:
+                return ("named", name)
         return None
 
+    def _matches(self, query, parallel=None):
+        if self.query_cache is not None and plan(query, self.indexes).strategy == "scan":
+            key = self._cache_key(query)
+            if key is not None:
+                return self._cached_matches(key, query)
+
+        if parallel and self.db and plan(query, self.indexes).strategy == "scan":
+            try:
+                return iter(list(self._parallel_scan(query, parallel)))
+            except _except.DatabaseOperationException as e:
+                Console.warning(f'[{self.name}] {e} Running the query serially.')
+
+        match = compile_query(query)
+        return (x for x in self._candidates(query) if match(x[0], x[1]))
+
+    def _cached_matches(self, key, query):
+        match = compile_query(query)
+
+        def scan(chunk):
+            return [x for x, document in chunk.iter_items() if match(x, document)]
+
+        for chunk, ids in self.query_cache.matches(key, self.chunks[::-1], scan):
+            for x in ids:
+                document = chunk.get(x, None)
+                if document is not None:
+                    yield (x, document)
+
+    def _ordered(self, query, field, reverse=False, count=None):
+        index = self.indexes.get(field, None)
+        if index is not None:
+            return self._ordered_by_index(query, index, reverse)
+
+        # Documents without an orderable value for the field go last.
+        ordered, rest = [], []
+        for item in self._matches(query):
+            value = sort_key(item[1].get(field, None))
+            if value is None:
+                rest.append(item)
+            else:
+                ordered.append((value, item))
+
+        key = operator.itemgetter(0)
+        if count is None:
+            ordered.sort(key=key, reverse=reverse)
+        elif reverse:
+            ordered = heapq.nlargest(count, ordered, key=key)
+        else:
+            ordered = heapq.nsmallest(count, ordered, key=key)
+        return itertools.chain((x[1] for x in ordered), rest)
+
+    def _ordered_by_index(self, query, index, reverse=False):
+        match = compile_query(query)
+        values = reversed(index.sorted) if reverse else index.sorted
+        for value in list(values):
+            for item in self._fetch(list(index.entries.get(value[1], ()))):
+                if match(item[0], item[1]):
+                    yield item
+
+        indexed = index.keys
+        unordered = [key for key in list(self.key_directory) if key not in indexed or sort_key(indexed[key]) is None]
+        for item in self._fetch(unordered):
+            if match(item[0], item[1]):
+                yield item
+
+    def _aggregate_chunks(self, query, aggregations, group_by):
+        match = compile_query(query) if query is not None else None
+        if isinstance(query, Query) and self.indexes:
+            query_plan = plan(query, self.indexes)
+            if query_plan.keys is not None:
+                return accumulate(self._fetch(query_plan.keys), aggregations, group_by, match)
+
+        groups = {}
+        for chunk in self.chunks[::-1]:
+            merge_groups(groups, accumulate(chunk.iter_items(), aggregations, group_by, match), aggregations)
+        return groups
+
+    def _aggregate_parallel(self, query, aggregations, group_by, worker_count):
+        # Same split as Table._parallel_scan, loaded chunks are aggregated here.
+        chunks = self.chunks[::-1]
+        remote = [x for x in chunks if not x.is_loaded and os.path.exists(x.chunk_path)]
+        pending = self.db.query_engine(worker_count).aggregate(query, [x.chunk_path for x in remote],
+                                                               aggregations, group_by)
+        match = compile_query(query) if query is not None else None
+        sent = {x.name for x in remote}
+        groups = {}
+        for chunk in chunks:
+            if chunk.name not in sent:
+                merge_groups(groups, accumulate(chunk.iter_items(), aggregations, group_by, match), aggregations)
+        for partial in pending.get():
+            merge_groups(groups, partial, aggregations)
+        return groups
+
+    def _aggregate_indexed(self, aggregations, group_by):
+        # Counts per value of an indexed field, the number of documents
+        # and min, max and distinct values of indexed fields don't need
+        # the documents. Returns None if any of the aggregations does.
+        if group_by is not None:
+            index = self.indexes.get(group_by, None) if isinstance(group_by, str) else None
+            if index is None or not all(type(x) is Count and x.field is None for x in aggregations):
+                return None
+            with index.lock:
+                groups = {value: [len(keys)] * len(aggregations) for value, keys in index.entries.items()}
+                # Documents without an indexed value are grouped under None.
+                missing = len(self.key_directory) - len(index.keys)
+            if missing > 0:
+                groups[None] = [missing] * len(aggregations)
+            return groups
+
+        states = []
+        for aggregation in aggregations:
+            if type(aggregation) is Count and aggregation.field is None:
+                states.append(len(self.key_directory))
+                continue
+            index = self.indexes.get(aggregation.field, None)
+            if index is None or type(aggregation) not in (Min, Max, Distinct):
+                return None
+            with index.lock:
+                if index.deferred:
+                    return None
+                if type(aggregation) is Distinct:
+                    states.append(set(index.entries))
+                    continue
+                # Values dropped during a deferred update can still be in the sorted list.
+                ordered = reversed(index.sorted) if type(aggregation) is Max else index.sorted
+                states.append(next((x[1] for x in ordered if x[1] in index.entries), None))
+        return {None: states}
+
+    def _project(self, item, fields):
+        data = {x: item[1][x] for x in fields if x in item[1]}
+        data['_id'] = item[0]
+        return data
+
+    def _candidates(self, query):
+        # Documents that can match the query, the whole table unless
+        # the indexes can narrow it down.
+        if isinstance(query, Query) and self.indexes:
+            query_plan = plan(query, self.indexes)
+            if query_plan.keys is not None:
+                if self.metrics.enabled:
+                    self.metrics.count("index_lookups")
+                    self.metrics.count("documents_fetched", len(query_plan.keys))
+                return self._fetch(query_plan.keys)
+        if self.metrics.enabled:
+            return self._counted_scan()
+        return self.items()
+
+    def _counted_scan(self):
+        # Table.items, counting what a query actually read before it stopped.
+        metrics = self.metrics
+        chunks = documents = 0
+        try:
+            for chunk in self.chunks[::-1]:
+                chunks += 1
+                for item in chunk.iter_items():
+                    documents += 1
+                    yield item
+        finally:
+            metrics.count("scans")
+            metrics.count("chunks_scanned", chunks)
+            metrics.count("documents_scanned", documents)
+
+    def _parallel_scan(self, query, worker_count):
+        # Chunks that aren't loaded are the same as their file on disk, those
+        # go to the workers while the loaded ones are scanned here.
+        chunks = self.chunks[::-1]
+        remote = [x for x in chunks if not x.is_loaded and os.path.exists(x.chunk_path)]
+        pending = self.db.query_engine(worker_count).submit(query, [x.chunk_path for x in remote])
+        if self.metrics.enabled:
+            self.metrics.count("parallel_scans")
+            self.metrics.count("chunks_scanned", len(chunks))
+
+        match = compile_query(query)
+        results = {}
+        for chunk in chunks:
+            if chunk.is_loaded:
+                results[chunk.name] = [x for x in chunk.iter_items() if match(x[0], x[1])]
+        for chunk, found in zip(remote, pending.get()):
+            results[chunk.name] = found
+
+        for chunk in chunks:
+            for item in results.get(chunk.name, ()):
+                yield item
+
+    def _fetch(self, keys):
+        for key in keys:
+            chunk = self.get_chunk(key)
+            if chunk:
+                document = chunk.get(key, None)
+                if document is not None:
+                    yield (key, document)
+
+    def _load_index(self, field):
+        index_path = self._index_path(field)
+        if not os.path.exists(index_path):
+            return None
+        with open(index_path, "rb") as f:
+            return Index.loads(f.read(), self.codec)
+
+    def _index_path(self, field):
+        return os.path.join(self.path, "{}-{}.index".format(self.name, field))
+
+    def _write_index(self, index):
+        atomic_write(self._index_path(index.field), index.dumps(self.codec),
+                     self.durability != DURABILITY_NONE)
+        index.dirty = False
+
+    def _bulk_load(self, items):
+        if self.partitions is not None:
+            return self._bulk_load_partitioned(items)
+        indexes = list(self.indexes.values())
+        for index in indexes:
+            index.deferred = True
+        directory = self.key_directory
+        writing = []
+        count = 0
+        created = 0
+        # The chunk being filled is write locked so it can't be evicted
+        # before it is marked dirty.
+        chunk = self.active_chunk
+        chunk.lock.acquire_write()
+        chunk._changing()
+        data = chunk.items
+        try:
+            for key, value in items:
+                if key == AutoGenerateId:
+                    key = polyfill.hex_token(8)
+                count += 1
+
+                target = self.get_chunk(key)
+                if target is None:
+                    if len(data) >= self.chunk_size:
+                        chunk.lock.release_write()
+                        if chunk.dirty:
+                            writing.append((chunk, chunk.commit()))
+                        self._release_written(writing)
+                        self._new_chunk()
+                        created += 1
+                        chunk = self.active_chunk
+                        chunk.lock.acquire_write()
+                        chunk._changing()
+                        data = chunk.items
+                    directory[key] = chunk.name
+                    data[key] = value
+                    chunk.dirty = True
+                    chunk.version += 1
+                else:
+                    target.write(key, value)
+
+                for index in indexes:
+                    index.update(key, value)
+        finally:
+            chunk.lock.release_write()
+            self.key_directory_dirty = True
+            for index in indexes:
+                index.sort()
+
+        for _, future in writing:
+            future.result()
+        return count, created
+
+    def _bulk_load_partitioned(self, items):
+        # Every key has its own partition, so documents are written where
+        # they belong and partitions are split as soon as they are full.
+        indexes = list(self.indexes.values())
+        for index in indexes:
+            index.deferred = True
+        count = 0
+        created = 0
+        try:
+            for key, value in items:
+                if key == AutoGenerateId:
+                    key = polyfill.hex_token(8)
+                count += 1
+
+                chunk = self.get_chunk(key) or self._place(key)
+                chunk.write(key, value)
+                self.key_directory[key] = chunk.name
+                for index in indexes:
+                    index.update(key, value)
+                if len(chunk.items) > self.chunk_size and self._split(chunk):
+                    created += 1
+        finally:
+            self.key_directory_dirty = True
+            for index in indexes:
+                index.sort()
+        return count, created
+
+    def _delete(self, chunk, key):
+        # Callers hold the table's write lock.
+        self.key_directory.pop(key, None)
+        self.key_directory_dirty = True
+        self.wal.append(OP_DELETE, chunk.name, key)
+        deleted = chunk.delete(key)
+        for index in self.indexes.values():
+            index.remove(key)
+        if self._free is not None and chunk is not self.active_chunk:
+            self._free.add(chunk.name)
+        return deleted
+
+    def _update(self, key, patch, match=None):
+        # Like a write to an existing key, only needs the read lock.
+        with self.lock.read():
+            chunk = self.get_chunk(key)
+            if chunk is None:
+                return None
+            with chunk.lock.write():
+                document = chunk.items.get(key, None)
+                if document is None or (match is not None and not match(key, document)):
+                    return None
+                delta = diff(document, patch)
+                if not delta[0] and not delta[1]:
+                    return document
+                # Logged first, a value the log can't store leaves the chunk as it was.
+                self.wal.append(OP_UPDATE, chunk.name, key, delta)
+                chunk._changing()
+                # Snapshots and Documents handed out share the old dict,
+                # the chunk gets an updated copy instead.
+                document = apply(dict(document), delta)
+                chunk.items[key] = document
+                chunk.dirty = True
+                chunk.version += 1
+                for field in itertools.chain(*delta):
+                    index = self.indexes.get(field, None)
+                    if index is not None:
+                        index.update(key, document)
+        return document
+
+    def _apply(self, writes):
+        # Applies a transaction's writes, see tasho.transaction.Transaction.
+        started = time.perf_counter() if self.metrics.enabled else None
+        with self.lock.write():
+            self._begin()
+            undo = []
+            full = set()
+            chunks = set(self.chunks)
+            self._applying = True
+            try:
+                with self.wal.group():
+                    for key, value in writes.items():
+                        chunk = self.get_chunk(key)
+                        undo.append((key, chunk, chunk.get(key, None) if chunk else None))
+                        if value is DELETED:
+                            if chunk is not None:
+                                self._delete(chunk, key)
+                            continue
+                        if chunk is None:
+                            chunk = self._place(key)
+                            self.key_directory[key] = chunk.name
+                            self.key_directory_dirty = True
+                        self._write(chunk, key, value)
+                        if self.partitions is not None and len(chunk._data) > self.chunk_size:
+                            full.add(chunk)
+            except BaseException:
+                self._undo(undo, chunks)
+                raise
+            finally:
+                self._applying = False
+            # Once the batch is in the log it can't be torn apart,
+            # partitions are only split after that.
+            self.wal.flush(self.durability == DURABILITY_COMMIT)
+            for chunk in full:
+                if chunk.name in self._chunk_map and len(chunk._data) > self.chunk_size:
+                    self._split(chunk)
+        self.commit()
+        if started is not None:
+            self.metrics.count("transactions")
+            self.metrics.count("transaction_writes", len(writes))
+            self.metrics.observe("transaction", time.perf_counter() - started)
+
+    def _undo(self, undo, chunks):
+        # Puts back what a failed transaction changed, none of it was logged.
+        # `chunks` are the ones the table had before, new ones are dropped.
+        for key, chunk, document in reversed(undo):
+            current = self.get_chunk(key)
+            if current is not None:
+                current.delete(key)
+            self.key_directory.pop(key, None)
+            for index in self.indexes.values():
+                index.remove(key)
+            if document is not None:
+                chunk.write(key, document)
+                self.key_directory[key] = chunk.name
+                for index in self.indexes.values():
+                    index.update(key, document)
+        self.key_directory_dirty = True
+        for chunk in [x for x in self.chunks if x not in chunks and not x.items]:
+            self.chunks.remove(chunk)
+            self._chunk_map.pop(chunk.name, None)
+            self._retire(chunk)
+            self.chunks_dirty = True
+        self._free = None
+
+    def _write(self, chunk, key, value):
+        # Logged under the chunk lock so the log and the chunk
+        # agree on the order of concurrent writes to a key, and
+        # first, a value the log can't store leaves the chunk as it was.
+        with chunk.lock.write():
+            self.wal.append(OP_WRITE, chunk.name, key, value)
+            chunk._changing()
+            chunk.items[key] = value
+            chunk.dirty = True
+            chunk.version += 1
+            for index in self.indexes.values():
+                index.update(key, value)
+
+    def _release_written(self, writing):
+        # Unloads bulk loaded chunks that made it to disk.
+        for chunk, future in list(writing):
+            if future.done():
+                writing.remove((chunk, future))
+                future.result()
+                if not chunk.dirty:
+                    if self.cache:
+                        self.cache.forget(chunk)
+                    chunk.unload()
+
+    def _rebuild_key_directory(self):
+        # Used for tables written before the key directory existed,
+        # loads every chunk once.
+        self.key_directory = {}
+        for chunk in self.chunks:
+            for key, _ in chunk.iter_items():
+                self.key_directory[key] = chunk.name
+        self.key_directory_dirty = True
+
+    def _replay_wal(self):
+        count = 0
+        for op, chunk_name, key, value in self.wal.records():
+            if self.partitions is not None:
+                # The chunk may have been split since the record was written.
+                chunk_name = self.partitions.chunk(key)
+            chunk = self.get_chunk_from_name(chunk_name)
+            if chunk is None:
+                chunk = self._add_chunk(chunk_name)
+            if op == OP_WRITE:
+                chunk.write(key, value)
+                self.key_directory[key] = chunk_name
+                for index in self.indexes.values():
+                    index.update(key, value)
+            elif op == OP_UPDATE:
+                chunk = self.get_chunk(key) or chunk
+                document = chunk.get(key, None)
+                if document is not None:
+                    document = apply(dict(document), value)
+                    chunk.write(key, document)
+                    for field in itertools.chain(*value):
+                        index = self.indexes.get(field, None)
+                        if index is not None:
+                            index.update(key, document)
+            elif op == OP_DELETE:
+                chunk.delete(key)
+                self.key_directory.pop(key, None)
+                for index in self.indexes.values():
+                    index.remove(key)
+            count += 1
+
+        if count:
+            Console.log(f'[{self.name}] Replayed {count} log records')
+            self._free = None
+            self.key_directory_dirty = True
+            self.checkpoint()
+        return count
+
+    def _make_chunk(self, chunk_name):
+        chunk_path = os.path.join(self.path, chunk_name)
+        return Chunk(chunk_name, chunk_path, self.chunk_size,
+                     self.durability != DURABILITY_NONE, self.cache, self.chunk_format, self.codec, self.scheduler,
+                     self.metrics)
+
+    def _add_chunk(self, chunk_name):
+        chunk = self._make_chunk(chunk_name)
+        self.chunks.append(chunk)
+        self._chunk_map[chunk_name] = chunk
+        self.chunks_dirty = True
+        return chunk
+
     def _new_chunk(self):
         chunk_name = self.name + "-" +  polyfill.hex_token(8)
-        chunk_path = os.path.join(self.path, chunk_name)
-        chunk = Chunk(chunk_name, chunk_path, self.chunk_size)
+        if self.partitions is not None:
+            # Only a new hash partitioned table gets a chunk this way, one partition for every key.
+            chunk_name += partition_suffix(0, 0)
+        chunk = self._add_chunk(chunk_name)
         chunk.initalize()
-        self.chunks.append(chunk)
+        self._reload_partitions()
         return chunk_name
 
@@ -0,0 +1,269 @@
+import threading
+
+from . import polyfill
+from .autogenerateid import AutoGenerateId
+from .chunk import ChunkReader
+from .document import Document
+from .query import compile_query
+from .patch import check_patch, diff, apply
+
+
+class Deleted():
+    # Marks a key deleted by a transaction.
+    def __repr__(self):
+        return "<Deleted>"
+
+
+DELETED = Deleted()
+
+
+class TransactionState(threading.local):
+    # The transaction open on the current thread, per table.
+    current = None
+
+
+class Transaction():
+    """Transaction(tasho.table.Table:table) returns tasho.transaction.Transaction
+
+            Writes to a table that are applied together, use Table.transaction
+            to get one. Inserts, updates and deletes are held back until the
+            outermost `with` block ends, reads through the transaction (and
+            through the table on the same thread) see them. The batch is then applied
+            under the table lock and logged as a single write-ahead log
+            record, so after a crash either all of it is there or none of it.
+            An exception in the block discards the batch."""
+
+    def __init__(self, table):
+        self.table = table
+        self.writes = {}
+        self.depth = 0
+
+    def __repr__(self):
+        return "<TashoDBTransaction:{} Writes: {}>".format(self.table.name, len(self.writes))
+
+    def __enter__(self):
+        if not self.depth:
+            self.table._transactions.current = self
+        self.depth += 1
+        return self
+
+    def __exit__(self, kind, exception, traceback):
+        self.depth -= 1
+        if self.depth:
+            # Nested blocks are part of the outermost one.
+            return False
+        self.table._transactions.current = None
+        if kind is None:
+            self.commit()
+        else:
+            self.rollback()
+        return False
+
+    def insert(self, key, value):
+        """
+        Transaction.insert(String/Int:key, Dict:value) returns tasho.database.Document
+        """
+        if key == AutoGenerateId:
+            key = polyfill.hex_token(8)
+        self.writes.pop(key, None)
+        self.writes[key] = value
+        return Document((key, value), self.table)
+
+    def delete(self, key):
+        """
+        Transaction.delete(String/Int:key) returns Bool
+
+        Returns True if the key exists as of this transaction.
+        """
+        exists = self.raw_get(key) is not None
+        self.writes.pop(key, None)
+        self.writes[key] = DELETED
+        return exists
+
+    def update(self, key, patch):
+        """
+        Transaction.update(String/Int:key, Dict:patch) returns tasho.database.Document
+
+        Same as Table.update, the updated document is held back like an insert.
+        """
+        check_patch(patch)
+        document = self.raw_get(key)
+        if document is None:
+            return None
+        delta = diff(document, patch)
+        if delta[0] or delta[1]:
+            document = apply(dict(document), delta)
+            self.writes.pop(key, None)
+            self.writes[key] = document
+        return Document((key, document), self.table)
+
+    def update_many(self, query, patch):
+        """
+        Transaction.update_many(tasho.query.Query/function(id, document):query, Dict:patch) returns Int
+
+        Same as Table.update_many, documents written in the transaction are matched too.
+        """
+        check_patch(patch)
+        match = compile_query(query)
+        keys = [x for x, _ in self.table._matches(query)]
+        keys.extend(x for x, y in self.writes.items() if y is not DELETED)
+        count = 0
+        for key in dict.fromkeys(keys):
+            document = self.raw_get(key)
+            if document is not None and match(key, document):
+                self.update(key, patch)
+                count += 1
+        return count
+
+    def raw_get(self, key):
+        value = self.writes.get(key, None)
+        if value is None:
+            return self.table._raw_get(key)
+        return None if value is DELETED else value
+
+    def get(self, key):
+        document = self.raw_get(key)
+        if document is not None:
+            return Document((key, document), self.table)
+        return None
+
+    def commit(self):
+        """
+        Transaction.commit()
+
+        Applies the writes so far and commits the table,
+        called when the outermost `with` block ends.
+        """
+        writes, self.writes = self.writes, {}
+        if writes:
+            self.table._apply(writes)
+
+    def rollback(self):
+        self.writes = {}
+
+
+class Snapshot():
+    """Snapshot(tasho.table.Table:table) returns tasho.transaction.Snapshot
+
+            Read-only view of a table as it was when the snapshot was taken,
+            use Table.snapshot to get one. Nothing is copied up front, every
+            chunk hands its documents to the snapshots open on it the first
+            time it is changed afterwards and carries on with a (shallow)
+            copy, so writes keep going while a long scan reads the snapshot.
+            Documents are shared with the table, changing one in place
+            rather than writing it back is seen by the snapshot too.
+            Snapshots should be closed, chunks keep copying on their first
+            write for the ones that are still open."""
+
+    def __init__(self, table):
+        self.table = table
+        with table.lock.write():
+            table._refresh()
+            self.chunks = list(table.chunks)
+            for chunk in self.chunks:
+                chunk._register(self)
+        self._members = set(self.chunks)
+        # chunk -> its documents as of the snapshot, once they were
+        # handed over by a write (Chunk._preserve) or pinned by a read.
+        self.preserved = {}
+        self.closed = False
+
+    def __repr__(self):
+        return "<TashoDBSnapshot:{} Chunks: {} Preserved: {}>".format(self.table.name, len(self.chunks), len(self.preserved))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """
+        Snapshot.close()
+
+        Releases the documents held for the snapshot.
+        """
+        for chunk in self.chunks:
+            chunk._unregister(self)
+        self.preserved = {}
+        self.closed = True
+
+    def raw_get(self, key):
+        chunk = self.table.get_chunk(key)
+        if chunk is not None:
+            document = self._get(chunk, key)
+            if document is not None:
+                return document
+        # Deleted or moved since, the chunk it was in has been changed then.
+        for data in list(self.preserved.values()):
+            document = data.get(key, None)
+            if document is not None:
+                return document
+        return None
+
+    def get(self, key):
+        document = self.raw_get(key)
+        if document is not None:
+            return Document((key, document), self.table)
+        return None
+
+    def items(self):
+        """
+        Snapshot.items() returns (String/Int:id, Dict:document)
+
+        Goes through the table as of the snapshot, in the same order as Table.items.
+        """
+        if self.closed:
+            raise ValueError("The snapshot is closed.")
+        for chunk in self.chunks[::-1]:
+            data, reader = self._pin(chunk)
+            if data is not None:
+                yield from data.items()
+            elif reader is not None:
+                try:
+                    yield from reader.items()
+                finally:
+                    reader.close()
+
+    def query(self, query, limit=None):
+        """
+        Snapshot.query(tasho.query.Query/function(id, document):query, Int:limit) returns List[tasho.database.Document]
+
+        Scans the snapshot, indexes only describe the live table so they aren't used.
+        """
+        match = compile_query(self.table._resolve(query))
+        results = []
+        for key, document in self.items():
+            if match(key, document):
+                results.append(Document((key, document), self.table))
+                if limit is not None and len(results) >= limit:
+                    break
+        return results
+
+    def _get(self, chunk, key):
+        with chunk.lock.read():
+            data = self.preserved.get(chunk, None)
+            if data is None:
+                if chunk not in self._members:
+                    return None
+                # Not changed since the snapshot.
+                return chunk.get(key, None)
+        return data.get(key, None)
+
+    def _pin(self, chunk):
+        # The chunk's documents as of the snapshot. A loaded chunk that
+        # hasn't changed is pinned as is, the next write copies it.
+        # An unloaded one is read from its file, which is only ever
+        # replaced, the open mapping keeps the old one. A retired chunk's
+        # file stays until the chunk is gone, see Table._retire.
+        with chunk.lock.read():
+            data = self.preserved.get(chunk, None)
+            if data is not None:
+                return data, None
+            if chunk.is_loaded:
+                data = self.preserved[chunk] = chunk._data
+                return data, None
+            try:
+                return None, ChunkReader(chunk.chunk_path)
+            except FileNotFoundError:
+                return None, None
@@ -0,0 +1,143 @@
+import os
+import marshal
+import struct
+import threading
+import zlib
+import contextlib
+
+from .console import Console
+
+# Every record is framed as <length><crc32><marshal payload> so a torn
+# write at the tail of the log can be detected and dropped on replay.
+_HEADER = struct.Struct("<II")
+
+OP_WRITE = "w"
+OP_DELETE = "d"
+# Holds the fields a Table.update changed, (Dict:set, List:unset).
+OP_UPDATE = "u"
+# Holds the records of a WriteAheadLog.group, replayed as if logged one by one.
+OP_BATCH = "b"
+
+
+class WriteAheadLog():
+    """WriteAheadLog(String:log_path) returns tasho.wal.WriteAheadLog
+
+            Append-only log of document writes, updates and deletes for a table.
+            Records are buffered with WriteAheadLog.append and written
+            in a single append by WriteAheadLog.flush (group commit).
+            Appends, flushes and truncation are serialized by WriteAheadLog.lock."""
+
+    def __init__(self, log_path):
+        self.log_path = log_path
+        self.pending = []
+        self.lock = threading.Lock()
+        self.written = 0
+        self._group = None
+        self._group_owner = None
+
+    def __repr__(self):
+        return "<TashoDBWriteAheadLog:{} Pending: {}>".format(self.log_path, len(self.pending))
+
+    @property
+    def size(self):
+        """
+        WriteAheadLog.size returns Int
+        Returns the size of the log on disk in bytes.
+        """
+        if os.path.exists(self.log_path):
+            return os.path.getsize(self.log_path)
+        return 0
+
+    def append(self, op, chunk_name, key, value=None):
+        """
+        WriteAheadLog.append(String:op, String:chunk_name, String/Int:key, Dict:value)
+
+        Buffers a record, it is written on the next WriteAheadLog.flush().
+        """
+        if self._group_owner is not None and self._group_owner == threading.get_ident():
+            self._group.append((op, chunk_name, key, value))
+            return
+        self._buffer(marshal.dumps((op, chunk_name, key, value)))
+
+    @contextlib.contextmanager
+    def group(self):
+        """
+        WriteAheadLog.group()
+
+        Records this thread appends inside the block are buffered as a
+        single record, replay sees either all of them or none. Nothing is
+        buffered if the block raises. Callers keep other writers out.
+        """
+        self._group, self._group_owner = [], threading.get_ident()
+        try:
+            yield
+            records = self._group
+        finally:
+            self._group = self._group_owner = None
+        if records:
+            self._buffer(marshal.dumps((OP_BATCH, None, None, records)))
+
+    def _buffer(self, payload):
+        record = _HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+        with self.lock:
+            self.pending.append(record)
+
+    def flush(self, fsync=False):
+        """
+        WriteAheadLog.flush(Bool:fsync) returns Int
+
+        Appends every buffered record to the log file in one write,
+        optionally waiting for it to reach the disk.
+        Returns the number of records written.
+        """
+        with self.lock:
+            if not self.pending:
+                return 0
+            count = len(self.pending)
+            data = b"".join(self.pending)
+            with open(self.log_path, "ab") as f:
+                f.write(data)
+                if fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            self.pending = []
+            self.written += len(data)
+            return count
+
+    def records(self):
+        """
+        WriteAheadLog.records() returns (String:op, String:chunk_name, String/Int:key, Dict:value)
+
+        Returns a generator going through every complete record in the log.
+        A torn record at the end of the log is discarded.
+        """
+        if not os.path.exists(self.log_path):
+            return
+        with open(self.log_path, "rb") as f:
+            data = f.read()
+
+        offset = 0
+        while offset + _HEADER.size <= len(data):
+            length, crc = _HEADER.unpack_from(data, offset)
+            start = offset + _HEADER.size
+            payload = data[start:start + length]
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                Console.warning(f'[{self.log_path}] Discarding torn record at offset {offset}')
+                break
+            record = marshal.loads(payload)
+            if record[0] == OP_BATCH:
+                yield from record[3]
+            else:
+                yield record
+            offset = start + length
+
+    def truncate(self):
+        """
+        WriteAheadLog.truncate()
+
+        Empties the log, used once its records are checkpointed into the chunks.
+        """
+        with self.lock:
+            self.pending = []
+            if os.path.exists(self.log_path):
+                os.remove(self.log_path)
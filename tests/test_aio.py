@@ -0,0 +1,78 @@
+import asyncio
+import threading
+
+import pytest
+
+import tasho
+
+
+@pytest.fixture
+def directory(tmp_path):
+    database = tasho.Database.new(str(tmp_path / "db"), chunk_size=5)
+    database.table.A.bulk_load((x, {"n": x}) for x in range(50))
+    database.table.B.insert(1, {"n": 1})
+    database.close()
+    return str(tmp_path / "db")
+
+
+def test_tables_are_opened_off_the_loop(directory):
+    async def main():
+        database = await tasho.AsyncDatabase.open(directory)
+        opened = []
+        get_table = database.database.get_table
+
+        def record(name):
+            opened.append(threading.current_thread())
+            return get_table(name)
+
+        database.database.get_table = record
+        tables = await database.tables()
+        await database.close()
+        return tables, opened
+
+    tables, opened = asyncio.run(main())
+    assert sorted(tables) == ["A", "B"]
+    assert isinstance(tables["A"], tasho.AsyncTable)
+    assert opened and threading.main_thread() not in opened
+
+
+def test_close_closes_the_database(directory):
+    async def main():
+        database = await tasho.AsyncDatabase.open(directory)
+        shows = await database.get_table("A")
+        await shows.insert(100, {"n": 100})
+        await database.close()
+        return database.database
+
+    database = asyncio.run(main())
+    assert database not in tasho._open_databases
+    assert tasho.Database.open(directory).table.A.raw_get(100) == {"n": 100}
+
+
+def test_reads_of_evicted_chunks_run_off_the_loop(directory):
+    async def main():
+        database = await tasho.AsyncDatabase.open(directory)
+        table = await database.get_table("A")
+        load_chunk = database.load_chunk
+
+        async def load_then_evict(chunk):
+            # Another read evicts the chunk right after it was loaded.
+            await load_chunk(chunk)
+            chunk.unload()
+
+        database.load_chunk = load_then_evict
+        readers = []
+        raw_get = table.table.raw_get
+
+        def record(key):
+            readers.append(threading.current_thread())
+            return raw_get(key)
+
+        table.table.raw_get = record
+        documents = [await table.raw_get(7), (await table.get(8)).n]
+        await database.close()
+        return documents, readers
+
+    documents, readers = asyncio.run(main())
+    assert documents == [{"n": 7}, 8]
+    assert len(readers) == 2 and threading.main_thread() not in readers
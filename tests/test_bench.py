@@ -0,0 +1,22 @@
+from tasho import bench
+
+
+def test_parallel_query_case(tmp_path):
+    results = bench.run_case(str(tmp_path), 50, 500, operations=10, queries=2, commits=2, parallel=2)
+    timings = results["parallel_query"]
+    assert timings["workers"] == 2
+    assert timings["serial"]["count"] == timings["parallel"]["count"] == 2
+    assert "parallel_query" not in bench.run_case(str(tmp_path), 50, 500, operations=10, queries=2, commits=2, parallel=0)
+
+
+def test_codec_case(tmp_path):
+    results = bench.run_codecs(str(tmp_path), 200, 50, ["marshal", "marshal+zlib"])
+    assert [x["codec"] for x in results] == ["marshal", "marshal+zlib"]
+    assert all(x["dump"] > 0 and x["load"] > 0 for x in results)
+    assert results[1]["bytes"] < results[0]["bytes"]
+
+
+def test_durability_case(tmp_path):
+    results = bench.run_durability(str(tmp_path), 200, 50, commits=2)
+    assert [x["durability"] for x in results] == ["none", "batch", "commit"]
+    assert all(x["commit"]["count"] == x["checkpoint"]["count"] == 2 for x in results)
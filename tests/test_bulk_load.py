@@ -0,0 +1,57 @@
+import os
+import subprocess
+import sys
+
+import tasho
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_bulk_load(tmp_path):
+    database = tasho.Database.new(str(tmp_path / "db"), chunk_size=10)
+    table = database.table.T
+    table.create_index("n")
+    table.insert(0, {"n": -1})
+    stats = table.bulk_load((x, {"n": x}) for x in range(100))
+    assert stats["documents"] == 100
+    assert table.raw_get(0) == {"n": 0}
+    assert len(table.query(tasho.Field("n") < 50)) == 50
+    assert not os.path.exists(table._loading_path)
+    database.close()
+
+
+def test_crash_during_bulk_load(tmp_path):
+    path = str(tmp_path / "db")
+    database = tasho.Database.new(path, chunk_size=10)
+    table = database.table.T
+    table.create_index("n")
+    table.insert("before", {"n": -1})
+    database.close()
+
+    # Dies once a few chunks, including the one that was active before, are on disk.
+    code = """
+import os, tasho
+database = tasho.Database.open({path!r})
+def items():
+    for x in range(1000):
+        if x == 500:
+            database.flush()
+            os._exit(0)
+        yield x, {{"n": x}}
+database.table.T.bulk_load(items())
+""".format(path=path)
+    env = dict(os.environ, PYTHONPATH=ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    subprocess.run([sys.executable, "-c", code], check=True, env=env, capture_output=True)
+
+    database = tasho.Database.open(path)
+    table = database.table.T
+    stored = dict(table.items())
+    assert stored["before"] == {"n": -1}
+    assert len(stored) > 1
+    for key, document in stored.items():
+        assert table.raw_get(key) == document
+        assert key in table.indexes["n"].entries[document["n"]]
+    key = next(x for x in stored if x != "before")
+    table.insert(key, {"n": "again"})
+    assert sum(1 for x, _ in table.items() if x == key) == 1
+    database.close()
@@ -0,0 +1,48 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import tasho
+from tasho.cache import open_readers
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def table(tmp_path):
+    database = tasho.Database.new(str(tmp_path / "db"), chunk_size=5)
+    database.table.T.bulk_load((x, {"n": x}) for x in range(500))
+    database.close()
+    # Reopened, so no chunk is loaded.
+    database = tasho.Database.open(str(tmp_path / "db"))
+    table = database.table.T
+    yield table
+    database.close()
+
+
+def test_point_reads_keep_a_bounded_number_of_files_open(table, monkeypatch):
+    monkeypatch.setattr(open_readers, "max_readers", 8)
+    for key in range(0, 500, 5):
+        assert table.raw_get(key) == {"n": key}
+    assert sum(x._reader is not None for x in table.chunks) <= 8
+    assert len(open_readers.open) <= 8
+    # Closed readers are opened again.
+    assert table.get_many(list(range(500)), raw=True) == [{"n": x} for x in range(500)]
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs the resource module")
+def test_point_reads_across_more_chunks_than_file_descriptors(tmp_path):
+    code = """
+import resource, tasho
+resource.setrlimit(resource.RLIMIT_NOFILE, (256, resource.getrlimit(resource.RLIMIT_NOFILE)[1]))
+database = tasho.Database.new({path!r}, chunk_size=5)
+table = database.table.T
+table.bulk_load((x, {{"n": x}}) for x in range(2500))
+for key in range(2500):
+    assert table.raw_get(key) == {{"n": key}}
+database.close()
+""".format(path=str(tmp_path / "db"))
+    env = dict(os.environ, PYTHONPATH=ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    subprocess.run([sys.executable, "-c", code], check=True, env=env, capture_output=True)
@@ -0,0 +1,103 @@
+import gc
+import os
+import threading
+import time
+
+import tasho
+
+SIZE = 2000
+# Always in the table, the rest of the keys keep getting deleted and merged away.
+KEPT = set(range(0, SIZE, 4))
+
+
+def test_scan_during_compaction(tmp_path):
+    database = tasho.Database.new(str(tmp_path / "db"), chunk_size=20, cache_chunks=2)
+    table = database.table.T
+    table.bulk_load((x, {"n": x}) for x in range(SIZE))
+    table.auto_commit = False
+    errors = []
+    done = threading.Event()
+
+    def scan():
+        try:
+            while not done.is_set():
+                keys = set()
+                for key, _ in table.items():
+                    keys.add(key)
+                    # Lets compaction run in the middle of the scan.
+                    time.sleep(0)
+                if not KEPT <= keys:
+                    errors.append("scan missed {} documents".format(len(KEPT - keys)))
+        except Exception as e:
+            errors.append(repr(e))
+
+    threads = [threading.Thread(target=scan) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    try:
+        for round in range(10):
+            # Leaves a quarter of the documents in a stretch of chunks, compact merges them.
+            window = [x for x in range(round * 200, round * 200 + 400) if x % 4 and x < SIZE]
+            for key in window:
+                table.delete(key)
+            table.checkpoint()
+            table.compact()
+            for key in window:
+                table.insert(key, {"n": key})
+            table.checkpoint()
+    finally:
+        done.set()
+        for thread in threads:
+            thread.join()
+    assert not errors, errors[:5]
+    assert {x for x, _ in table.items()} == set(range(SIZE))
+    database.close()
+
+
+def test_inserts_fill_freed_space(tmp_path):
+    database = tasho.Database.new(str(tmp_path / "db"), chunk_size=10)
+    table = database.table.T
+    for x in range(50):
+        table.insert(x, {"n": x})
+    chunks = [x.name for x in table.chunks]
+    first = table.key_directory[0]
+    for x in range(5):
+        table.delete(x)
+    for x in range(50, 55):
+        table.insert(x, {"n": x})
+    assert [x.name for x in table.chunks] == chunks
+    assert {table.key_directory[x] for x in range(50, 55)} == {first}
+    # Only a full table gets a new chunk.
+    table.insert(55, {"n": 55})
+    assert len(table.chunks) == len(chunks) + 1
+    database.close()
+
+
+def test_compact_merges_sparse_chunks(tmp_path):
+    path = str(tmp_path / "db")
+    database = tasho.Database.new(path, chunk_size=10)
+    table = database.table.T
+    table.create_index("n")
+    table.bulk_load((x, {"n": x}) for x in range(100))
+    kept = [x for x in range(100) if x % 4 == 0 and x < 80]
+    for x in range(100):
+        if x not in kept:
+            table.delete(x)
+    stats = table.compact()
+    assert stats["before"] == {"chunks": 10, "documents": 20, "fill": 0.2, "sparse": 10, "empty": 2, "reclaimable": 8}
+    assert stats["after"]["chunks"] == 2
+    assert stats["after"]["reclaimable"] == 0
+    assert stats["merged"] == 10
+    assert sorted(x for x, _ in table.items()) == kept
+    assert sorted(x for _, x in table.indexes["n"].keys.items()) == kept
+    database.close()
+
+    database = tasho.Database.open(path)
+    table = database.table.T
+    assert len(table.chunks) == 2
+    assert table.get_many(kept, raw=True) == [{"n": x} for x in kept]
+    # The merged chunks' files go once nothing refers to them.
+    gc.collect()
+    files = [x for x in os.listdir(path) if x.startswith("T-") and not x.endswith(".index")]
+    assert sorted(files) == sorted(os.path.basename(x.chunk_path) for x in table.chunks)
+    database.close()
@@ -0,0 +1,58 @@
+import os
+
+import pytest
+
+import tasho
+
+
+def _touched(table):
+    return [x.name for x in table.chunks if x.is_loaded or x._reader is not None]
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = str(tmp_path / "db")
+    database = tasho.Database.new(path, chunk_size=10)
+    database.table.T.bulk_load((x, {"n": x}) for x in range(100))
+    database.close()
+    return path
+
+
+def test_point_operations_touch_one_chunk(path):
+    database = tasho.Database.open(path)
+    table = database.table.T
+    assert table.raw_get(55) == {"n": 55}
+    assert _touched(table) == [table.key_directory[55]]
+    table.insert(56, {"n": -56})
+    table.delete(57)
+    assert _touched(table) == [table.key_directory[55]]
+    assert table.get(404) is None
+    assert len(_touched(table)) == 1
+    database.close()
+
+
+@pytest.mark.parametrize("layout", tasho.LAYOUTS)
+def test_lost_key_directory_is_rebuilt(tmp_path, layout):
+    path = str(tmp_path / "db")
+    database = tasho.Database.new(path, chunk_size=10, layout=layout)
+    table = database.table.T
+    for x in range(100):
+        table.insert(x, {"n": x})
+    table.delete(5)
+    database.close()
+    os.remove(os.path.join(path, "T.keys"))
+
+    database = tasho.Database.open(path)
+    table = database.table.T
+    assert table.get(5) is None
+    assert table.get_many(range(6, 100), raw=True) == [{"n": x} for x in range(6, 100)]
+    # The key isn't added again to another chunk.
+    table.insert(50, {"n": -50})
+    assert sorted(x for x, _ in table.items()) == [x for x in range(100) if x != 5]
+    database.close()
+
+    # Written back, the next open doesn't have to rebuild it.
+    assert os.path.exists(os.path.join(path, "T.keys"))
+    database = tasho.Database.open(path)
+    assert database.table.T.raw_get(50) == {"n": -50}
+    database.close()
@@ -0,0 +1,12 @@
+import pytest
+
+from tasho import bench
+
+# Multi-process mode needs fcntl.
+pytest.importorskip("fcntl")
+
+
+def test_processes_see_each_others_writes(tmp_path):
+    results = bench.run_multiprocess(str(tmp_path), 2, seconds=2)
+    assert results["writes"]["count"]
+    assert results["errors"] == []
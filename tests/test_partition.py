@@ -0,0 +1,110 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import tasho
+from tasho.partition import parse_partition, partition_hash
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _check_placement(table, keys):
+    # Every key is in the chunk its hash names, no chunk is over the size.
+    partitions = table.partitions
+    assert len(partitions) == len(table.chunks)
+    for chunk in table.chunks:
+        depth, bits = parse_partition(chunk.name)
+        assert len(chunk.items) <= table.chunk_size
+        assert all(partition_hash(x) & ((1 << depth) - 1) == bits for x in chunk.items)
+    for key in keys:
+        assert table.key_directory[key] == partitions.chunk(key)
+
+
+def test_partitions_split_as_they_grow(tmp_path):
+    path = str(tmp_path / "db")
+    database = tasho.Database.new(path, chunk_size=10, layout=tasho.LAYOUT_HASH)
+    table = database.table.T
+    keys = ["key-{}".format(x) for x in range(300)]
+    for key in keys:
+        table.insert(key, {"key": key})
+    assert len(table.chunks) >= 300 // 10
+    _check_placement(table, keys)
+    database.close()
+
+    # The layout is read back from the chunk names.
+    database = tasho.Database.open(path)
+    table = database.table.T
+    assert table.layout == tasho.LAYOUT_HASH
+    _check_placement(table, keys)
+    assert table.get_many(keys, raw=True) == [{"key": x} for x in keys]
+    database.close()
+
+
+def test_split_partitions_replay_after_crash(tmp_path):
+    path = str(tmp_path / "db")
+    # Partitions split while the inserts are only in the log.
+    code = """
+import os, tasho
+database = tasho.Database.new({path!r}, chunk_size=10, layout="hash")
+table = database.table.T
+table.insert("first", {{"n": -1}})
+table.checkpoint()
+for x in range(200):
+    table.insert(x, {{"n": x}})
+database.flush()
+os._exit(0)
+""".format(path=path)
+    env = dict(os.environ, PYTHONPATH=ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    subprocess.run([sys.executable, "-c", code], check=True, env=env, capture_output=True)
+
+    database = tasho.Database.open(path)
+    table = database.table.T
+    assert dict(table.items()) == dict([("first", {"n": -1})] + [(x, {"n": x}) for x in range(200)])
+    _check_placement(table, ["first"] + list(range(200)))
+    database.close()
+
+
+def test_concurrent_inserts_into_hash_partitions(tmp_path):
+    path = str(tmp_path / "db")
+    database = tasho.Database.new(path, chunk_size=50, layout=tasho.LAYOUT_HASH)
+    table = database.table.T
+    errors = []
+    done = threading.Event()
+
+    def insert(n):
+        try:
+            for x in range(500):
+                table.insert("{}-{}".format(n, x), {"n": n, "x": x})
+        except Exception as e:
+            errors.append(e)
+
+    def watch():
+        # Walks and writes out the key directory while keys are added to it.
+        try:
+            while not done.is_set():
+                table.fragmentation()
+                table.checkpoint()
+                time.sleep(0.01)
+        except Exception as e:
+            errors.append(e)
+
+    watcher = threading.Thread(target=watch)
+    watcher.start()
+    writers = [threading.Thread(target=insert, args=(n,)) for n in range(4)]
+    for writer in writers:
+        writer.start()
+    for writer in writers:
+        writer.join()
+    done.set()
+    watcher.join()
+    assert errors == []
+
+    keys = ["{}-{}".format(n, x) for n in range(4) for x in range(500)]
+    assert len(table.chunks) > 1
+    assert all(table.get_chunk(x).get(x) is not None for x in keys)
+    database.close()
+
+    table = tasho.Database.open(path).table.T
+    assert table.get_many(keys, raw=True) == [{"n": n, "x": x} for n in range(4) for x in range(500)]
@@ -0,0 +1,80 @@
+import pytest
+
+import tasho
+from tasho import Field
+from tasho.exceptions import DatabaseOperationException
+from tasho.wal import OP_UPDATE
+
+
+@pytest.fixture
+def table(tmp_path):
+    database = tasho.Database.new(str(tmp_path / "db"), chunk_size=10)
+    table = database.table.T
+    table.create_index("a")
+    table.create_index("b")
+    table.bulk_load((x, {"a": x, "b": x % 3, "c": "x"}) for x in range(30))
+    yield table
+    database.close()
+
+
+def _spy(monkeypatch, index):
+    calls = []
+    update = index.update
+    monkeypatch.setattr(index, "update", lambda key, document: (calls.append(key), update(key, document)))
+    return calls
+
+
+def test_patch_operators(table):
+    document = table.update(1, {"$set": {"a": 100, "d": [1]}, "$inc": {"b": 2, "e": 1.5}, "$unset": ["c", "missing"]})
+    assert document.dict == {"_id": 1, "a": 100, "b": 3, "d": [1], "e": 1.5}
+    assert table.raw_get(1) == {"a": 100, "b": 3, "d": [1], "e": 1.5}
+    assert table.update(404, {"$set": {"a": 1}}) is None
+    assert table.get(404) is None
+
+
+def test_bad_patches_change_nothing(table):
+    for patch in ({"a": 1}, {"$set": {"a": 1}, "$inc": {"a": 1}}, {"$inc": {"a": "1"}}, {"$inc": {"c": 1}}):
+        with pytest.raises(DatabaseOperationException):
+            table.update(2, patch)
+    assert table.raw_get(2) == {"a": 2, "b": 2, "c": "x"}
+
+
+def test_only_changed_fields_are_indexed_and_logged(table, monkeypatch):
+    a = _spy(monkeypatch, table.indexes["a"])
+    b = _spy(monkeypatch, table.indexes["b"])
+    table.update(4, {"$set": {"a": 40, "c": "y"}})
+    assert (a, b) == ([4], [])
+    assert table.indexes["a"].eq(40) == [4]
+    assert 4 not in table.indexes["a"].eq(4)
+    # The log only holds what changed, not the whole document.
+    table.commit()
+    assert list(table.wal.records())[-1] == (OP_UPDATE, table.key_directory[4], 4, ({"a": 40, "c": "y"}, []))
+
+    # Nothing changes, nothing is logged or indexed.
+    table.update(4, {"$set": {"a": 40}, "$inc": {"b": 0}})
+    table.commit()
+    assert len(list(table.wal.records())) == 1
+    assert (a, b) == ([4], [])
+
+    table.update(4, {"$unset": ["b"]})
+    assert (a, b) == ([4], [4])
+    assert 4 not in table.indexes["b"].keys
+    assert 4 not in [x.dict["_id"] for x in table.query(Field("b") == 1)]
+
+
+def test_update_many(table):
+    assert table.update_many(Field("b") == 0, {"$inc": {"a": 1000}}) == 10
+    assert sorted(table.indexes["a"].range(1000)) == [x for x in range(30) if x % 3 == 0]
+    assert sorted(x.dict["_id"] for x in table.query(Field("a") >= 1000)) == [x for x in range(30) if x % 3 == 0]
+    assert table.update_many(Field("b") == 5, {"$set": {"a": 0}}) == 0
+
+
+def test_document_save_sends_a_patch(table, monkeypatch):
+    b = _spy(monkeypatch, table.indexes["b"])
+    document = table.get(7)
+    document["a"] = 70
+    assert document.patch == {"$set": {"a": 70}}
+    document.save()
+    assert b == []
+    assert table.raw_get(7) == {"a": 70, "b": 1, "c": "x"}
+    assert table.indexes["a"].eq(70) == [7]
@@ -0,0 +1,56 @@
+import pytest
+
+import tasho
+from tasho import Field
+
+DOCUMENTS = {
+    1: {"x": None},
+    2: {"x": 1},
+    3: {"x": [1, 2]},
+    4: {"x": {"a": 1}},
+    5: {"x": 1.0},
+    6: {"y": 1},
+    7: {"x": "1"},
+}
+
+QUERIES = [
+    Field("x") == None,
+    Field("x") == [1, 2],
+    Field("x") == {"a": 1},
+    Field("x") == 1,
+    Field("x").isin([None, 1]),
+    Field("x").isin([[1, 2], "1"]),
+    Field("x").isin(["1"]),
+    (Field("x") == None) | (Field("x") == "1"),
+]
+
+
+@pytest.fixture
+def tables(tmp_path):
+    database = tasho.Database.new(str(tmp_path / "db"))
+    scanned, indexed = database.table.Scanned, database.table.Indexed
+    for key, document in DOCUMENTS.items():
+        scanned.insert(key, document)
+        indexed.insert(key, document)
+    indexed.create_index("x")
+    yield scanned, indexed
+    database.close()
+
+
+@pytest.mark.parametrize("query", QUERIES, ids=repr)
+def test_index_matches_scan(tables, query):
+    scanned, indexed = tables
+    assert sorted(x._id for x in indexed.query(query)) == sorted(x._id for x in scanned.query(query))
+
+
+@pytest.mark.parametrize("value", [None, [1, 2], {"a": 1}])
+def test_unindexable_values_are_scanned(tables, value):
+    _, indexed = tables
+    assert indexed.explain(Field("x") == value)["strategy"] == "scan"
+    assert indexed.explain(Field("x").isin([value, 1]))["strategy"] == "scan"
+
+
+@pytest.mark.parametrize("value", [None, [1, 2], {"a": 1}, 1, "1"])
+def test_get_indexed_matches_scan(tables, value):
+    scanned, indexed = tables
+    assert sorted(x._id for x in indexed.get_indexed("x", value)) == sorted(x._id for x in scanned.query(Field("x") == value))
@@ -0,0 +1,75 @@
+import tasho
+from tasho import Field
+
+
+def _table(tmp_path, **options):
+    database = tasho.Database.new(str(tmp_path / "db"), chunk_size=10)
+    table = database.table.T
+    table.bulk_load((x, {"g": x % 5}) for x in range(100))
+    table.enable_query_cache(**options)
+    return database, table
+
+
+def _keys(documents):
+    return sorted(x.dict["_id"] for x in documents)
+
+
+def test_writes_invalidate_only_their_chunk(tmp_path):
+    database, table = _table(tmp_path)
+    cache = table.query_cache
+    ones = Field("g") == 1
+    assert _keys(table.query(ones)) == list(range(1, 100, 5))
+    assert _keys(table.query(ones)) == list(range(1, 100, 5))
+    assert cache.stats()["hits"] == 1
+    assert cache.chunks_reused == len(table.chunks)
+
+    scanned = cache.chunks_scanned
+    table.insert(1000, {"g": 1})
+    table.update(1, {"$set": {"g": 2}})
+    table.delete(6)
+    expected = [x for x in range(1, 100, 5) if x not in (1, 6)] + [1000]
+    assert _keys(table.query(ones)) == expected
+    stats = cache.stats()
+    assert stats["partial_hits"] == 1
+    # Keys 1 and 6 share a chunk, 1000 went to a new one.
+    assert cache.chunks_scanned - scanned == 2
+
+    table.update(2, {"$set": {"g": 1}})
+    assert _keys(table.query(ones)) == sorted(expected + [2])
+    with table.transaction():
+        table.delete(11)
+    assert _keys(table.query(ones)) == sorted(x for x in expected + [2] if x != 11)
+    database.close()
+
+
+def test_named_queries_are_cached(tmp_path):
+    database, table = _table(tmp_path)
+    cache = table.query_cache
+    table.register_query("ones", lambda key, document: document["g"] == 1)
+    assert len(table.query("ones")) == 20
+    assert len(table.query("ones")) == 20
+    assert cache.stats()["hits"] == 1
+    # Registering again drops the old results.
+    table.register_query("ones", lambda key, document: document["g"] == 1 and key < 50)
+    assert len(table.query("ones")) == 10
+    # Lambdas that weren't registered aren't cached.
+    lookups = cache.hits + cache.partial_hits + cache.misses
+    table.query(lambda key, document: document["g"] == 1)
+    assert cache.hits + cache.partial_hits + cache.misses == lookups
+    database.close()
+
+
+def test_limits(tmp_path):
+    database, table = _table(tmp_path, max_queries=2, max_ids=45)
+    cache = table.query_cache
+    for g in range(3):
+        table.query(Field("g") == g)
+    stats = cache.stats()
+    assert stats["queries"] == 2
+    assert stats["evictions"] == 1
+    # Too many ids to keep.
+    assert len(table.query(Field("g") < 4)) == 80
+    assert cache.stats()["ids"] <= 45
+    assert len(table.query(Field("g") < 4)) == 80
+    assert cache.stats()["hits"] == 0
+    database.close()
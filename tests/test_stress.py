@@ -0,0 +1,126 @@
+"""Hammers one table from many threads and checks nothing got lost.
+
+TASHO_STRESS_THREADS and TASHO_STRESS_SECONDS make the run longer.
+"""
+import os
+import random
+import threading
+import time
+
+import pytest
+
+import tasho
+
+THREADS = int(os.environ.get("TASHO_STRESS_THREADS", 8))
+SECONDS = float(os.environ.get("TASHO_STRESS_SECONDS", 3))
+SHARED = 500
+
+
+def _worker(n, table, own, deadline, errors):
+    rng = random.Random(n)
+    while time.time() < deadline:
+        op = rng.random()
+        if op < 0.35:
+            key = "t{}-{}".format(n, rng.randrange(2000))
+            document = {"group": rng.randrange(10), "writer": n, "payload": os.urandom(16).hex()}
+            table.insert(key, document)
+            own[key] = document
+        elif op < 0.45:
+            if own:
+                key = rng.choice(list(own))
+                table.delete(key)
+                del own[key]
+        elif op < 0.52:
+            if own:
+                key = rng.choice(list(own))
+                group = rng.randrange(10)
+                table.update(key, {"$set": {"group": group}, "$inc": {"updates": 1}})
+                own[key] = dict(own[key], group=group, updates=own[key].get("updates", 0) + 1)
+        elif op < 0.60:
+            table.insert("shared-{}".format(rng.randrange(SHARED)), {"group": rng.randrange(10), "writer": n})
+        elif op < 0.85:
+            if own:
+                key = rng.choice(list(own))
+                if table.raw_get(key) != own[key]:
+                    errors.append("thread {} read a stale {}".format(n, key))
+        elif op < 0.97:
+            group = rng.randrange(10)
+            for document in table.query(tasho.Field("group") == group, limit=50):
+                if document["group"] != group:
+                    errors.append("index returned {} for group {}".format(document._id, group))
+        elif op < 0.975:
+            # A batch of the thread's own keys, applied all at once.
+            batch = {}
+            with table.transaction():
+                for _ in range(5):
+                    key = "t{}-{}".format(n, rng.randrange(2000))
+                    batch[key] = {"group": rng.randrange(10), "writer": n, "payload": "batch"}
+                    table.insert(key, batch[key])
+            own.update(batch)
+        elif op < 0.98:
+            with table.snapshot() as snapshot:
+                first = dict(snapshot.items())
+                if own:
+                    key = rng.choice(list(own))
+                    if snapshot.raw_get(key) != own[key]:
+                        errors.append("snapshot of thread {} misses {}".format(n, key))
+                if dict(snapshot.items()) != first:
+                    errors.append("snapshot changed under thread {}".format(n))
+        elif op < 0.99:
+            table.checkpoint()
+        else:
+            table.compact()
+
+
+def _verify(table, expected, errors):
+    for own in expected:
+        for key, document in own.items():
+            if table.raw_get(key) != document:
+                errors.append("{} lost".format(key))
+    keys = set(table.key_directory)
+    stored = {x for x, _ in table.items()}
+    if keys != stored:
+        errors.append("key directory and chunks disagree on {} keys".format(len(keys ^ stored)))
+    index = table.indexes["group"]
+    for key, document in table.items():
+        if index.keys.get(key) != document["group"]:
+            errors.append("index is stale for {}".format(key))
+            break
+    if len({x.name for x in table.chunks}) != len(table.chunks):
+        errors.append("duplicate chunks")
+
+
+@pytest.mark.parametrize("layout", tasho.LAYOUTS)
+def test_threads(tmp_path, layout):
+    path = str(tmp_path / "db")
+    # Small chunks and a small cache so chunks keep getting created, evicted and reloaded.
+    database = tasho.Database.new(path, chunk_size=256, cache_chunks=4, wal_checkpoint=256 * 1024, layout=layout)
+    table = database.table.Stress
+    table.create_index("group")
+    for i in range(SHARED):
+        table.insert("shared-{}".format(i), {"group": 0, "writer": None})
+
+    errors = []
+    expected = [{} for _ in range(THREADS)]
+    deadline = time.time() + SECONDS
+
+    def run(n):
+        try:
+            _worker(n, table, expected[n], deadline, errors)
+        except Exception as e:
+            errors.append("thread {} failed: {!r}".format(n, e))
+
+    threads = [threading.Thread(target=run, args=(x,)) for x in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    _verify(table, expected, errors)
+    database.flush()
+    table.checkpoint()
+    reopened = tasho.Database.open(path)
+    _verify(reopened.table.Stress, expected, errors)
+    reopened.close()
+    database.close()
+    assert not errors, errors[:20]
@@ -0,0 +1,74 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import tasho
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _run(code):
+    env = dict(os.environ, PYTHONPATH=ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    subprocess.run([sys.executable, "-c", code], check=True, env=env, capture_output=True)
+
+
+def test_failed_transaction_leaves_nothing_on_disk(tmp_path):
+    path = str(tmp_path / "db")
+    database = tasho.Database.new(path, chunk_size=2, wal_checkpoint=1)
+    table = database.table.T
+    table.insert(0, {"g": "before"})
+    database.close()
+
+    # A new chunk is needed halfway through, the batch then fails on a value the log can't store.
+    _run("""
+import os, tasho
+database = tasho.Database.open({path!r})
+table = database.table.T
+table.auto_commit = False
+table.insert(1, {{"g": "uncommitted"}})
+chunks = len(table.chunks)
+try:
+    with table.transaction():
+        table.insert(0, {{"g": "PARTIAL"}})
+        table.insert(50, {{"g": 50}})
+        table.insert(51, {{"g": object()}})
+except ValueError:
+    pass
+assert table.raw_get(0) == {{"g": "before"}} and table.raw_get(50) is None
+assert len(table.chunks) == chunks, (len(table.chunks), chunks)
+os._exit(0)
+""".format(path=path))
+
+    database = tasho.Database.open(path)
+    table = database.table.T
+    assert table.raw_get(0) == {"g": "before"}
+    assert table.raw_get(50) is None
+    assert table.raw_get(51) is None
+    database.close()
+
+
+@pytest.mark.parametrize("layout", tasho.LAYOUTS)
+def test_transaction_survives_crash(tmp_path, layout):
+    path = str(tmp_path / "db")
+    database = tasho.Database.new(path, chunk_size=2, wal_checkpoint=1, layout=layout)
+    database.table.T.insert(0, {"g": 0})
+    database.close()
+
+    _run("""
+import os, tasho
+database = tasho.Database.open({path!r})
+table = database.table.T
+with table.transaction():
+    table.insert(0, {{"g": "changed"}})
+    for key in range(50, 60):
+        table.insert(key, {{"g": key}})
+os._exit(0)
+""".format(path=path))
+
+    database = tasho.Database.open(path)
+    table = database.table.T
+    assert table.raw_get(0) == {"g": "changed"}
+    assert all(table.raw_get(x) == {"g": x} for x in range(50, 60))
+    database.close()
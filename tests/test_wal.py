@@ -0,0 +1,71 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import tasho
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.mark.parametrize("layout", tasho.LAYOUTS)
+def test_unloggable_insert_changes_nothing(tmp_path, layout):
+    database = tasho.Database.new(str(tmp_path / "db"), layout=layout)
+    table = database.table.T
+    table.create_index("a")
+    table.insert(1, {"a": 1})
+    for key in (1, 2):
+        with pytest.raises(ValueError):
+            table.insert(key, {"a": object()})
+    assert table.raw_get(1) == {"a": 1}
+    assert table.get(2) is None
+    assert 2 not in table.key_directory
+    assert table.indexes["a"].keys == {1: 1}
+    # Nothing unloggable was left behind for the checkpoint to trip over.
+    table.checkpoint()
+    database.close()
+    database = tasho.Database.open(str(tmp_path / "db"))
+    assert dict(database.table.T.items()) == {1: {"a": 1}}
+    database.close()
+
+
+@pytest.mark.parametrize("layout", tasho.LAYOUTS)
+def test_replay_after_crash(tmp_path, layout):
+    path = str(tmp_path / "db")
+    # Commits changes to the log, then dies without checkpointing them.
+    code = """
+import os, tasho
+database = tasho.Database.new({path!r}, chunk_size=10, layout={layout!r})
+table = database.table.T
+table.create_index("n")
+table.bulk_load((x, {{"n": x}}) for x in range(100))
+for x in range(100, 150):
+    table.insert(x, {{"n": x}})
+for x in range(10):
+    table.update(x, {{"$inc": {{"n": 1000}}}})
+for x in range(10, 20):
+    table.delete(x)
+database.flush()
+os._exit(0)
+""".format(path=path, layout=layout)
+    env = dict(os.environ, PYTHONPATH=ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    subprocess.run([sys.executable, "-c", code], check=True, env=env, capture_output=True)
+    log = os.path.join(path, "T.wal")
+    assert os.path.getsize(log)
+    # A record the crash cut short.
+    with open(log, "ab") as f:
+        f.write(b"\x40\x00\x00\x00torn")
+
+    database = tasho.Database.open(path)
+    table = database.table.T
+    expected = {x: {"n": x + 1000 if x < 10 else x} for x in range(150) if not 10 <= x < 20}
+    assert dict(table.items()) == expected
+    assert {x: table.raw_get(x) for x in expected} == expected
+    assert table.indexes["n"].keys == {x: document["n"] for x, document in expected.items()}
+    table.insert(150, {"n": 150})
+    database.close()
+
+    database = tasho.Database.open(path)
+    assert len(dict(database.table.T.items())) == len(expected) + 1
+    database.close()